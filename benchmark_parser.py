@@ -0,0 +1,225 @@
+import argparse
+import glob
+import gzip
+import json
+import os
+import platform
+import re
+import time
+import tracemalloc
+from datetime import datetime
+
+try:
+    import resource  # Indisponible sous Windows
+except ImportError:
+    resource = None
+
+import scrapy
+from parsel import Selector
+from scrapy.http import HtmlResponse, Request
+
+import spiders
+from utils.debug_color import debug_print, setup_logging
+from utils.kbo_selectors import compiled_xpaths
+
+KBO_URL = 'https://kbopub.economie.fgov.be/kbopub/toonondernemingps.html?ondernemingsnummer={numero}&lang=fr'
+DEFAULT_CORPUS = ['debug_pages/debug_page_*.html*', 'debug_page_*.html*']
+DEFAULT_RESULTS_DIR = 'bench_results'
+
+
+def load_corpus(patterns):
+    """Charger les pages enregistrées (.html ou .html.gz) : liste de (numero, corps)"""
+    pages = []
+    paths = sorted({path for pattern in patterns for path in glob.glob(pattern)})
+    for path in paths:
+        opener = gzip.open if path.endswith('.gz') else open
+        with opener(path, 'rb') as f:
+            body = f.read()
+        match = re.search(r'(\d{10})', os.path.basename(path))
+        numero = match.group(1) if match else os.path.basename(path)
+        pages.append((numero, body))
+    return pages
+
+
+def build_response(numero, body):
+    request = Request(KBO_URL.format(numero=numero), meta={'numero_entreprise': numero})
+    return HtmlResponse(url=request.url, body=body, encoding='utf-8', request=request)
+
+
+def instrument_extractors(spider, timings):
+    """Remplacer chaque extract_* de l'instance par une version chronométrée"""
+    for name in dir(spider):
+        if not name.startswith('extract_'):
+            continue
+        method = getattr(spider, name)
+        timings[name] = 0.0
+
+        def timed(*args, _method=method, _name=name, **kwargs):
+            started = time.perf_counter()
+            try:
+                return _method(*args, **kwargs)
+            finally:
+                timings[_name] += time.perf_counter() - started
+
+        setattr(spider, name, timed)
+
+
+def run_pass(spider, pages):
+    items = 0
+    for numero, body in pages:
+        # La réponse est reconstruite à chaque passe : le parsing HTML fait partie du coût mesuré
+        for _ in spider.parse(build_response(numero, body)):
+            items += 1
+    return items
+
+
+def run_benchmark(pages, repeat):
+    # Hors crawler, l'échantillonnage des diagnostics de structure reste désactivé
+    spider = spiders.KboSpider()
+
+    # Passe de chauffe, puis mesure de la mémoire maximale sur une passe dédiée (tracemalloc ralentit)
+    run_pass(spider, pages)
+    tracemalloc.start()
+    run_pass(spider, pages)
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    timings = {}
+    instrument_extractors(spider, timings)
+    items = 0
+    started = time.perf_counter()
+    for _ in range(repeat):
+        items += run_pass(spider, pages)
+    elapsed = time.perf_counter() - started
+
+    total_pages = len(pages) * repeat
+    return {
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'scrapy': scrapy.__version__,
+        'corpus_pages': len(pages),
+        'corpus_bytes': sum(len(body) for _, body in pages),
+        'repeat': repeat,
+        'pages': total_pages,
+        'items': items,
+        'seconds': round(elapsed, 4),
+        'pages_per_sec': round(total_pages / elapsed, 2) if elapsed else None,
+        # tracemalloc ne voit que les allocations Python (pas les arbres lxml) : garder aussi le RSS max
+        'peak_memory_bytes': peak_memory,
+        'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss if resource else None,
+        'extractors_ms_per_page': {
+            name: round(total * 1000 / total_pages, 4) for name, total in sorted(timings.items())
+        },
+    }
+
+
+def run_selector_benchmark(pages, repeat):
+    """Chaque expression de utils/kbo_selectors.py évaluée sur toutes les lignes <tr> du corpus :
+    XPath compilé sur l'élément lxml contre Selector.xpath() de parsel (chemin des extracteurs d'avant).
+
+    Les sélecteurs parsel sont construits hors mesure : l'écart mesuré est un minimum.
+    """
+    rows = [row for numero, body in pages for row in build_response(numero, body).selector.root.iter('tr')]
+    selectors = [Selector(root=row, type='html') for row in rows]
+    timings = {}
+    for name, xpath in sorted(compiled_xpaths().items()):
+        # Mêmes résultats dans les deux cas (éléments ou textes), sinon la comparaison n'a pas de sens
+        for row, selector in zip(rows, selectors):
+            if [result.root for result in selector.xpath(xpath.path)] != xpath(row):
+                raise AssertionError(f"{name} : résultats différents de parsel")
+
+        started = time.perf_counter()
+        for _ in range(repeat):
+            for row in rows:
+                xpath(row)
+        compiled = time.perf_counter() - started
+
+        started = time.perf_counter()
+        for _ in range(repeat):
+            for selector in selectors:
+                selector.xpath(xpath.path).getall()
+        parsel = time.perf_counter() - started
+
+        evaluations = len(rows) * repeat
+        timings[name] = {
+            'lxml_us': round(compiled * 1e6 / evaluations, 3),
+            'parsel_us': round(parsel * 1e6 / evaluations, 3),
+            'speedup': round(parsel / compiled, 2) if compiled else None,
+        }
+    return {'rows': len(rows), 'evaluations_per_expression': len(rows) * repeat, 'expressions': timings}
+
+
+def print_results(results, previous=None):
+    debug_print(f"{results['pages']} pages ({results['corpus_pages']} fichiers x {results['repeat']}) "
+                f"en {results['seconds']}s", "info")
+
+    def delta(new, old, higher_is_better):
+        if not old:
+            return ''
+        change = (new - old) / old * 100
+        if change == 0:
+            return ''
+        better = change > 0 if higher_is_better else change < 0
+        return f" ({'+' if change >= 0 else ''}{change:.1f}% {'mieux' if better else 'moins bien'})"
+
+    old = previous or {}
+    debug_print(f"Pages/s : {results['pages_per_sec']}{delta(results['pages_per_sec'], old.get('pages_per_sec'), True)}", "success")
+    debug_print(f"Mémoire Python max : {results['peak_memory_bytes'] / 1024:.0f} Ko"
+                f"{delta(results['peak_memory_bytes'], old.get('peak_memory_bytes'), False)}", "info")
+    if results.get('max_rss_kb'):
+        debug_print(f"RSS max du processus : {results['max_rss_kb']} Ko", "info")
+    old_extractors = old.get('extractors_ms_per_page', {})
+    for name, value in results['extractors_ms_per_page'].items():
+        debug_print(f"  {name:<40} {value:>8.3f} ms/page{delta(value, old_extractors.get(name), False)}", "info")
+    if results.get('selectors'):
+        debug_print(f"XPath compilés (lxml) contre parsel, par évaluation sur {results['selectors']['rows']} lignes :", "info")
+        for name, timing in results['selectors']['expressions'].items():
+            debug_print(f"  {name:<40} {timing['lxml_us']:>8.3f} µs contre {timing['parsel_us']:>8.3f} µs (x{timing['speedup']})", "info")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mesurer KboSpider.parse hors ligne sur des pages KBO enregistrées.")
+    parser.add_argument('--corpus', '-c', nargs='+', default=DEFAULT_CORPUS,
+                        help=f"Motifs glob des pages à rejouer (défaut: {' '.join(DEFAULT_CORPUS)})")
+    parser.add_argument('--repeat', '-r', type=int, default=20,
+                        help='Nombre de passes sur le corpus (défaut: 20)')
+    parser.add_argument('--output', '-o', type=str, default=None,
+                        help=f"Fichier JSON des résultats (défaut: {DEFAULT_RESULTS_DIR}/parser_<date>.json)")
+    parser.add_argument('--compare', type=str, default=None,
+                        help='Fichier JSON d\'une exécution précédente à comparer')
+    parser.add_argument('--selectors', action='store_true',
+                        help='Comparer aussi chaque XPath compilé de utils/kbo_selectors.py avec parsel')
+    parser.add_argument('--verbose', '-v', action='store_true',
+                        help='Afficher les messages de debug du spider (les mesures incluent alors leur coût)')
+    args = parser.parse_args()
+
+    pages = load_corpus(args.corpus)
+    if not pages:
+        debug_print(f"Aucune page trouvée pour {args.corpus}", "error")
+        return
+
+    debug_print(f"Benchmark de KboSpider.parse sur {len(pages)} pages...", "info")
+    # Les messages de debug du spider fausseraient les mesures et noieraient le résultat
+    setup_logging('debug' if args.verbose else 'warning')
+    results = run_benchmark(pages, args.repeat)
+    if args.selectors:
+        results['selectors'] = run_selector_benchmark(pages, args.repeat)
+    setup_logging('info')
+
+    previous = None
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            previous = json.load(f)
+    print_results(results, previous)
+
+    output = args.output
+    if output is None:
+        os.makedirs(DEFAULT_RESULTS_DIR, exist_ok=True)
+        output = os.path.join(DEFAULT_RESULTS_DIR, f"parser_{datetime.now():%Y%m%d_%H%M%S}.json")
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2, ensure_ascii=False)
+    debug_print(f"Résultats enregistrés dans {output}", "success")
+
+
+if __name__ == "__main__":
+    main()
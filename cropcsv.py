@@ -1,65 +1,297 @@
+import argparse
 import csv
+import heapq
+import multiprocessing
 import os
-import argparse
+import random
+import shutil
+import tempfile
+import time
+
 from utils.debug_color import debug_print
+from utils.enterprise_source import shard_of
+
+MODES = ('head', 'sample', 'filter', 'shard')
+# En dessous de cette taille par morceau, le fichier est lu dans ce processus
+MIN_CHUNK_BYTES = 32 * 1024 ** 2
+# Colonnes filtrables du dump open data et option correspondante
+FILTER_COLUMNS = {
+    'status': 'Status',
+    'juridical_form': 'JuridicalForm',
+    'type_of_enterprise': 'TypeOfEnterprise',
+}
+# Taille des blocs de lignes lus puis analysés d'un coup par le module csv
+BLOCK_BYTES = 4 * 1024 ** 2
+
+
+def parse_row(line):
+    """Ligne brute (bytes) → liste des valeurs, guillemets retirés"""
+    return next(csv.reader((line.decode('utf-8'),)), [])
+
+
+def build_filters(header, wanted):
+    """Options --status/--juridical-form/--type-of-enterprise → [(index, valeurs)] d'après l'en-tête"""
+    columns = [column.strip('"').lstrip('\ufeff') for column in parse_row(header)]
+    filters = []
+    for column, values in wanted.items():
+        if column not in columns:
+            raise ValueError(f"Colonne {column} absente de l'en-tête")
+        filters.append((columns.index(column), set(values)))
+    return filters
+
+
+def row_matches(row, filters):
+    """Ligne analysée acceptée par tous les filtres [(index, valeurs)]"""
+    for index, values in filters:
+        if index >= len(row) or row[index] not in values:
+            return False
+    return True
+
+
+def iter_blocks(path, start, end):
+    """Blocs de lignes complètes entre start et end (readlines ne coupe jamais une ligne)"""
+    with open(path, 'rb') as f:
+        f.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            lines = f.readlines(min(BLOCK_BYTES, remaining))
+            if not lines:
+                break
+            remaining -= sum(map(len, lines))
+            if not lines[-1].endswith(b'\n'):
+                lines[-1] += b'\n'
+            yield lines
+
+
+def iter_matching(path, start, end, filters):
+    """Lignes brutes retenues par les filtres ; chaque bloc est analysé en une passe du module csv"""
+    for lines in iter_blocks(path, start, end):
+        if not filters:
+            yield from (line for line in lines if line.strip())
+            continue
+        # Une chaîne par ligne brute : str.splitlines couperait aussi sur \x0b, \x0c, \u2028...
+        rows = csv.reader([line.decode('utf-8') for line in lines])
+        for line, row in zip(lines, rows):
+            if row and row_matches(row, filters):
+                yield line
+
+
+def split_ranges(path, parts):
+    """Découper les données (en-tête exclu) en plages d'octets commençant chacune en début de ligne.
+
+    Les lignes ne sont pas comptées : on se place à la position visée puis on avance à la
+    ligne suivante. Suppose qu'aucun champ ne contient de retour à la ligne (vrai pour le
+    dump open data de la BCE).
+    """
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        f.readline()
+        bounds = [f.tell()]
+        for i in range(1, parts):
+            target = bounds[0] + (size - bounds[0]) * i // parts
+            if target <= bounds[-1]:
+                continue
+            f.seek(target - 1)
+            f.readline()
+            if bounds[-1] < f.tell() < size:
+                bounds.append(f.tell())
+        bounds.append(size)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def scan_range(task):
+    """Traiter une plage d'octets (exécuté dans un worker) selon le mode"""
+    mode, path, start, end, filters, options, workdir, index = task
+    total = 0
+    if mode == 'sample':
+        # Échantillon par clés aléatoires : les k plus petites clés de chaque morceau,
+        # fusionnables en gardant les k plus petites de l'ensemble
+        rng = random.Random(None if options['seed'] is None else options['seed'] + index)
+        heap = []
+        rows = options['rows']
+        for position, line in enumerate(iter_matching(path, start, end, filters)):
+            total += 1
+            key = rng.random()
+            if len(heap) < rows:
+                heapq.heappush(heap, (-key, position, line))
+            elif -key > heap[0][0]:
+                heapq.heapreplace(heap, (-key, position, line))
+        return index, total, [(-key, position, line) for key, position, line in heap]
+
+    if mode == 'shard':
+        shards = options['shards']
+        outputs = [open(os.path.join(workdir, f"{index:05d}.{shard}"), 'wb') for shard in range(shards)]
+        counts = [0] * shards
+        try:
+            for line in iter_matching(path, start, end, filters):
+                total += 1
+                # Même répartition que --shard-index/--shard-count de main.py
+                shard = shard_of(line.split(b',', 1)[0].decode('ascii', 'ignore'), shards)
+                outputs[shard].write(line)
+                counts[shard] += 1
+        finally:
+            for output in outputs:
+                output.close()
+        return index, total, counts
 
-def crop_csv(input_file, output_file, max_rows):
+    # filter
+    with open(os.path.join(workdir, f"{index:05d}"), 'wb') as output:
+        for line in iter_matching(path, start, end, filters):
+            total += 1
+            output.write(line)
+    return index, total, None
+
+
+def run_chunks(mode, input_file, filters, options, workdir, workers):
+    """Répartir le fichier en plages et les traiter en parallèle ; résultats dans l'ordre du fichier"""
+    size = os.path.getsize(input_file)
+    parts = max(1, min(workers * 4, size // MIN_CHUNK_BYTES))
+    tasks = [(mode, input_file, start, end, filters, options, workdir, index)
+             for index, (start, end) in enumerate(split_ranges(input_file, parts))]
+    if len(tasks) == 1 or workers <= 1:
+        return [scan_range(task) for task in tasks]
+    debug_print(f"{len(tasks)} morceaux répartis sur {workers} processus", "debug")
+    with multiprocessing.get_context('spawn').Pool(workers) as pool:
+        return sorted(pool.imap_unordered(scan_range, tasks))
+
+
+def concat(header, parts, output_file):
+    with open(output_file, 'wb') as output:
+        output.write(header)
+        for part in parts:
+            with open(part, 'rb') as f:
+                shutil.copyfileobj(f, output, 1024 ** 2)
+
+
+def head_csv(input_file, output_file, max_rows, filters):
+    """Les max_rows premières lignes (en-tête compris) : lecture arrêtée dès qu'elles sont écrites.
+
+    Renvoie (lignes écrites, fin du fichier atteinte).
+    """
+    written = 1
+    with open(input_file, 'rb') as f_in, open(output_file, 'wb') as f_out:
+        header = f_in.readline()
+        f_out.write(header)
+        for line in iter_matching(input_file, f_in.tell(), os.path.getsize(input_file), filters):
+            if written >= max_rows:
+                return written, False
+            f_out.write(line)
+            written += 1
+    return written, True
+
+
+def crop_csv(input_file, output_file, max_rows=None, mode='head', filters=None, shards=None,
+             seed=None, workers=None):
+    """Préparer un fichier d'entrée à partir du CSV des entreprises, en une seule lecture.
+
+    head : max_rows premières lignes (en-tête compris) ; sample : max_rows lignes tirées au hasard ;
+    filter : toutes les lignes correspondant aux filtres ; shard : un fichier par shard
+    (<sortie>_shard<i>of<N>.csv). Les filtres {colonne: valeurs} s'appliquent dans tous les modes.
+    """
     try:
         # Vérifier si le fichier d'entrée existe
         if not os.path.exists(input_file):
             debug_print(f"Le fichier {input_file} n'existe pas!", "error")
             return False
-        
-        # Compter le nombre total de lignes dans le fichier d'entrée
-        with open(input_file, 'r', newline='', encoding='utf-8') as f:
-            total_rows = sum(1 for _ in f)
-        
-        if max_rows >= total_rows:
-            debug_print(f"Le fichier contient déjà {total_rows} lignes, ce qui est inférieur ou égal à {max_rows}.", "info")
-            debug_print(f"Le fichier ne sera pas modifié.", "info")
-            return False
-        
-        # Ouvrir le fichier d'entrée et créer le fichier de sortie
-        with open(input_file, 'r', newline='', encoding='utf-8') as f_in, \
-             open(output_file, 'w', newline='', encoding='utf-8') as f_out:
-            
-            reader = csv.reader(f_in)
-            writer = csv.writer(f_out)
-            
-            # Copier les max_rows premières lignes
-            for i, row in enumerate(reader):
-                if i < max_rows:
-                    writer.writerow(row)
-                else:
-                    break
-        
-        debug_print(f"Fichier réduit créé avec succès: {output_file}", "success")
-        debug_print(f"Nombre de lignes réduites de {total_rows} à {max_rows}", "info")
+
+        started = time.monotonic()
+        with open(input_file, 'rb') as f:
+            header = f.readline()
+        filters = build_filters(header, filters or {})
+        workers = workers or os.cpu_count() or 1
+
+        if mode == 'head':
+            # Écriture dans un .part à côté de la sortie : une sortie existante n'est remplacée qu'une fois le fichier complet
+            part_file = f"{output_file}.part"
+            try:
+                written, complete = head_csv(input_file, part_file, max_rows, filters)
+                if complete and not filters:
+                    debug_print(f"Le fichier contient déjà {written} lignes, ce qui est inférieur ou égal à {max_rows}.", "info")
+                    debug_print("Le fichier ne sera pas modifié.", "info")
+                    return False
+                os.replace(part_file, output_file)
+            finally:
+                if os.path.exists(part_file):
+                    os.remove(part_file)
+            debug_print(f"Fichier réduit créé avec succès: {output_file} ({written} lignes)", "success")
+            return True
+
+        # Fichiers intermédiaires à côté de la sortie : concaténation sur le même disque
+        workdir = tempfile.mkdtemp(prefix='cropcsv-', dir=os.path.dirname(os.path.abspath(output_file)))
+        try:
+            options = {'rows': (max_rows or 1) - 1, 'shards': shards, 'seed': seed}
+            results = run_chunks(mode, input_file, filters, options, workdir, workers)
+            total = sum(result[1] for result in results)
+
+            if mode == 'sample':
+                candidates = [(key, index, position, line) for index, _, sample in results
+                              for key, position, line in sample]
+                # Les k plus petites clés, remises dans l'ordre du fichier
+                kept = sorted(heapq.nsmallest(options['rows'], candidates), key=lambda c: (c[1], c[2]))
+                with open(output_file, 'wb') as output:
+                    output.write(header)
+                    output.writelines(line for _, _, _, line in kept)
+                debug_print(f"Échantillon de {len(kept)} lignes sur {total} écrit dans {output_file}", "success")
+            elif mode == 'shard':
+                base, ext = os.path.splitext(output_file)
+                for shard in range(shards):
+                    path = f"{base}_shard{shard}of{shards}{ext}"
+                    concat(header, [os.path.join(workdir, f"{index:05d}.{shard}") for index, _, _ in results], path)
+                    debug_print(f"Shard {shard}/{shards}: {sum(r[2][shard] for r in results)} lignes dans {path}", "info")
+                debug_print(f"{total} lignes réparties en {shards} shards", "success")
+            else:
+                concat(header, [os.path.join(workdir, f"{index:05d}") for index, _, _ in results], output_file)
+                debug_print(f"{total} lignes retenues écrites dans {output_file}", "success")
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+        debug_print(f"Terminé en {time.monotonic() - started:.1f}s", "info")
         return True
-    
+
     except Exception as e:
         debug_print(f"Erreur lors de la réduction du fichier: {e}", "error")
         return False
 
 def main():
     # Configurer l'analyse des arguments de ligne de commande
-    parser = argparse.ArgumentParser(description='Réduire un fichier CSV à un nombre spécifique de lignes.')
+    parser = argparse.ArgumentParser(description="Préparer un fichier d'entrée à partir du CSV des entreprises (tête, échantillon, filtre ou shards).")
     parser.add_argument('--input', '-i', type=str, default='enterprise.csv',
                         help='Fichier CSV d\'entrée (défaut: enterprise.csv)')
     parser.add_argument('--output', '-o', type=str, default=None,
                         help='Fichier CSV de sortie (défaut: enterprise_cropped.csv)')
-    parser.add_argument('--rows', '-r', type=int, required=True,
-                        help='Nombre maximum de lignes à conserver')
+    parser.add_argument('--mode', '-m', type=str, default='head', choices=MODES,
+                        help='head : premières lignes ; sample : lignes au hasard ; filter : lignes filtrées ; shard : un fichier par shard (défaut: head)')
+    parser.add_argument('--rows', '-r', type=int, default=None,
+                        help='Nombre maximum de lignes à conserver, en-tête compris (head, sample)')
+    parser.add_argument('--shards', type=int, default=None,
+                        help='Nombre de fichiers à produire (shard), même répartition que --shard-count de main.py')
+    parser.add_argument('--status', type=str, default=None,
+                        help='Garder seulement ces statuts, séparés par des virgules (ex. AC)')
+    parser.add_argument('--juridical-form', type=str, default=None,
+                        help='Garder seulement ces formes juridiques (codes, ex. 014,610)')
+    parser.add_argument('--type-of-enterprise', type=str, default=None,
+                        help='Garder seulement ces types (1 : personne physique, 2 : personne morale)')
+    parser.add_argument('--seed', type=int, default=None,
+                        help='Graine du tirage aléatoire (sample), pour un échantillon reproductible')
+    parser.add_argument('--workers', '-w', type=int, default=os.cpu_count() or 1,
+                        help='Nombre de processus pour les gros fichiers (défaut: nombre de cœurs)')
 
     args = parser.parse_args()
-    
+    if args.mode in ('head', 'sample') and not args.rows:
+        parser.error(f"--rows est requis en mode {args.mode}")
+    if args.mode == 'shard' and not args.shards:
+        parser.error("--shards est requis en mode shard")
+
     # Définir le fichier de sortie si non spécifié
     if args.output is None:
         base_name, ext = os.path.splitext(args.input)
         args.output = f"{base_name}_cropped{ext}"
-    
-    debug_print(f"Réduction du fichier {args.input} à {args.rows} lignes...", "info")
-    crop_csv(args.input, args.output, args.rows)
+
+    filters = {column: getattr(args, option).split(',')
+               for option, column in FILTER_COLUMNS.items() if getattr(args, option)}
+
+    debug_print(f"Préparation de {args.input} (mode {args.mode})...", "info")
+    crop_csv(args.input, args.output, args.rows, args.mode, filters, args.shards, args.seed, args.workers)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
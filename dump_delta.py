@@ -0,0 +1,134 @@
+import argparse
+import csv
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+
+from utils.debug_color import debug_print
+from utils.enterprise_source import clean_numero, shard_of
+
+DEFAULT_OUTPUT_PREFIX = 'delta'
+# Nombre de partitions par défaut : chaque partition de l'ancien dump tient en mémoire
+DEFAULT_PARTITIONS = 16
+# Fichiers produits, <préfixe>_<nom>.csv ; to_crawl regroupe added et changed
+OUTPUTS = ('added', 'removed', 'changed', 'to_crawl')
+# Taille des blocs de lignes lus puis analysés d'un coup par le module csv
+BLOCK_BYTES = 4 * 1024 ** 2
+
+
+def partition_file(path, workdir, name, partitions):
+    """Répartir les lignes brutes d'un dump entre partitions selon le numéro ; renvoie l'en-tête"""
+    outputs = [open(os.path.join(workdir, f"{name}.{index:04d}"), 'wb') for index in range(partitions)]
+    try:
+        with open(path, 'rb') as f:
+            header = f.readline()
+            for line in f:
+                numero = clean_numero(line.split(b',', 1)[0].decode('ascii', 'ignore'))
+                if not numero:
+                    continue
+                outputs[shard_of(numero, partitions)].write(line if line.endswith(b'\n') else line + b'\n')
+    finally:
+        for output in outputs:
+            output.close()
+    return header
+
+
+def iter_partition(path):
+    """(numéro, empreinte des valeurs, ligne brute) pour chaque ligne d'une partition.
+
+    L'empreinte porte sur les valeurs analysées : un changement de guillemets d'un dump
+    à l'autre n'est pas un changement. La partition est lue par blocs : seule la partition
+    de l'ancien dump est gardée en mémoire, par compare_partition.
+    """
+    with open(path, 'rb') as f:
+        while True:
+            lines = f.readlines(BLOCK_BYTES)
+            if not lines:
+                break
+            # Une chaîne par ligne brute : str.splitlines couperait aussi sur \x0b, \x0c, \u2028...
+            rows = csv.reader([line.decode('utf-8') for line in lines])
+            for line, row in zip(lines, rows):
+                digest = hashlib.blake2b('\x1f'.join(row).encode('utf-8'), digest_size=16).digest()
+                yield clean_numero(row[0]), digest, line
+
+
+def compare_partition(old_path, new_path, outputs, counts):
+    """Comparer une partition : seul l'ancien dump de la partition est chargé en mémoire"""
+    old = {numero: (digest, line) for numero, digest, line in iter_partition(old_path)}
+    for numero, digest, line in iter_partition(new_path):
+        previous = old.pop(numero, None)
+        if previous is None:
+            kind = 'added'
+        elif previous[0] != digest:
+            kind = 'changed'
+        else:
+            continue
+        outputs[kind].write(line)
+        outputs['to_crawl'].write(line)
+        counts[kind] += 1
+    # Restés dans l'ancien dump seulement : radiées ou disparues du dump
+    for _, line in old.values():
+        outputs['removed'].write(line)
+        counts['removed'] += 1
+
+
+def diff_dumps(old_file, new_file, output_prefix=DEFAULT_OUTPUT_PREFIX, partitions=DEFAULT_PARTITIONS):
+    """Comparer deux versions du CSV des entreprises par partition de hachage sur EnterpriseNumber.
+
+    Produit <préfixe>_added.csv, _removed.csv, _changed.csv et _to_crawl.csv (added + changed),
+    lignes d'origine et même en-tête que le dump : directement utilisables avec --input.
+    """
+    started = time.monotonic()
+    directory = os.path.dirname(os.path.abspath(output_prefix))
+    os.makedirs(directory, exist_ok=True)
+    workdir = tempfile.mkdtemp(prefix='dump-delta-', dir=directory)
+    try:
+        old_header = partition_file(old_file, workdir, 'old', partitions)
+        new_header = partition_file(new_file, workdir, 'new', partitions)
+        if old_header.strip() != new_header.strip():
+            debug_print("Les en-têtes des deux dumps diffèrent : toutes les lignes risquent d'être vues comme modifiées", "warning")
+        debug_print(f"Dumps répartis en {partitions} partitions en {time.monotonic() - started:.1f}s", "info")
+
+        outputs = {kind: open(f"{output_prefix}_{kind}.csv", 'wb') for kind in OUTPUTS}
+        counts = dict.fromkeys(OUTPUTS[:3], 0)
+        try:
+            for output in outputs.values():
+                output.write(new_header)
+            for index in range(partitions):
+                compare_partition(os.path.join(workdir, f"old.{index:04d}"),
+                                  os.path.join(workdir, f"new.{index:04d}"), outputs, counts)
+        finally:
+            for output in outputs.values():
+                output.close()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    debug_print(f"Delta calculé en {time.monotonic() - started:.1f}s : {counts['added']} ajoutées, "
+                f"{counts['removed']} supprimées, {counts['changed']} modifiées", "success")
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Comparer deux dumps open data des entreprises et lister les numéros à recrawler.")
+    parser.add_argument('--old', type=str, required=True,
+                        help='CSV des entreprises du dump précédent')
+    parser.add_argument('--new', type=str, required=True,
+                        help='CSV des entreprises du nouveau dump')
+    parser.add_argument('--output-prefix', '-o', type=str, default=DEFAULT_OUTPUT_PREFIX,
+                        help=f"Préfixe des fichiers produits (<préfixe>_added.csv, _removed.csv, _changed.csv, _to_crawl.csv ; défaut: {DEFAULT_OUTPUT_PREFIX})")
+    parser.add_argument('--partitions', '-p', type=int, default=DEFAULT_PARTITIONS,
+                        help=f"Nombre de partitions : la mémoire utilisée est environ la taille de l'ancien dump divisée par ce nombre (défaut: {DEFAULT_PARTITIONS})")
+    args = parser.parse_args()
+
+    for path in (args.old, args.new):
+        if not os.path.exists(path):
+            debug_print(f"Le fichier {path} n'existe pas!", "error")
+            return
+    diff_dumps(args.old, args.new, args.output_prefix, args.partitions)
+    debug_print(f"Recrawler les changements : python main.py --input {args.output_prefix}_to_crawl.csv", "info")
+
+
+if __name__ == "__main__":
+    main()
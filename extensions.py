@@ -0,0 +1,290 @@
+import json
+import os
+import time
+from datetime import datetime
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from scrapy.http import TextResponse
+from twisted.internet import task
+
+from spiders import CombinedSpider, KboSpider
+from utils.archive import ArchiveWriter
+from utils.debug_color import get_logger
+
+logger = get_logger('extensions')
+
+# Réponses signalant une surcharge ou un bannissement imminent
+BACKOFF_STATUSES = (429, 503)
+# Délai minimal appliqué après un 429/503 quand le plancher du domaine est à 0
+BACKOFF_MIN_DELAY = 0.25
+
+
+class StatsJsonlDump:
+    """Écrire périodiquement les stats du crawler dans un fichier JSON lines.
+
+    Chaque ligne contient les compteurs Scrapy et ipssi/* bruts, plus les débits
+    (pages/s, items/s) calculés sur le dernier intervalle.
+    """
+
+    def __init__(self, crawler, path, interval):
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.path = path
+        self.interval = interval
+        self.loop = None
+        self.file = None
+        self.started = None
+        self.last_time = None
+        self.last_counts = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        path = crawler.settings.get('STATS_JSONL_FILE')
+        interval = crawler.settings.getfloat('STATS_JSONL_INTERVAL', 30)
+        if not path or interval <= 0:
+            raise NotConfigured
+        extension = cls(crawler, path, interval)
+        crawler.signals.connect(extension.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(extension.spider_closed, signal=signals.spider_closed)
+        return extension
+
+    def spider_opened(self, spider):
+        path = self.path % {'name': spider.name}
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.file = open(path, 'a', encoding='utf-8')
+        self.started = self.last_time = time.monotonic()
+        self.loop = task.LoopingCall(self.dump, spider)
+        self.loop.start(self.interval, now=False)
+
+    def spider_closed(self, spider, reason):
+        if self.loop is not None and self.loop.running:
+            self.loop.stop()
+        if self.file is not None:
+            self.dump(spider, final=True)
+            self.file.close()
+
+    def rate(self, key, now):
+        """Débit d'un compteur depuis le dernier export"""
+        value = self.stats.get_value(key, 0)
+        previous = self.last_counts.get(key, 0)
+        self.last_counts[key] = value
+        elapsed = now - self.last_time
+        return round((value - previous) / elapsed, 2) if elapsed > 0 else None
+
+    def dump(self, spider, final=False):
+        now = time.monotonic()
+        record = {
+            'time': datetime.now().isoformat(timespec='seconds'),
+            'spider': spider.name,
+            'final': final,
+            'elapsed': round(now - self.started, 1),
+            'responses_per_sec': self.rate('response_received_count', now),
+            'items_per_sec': self.rate('item_scraped_count', now),
+            'bytes_per_sec': self.rate('downloader/response_bytes', now),
+            'stats': self.stats.get_stats(),
+        }
+        self.last_time = now
+        self.file.write(json.dumps(record, default=str, ensure_ascii=False) + '\n')
+        self.file.flush()
+        logger.info("[%s] %s pages, %s pages/s, %s items/s", spider.name,
+                    self.stats.get_value('response_received_count', 0),
+                    record['responses_per_sec'], record['items_per_sec'])
+
+
+class DomainThrottle:
+    """Contrôleur de débit d'un domaine (AIMD) : accélère par paliers tant que le serveur suit,
+    divise le débit par deux au premier 429/503.
+
+    Avec un délai non nul, Scrapy n'envoie qu'une requête par délai sur le slot : le délai
+    est donc réduit en premier, la concurrence n'augmente qu'une fois le plancher atteint.
+    """
+
+    def __init__(self, domain, min_delay=0.0, max_delay=60.0, start_delay=1.0,
+                 min_concurrency=1, max_concurrency=4, target_latency=2.0, window=10):
+        self.domain = domain
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.delay = min(max(start_delay, min_delay), max_delay)
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max(max_concurrency, min_concurrency)
+        self.concurrency = min_concurrency
+        self.target_latency = target_latency
+        self.window = window
+        self.latency = None  # Moyenne mobile exponentielle, en secondes
+        self.successes = 0  # Réponses correctes depuis le dernier ajustement
+
+    def record(self, status, latency=None, retry_after=None):
+        """Prendre en compte une réponse ; renvoie 'backoff', 'slow', 'up' ou None selon l'ajustement fait"""
+        if latency is not None:
+            self.latency = latency if self.latency is None else 0.8 * self.latency + 0.2 * latency
+
+        if status in BACKOFF_STATUSES:
+            self.successes = 0
+            self.concurrency = max(self.min_concurrency, self.concurrency // 2)
+            self.delay = min(self.max_delay, max(self.delay * 2, self.min_delay, BACKOFF_MIN_DELAY, retry_after or 0))
+            return 'backoff'
+
+        self.successes += 1
+        if self.successes < self.window:
+            return None
+        self.successes = 0
+
+        if self.latency is not None and self.latency > self.target_latency:
+            # Le serveur ralentit : freiner avant les premières erreurs
+            if self.concurrency > self.min_concurrency:
+                self.concurrency -= 1
+            else:
+                self.delay = min(self.max_delay, max(self.delay * 1.5, BACKOFF_MIN_DELAY))
+            return 'slow'
+        if self.delay > self.min_delay:
+            delay = self.delay * 0.8
+            self.delay = self.min_delay if delay < max(self.min_delay, 0.05) else delay
+            return 'up'
+        if self.concurrency < self.max_concurrency:
+            self.concurrency += 1
+            return 'up'
+        return None
+
+    @property
+    def rate(self):
+        """Débit visé en requêtes/s"""
+        if self.delay > 0:
+            return 1 / self.delay
+        return self.concurrency / self.latency if self.latency else None
+
+
+class AdaptiveThrottle:
+    """Régler délai et concurrence de chaque slot de téléchargement selon la latence et les 429/503.
+
+    Les bornes par domaine viennent de ADAPTIVE_THROTTLE_DOMAINS ({domaine: {min_delay, max_delay,
+    start_delay, min_concurrency, max_concurrency, target_latency, window}}) ; les autres domaines partent
+    de DOWNLOAD_DELAY. Le débit choisi est publié dans les stats sous ipssi/throttle/<domaine>/*.
+    """
+
+    def __init__(self, crawler, domains, defaults):
+        self.crawler = crawler
+        self.domains = domains
+        self.defaults = defaults
+        self.throttles = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('ADAPTIVE_THROTTLE_ENABLED'):
+            raise NotConfigured
+        defaults = {
+            'start_delay': crawler.settings.getfloat('DOWNLOAD_DELAY'),
+            'max_concurrency': crawler.settings.getint('CONCURRENT_REQUESTS_PER_DOMAIN', 8),
+        }
+        extension = cls(crawler, crawler.settings.getdict('ADAPTIVE_THROTTLE_DOMAINS'), defaults)
+        crawler.signals.connect(extension.response_downloaded, signal=signals.response_downloaded)
+        return extension
+
+    def get_throttle(self, key):
+        throttle = self.throttles.get(key)
+        if throttle is None:
+            options = dict(self.defaults)
+            for domain, domain_options in self.domains.items():
+                if key == domain or key.endswith('.' + domain):
+                    options.update(domain_options)
+                    break
+            throttle = self.throttles[key] = DomainThrottle(key, **options)
+        return throttle
+
+    def response_downloaded(self, response, request, spider):
+        key = request.meta.get('download_slot')
+        slot = self.crawler.engine.downloader.slots.get(key) if key else None
+        if slot is None:
+            return
+        throttle = self.get_throttle(key)
+        change = throttle.record(response.status, request.meta.get('download_latency'),
+                                 self.retry_after(response))
+        slot.delay = throttle.delay
+        slot.concurrency = throttle.concurrency
+
+        prefix = f"ipssi/throttle/{key}"
+        stats = self.crawler.stats
+        if response.status in BACKOFF_STATUSES:
+            stats.inc_value(f"{prefix}/backoffs")
+        stats.set_value(f"{prefix}/delay_ms", round(throttle.delay * 1000))
+        stats.set_value(f"{prefix}/concurrency", throttle.concurrency)
+        if throttle.rate is not None:
+            stats.set_value(f"{prefix}/rate_per_sec", round(throttle.rate, 2))
+            stats.max_value(f"{prefix}/rate_per_sec_max", round(throttle.rate, 2))
+        if change == 'backoff':
+            logger.warning("[%s] HTTP %s : délai %.2fs, concurrence %s",
+                           key, response.status, throttle.delay, throttle.concurrency)
+        elif change == 'slow':
+            logger.info("[%s] latence %.2fs : délai %.2fs, concurrence %s",
+                        key, throttle.latency, throttle.delay, throttle.concurrency)
+        elif change == 'up':
+            logger.debug("[%s] accélération : délai %.2fs, concurrence %s",
+                         key, throttle.delay, throttle.concurrency)
+
+    @staticmethod
+    def retry_after(response):
+        """En-tête Retry-After en secondes (la forme date HTTP est ignorée)"""
+        value = response.headers.get('Retry-After')
+        if value and value.strip().isdigit():
+            return float(value)
+        return None
+
+
+class ResponseArchive:
+    """Archiver chaque fiche KBO téléchargée (HTML brut) dans des segments JSONL compressés.
+
+    Seuls kbo_spider et la source KBO du spider combiné sont archivés : reprocess_archive.py
+    ne rejoue que KboSpider.parse.
+
+    Activée par ARCHIVE_ENABLED ; segments dans ARCHIVE_DIR, ARCHIVE_SEGMENT_BYTES octets
+    au plus chacun. Les réponses rejouées depuis le cache HTTP ne sont pas réarchivées.
+    Relecture : reprocess_archive.py.
+    """
+
+    def __init__(self, crawler, directory, segment_bytes):
+        self.crawler = crawler
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.writer = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('ARCHIVE_ENABLED'):
+            raise NotConfigured
+        extension = cls(crawler, crawler.settings.get('ARCHIVE_DIR', 'archive'),
+                        crawler.settings.getint('ARCHIVE_SEGMENT_BYTES', 256 * 1024 ** 2))
+        crawler.signals.connect(extension.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(extension.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(extension.response_received, signal=signals.response_received)
+        return extension
+
+    def spider_opened(self, spider):
+        # Seules les fiches KBO sont rejouables par reprocess_archive.py : rien à archiver pour eJustice et Consult
+        if spider.name not in (KboSpider.name, CombinedSpider.name):
+            return
+        # Le pid distingue les segments des workers du lanceur multi-processus
+        self.writer = ArchiveWriter(self.directory, f"{spider.name}-{os.getpid()}", self.segment_bytes)
+
+    def spider_closed(self, spider, reason):
+        if self.writer is not None:
+            self.writer.close()
+            logger.info("[%s] %s pages archivées dans %s", spider.name, self.writer.records, self.directory)
+
+    def response_received(self, response, request, spider):
+        if self.writer is None or response.status != 200 or 'cached' in response.flags:
+            return
+        if not isinstance(response, TextResponse) or request.url.endswith('/robots.txt'):
+            return
+        # Crawl combiné : seules les réponses de la source KBO sont des fiches
+        if spider.name == CombinedSpider.name and request.meta.get('source') != 'kbo':
+            return
+        numero = request.meta.get('numero_entreprise')
+        self.writer.write({
+            'url': response.url,
+            'status': response.status,
+            'numero_entreprise': numero,
+            'fetched_at': datetime.now().isoformat(timespec='seconds'),
+            'encoding': response.encoding,
+            'body': response.text,
+        }, numero)
+        self.crawler.stats.inc_value('ipssi/archived_pages')
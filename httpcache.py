@@ -0,0 +1,217 @@
+import gzip
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import time
+
+from scrapy.http import Headers
+from scrapy.responsetypes import responsetypes
+
+from utils.debug_color import get_logger
+
+logger = get_logger('httpcache')
+
+CACHE_FILE_RE = re.compile(r'^(\d{10})_[0-9a-f]+\.gz$')
+# Index LRU du cache d'un spider, à côté des pages
+INDEX_FILE = 'index.sqlite'
+# Entrées évincées par requête SQL quand le cache dépasse sa taille
+EVICT_BATCH = 100
+
+
+def cache_key(request):
+    """(numero, hash de l'URL) : le numéro d'entreprise range les pages d'une même entreprise ensemble"""
+    numero = request.meta.get('numero_entreprise')
+    return numero, hashlib.sha1(request.url.encode('utf-8')).hexdigest()[:16]
+
+
+def cached_numeros(cache_dir, spider_name):
+    """Numéros d'entreprise présents dans le cache d'un spider (pour --reparse-from-cache)"""
+    numeros = set()
+    for root, _, files in os.walk(os.path.join(cache_dir, spider_name)):
+        for name in files:
+            match = CACHE_FILE_RE.match(name)
+            if match:
+                numeros.add(match.group(1))
+    return sorted(numeros)
+
+
+class EnterpriseCacheStorage:
+    """Cache HTTP sur disque : un fichier gzip par réponse, rangé par numéro d'entreprise.
+
+    Chaque fichier contient une ligne JSON (URL, statut, en-têtes, date) suivie du corps.
+    Les entrées ne périment pas ici : la politique décide si elles sont fraîches ou à
+    revalider. La taille totale est bornée par HTTPCACHE_MAX_BYTES (0 = illimitée), les
+    entrées les moins récemment lues étant supprimées en premier.
+
+    L'ordre LRU (chemin, taille, dernier accès) est tenu dans une base SQLite à côté des
+    pages, pas en mémoire : la mémoire ne dépend pas du nombre d'entrées, et les workers
+    de --workers partagent le même index.
+    """
+
+    def __init__(self, settings):
+        self.cache_dir = settings.get('HTTPCACHE_DIR', 'httpcache')
+        self.max_bytes = settings.getint('HTTPCACHE_MAX_BYTES', 0)
+        self.compresslevel = settings.getint('HTTPCACHE_GZIP_LEVEL', 6)
+        self.db = None
+        self.total_bytes = 0
+
+    def open_spider(self, spider):
+        self.spider_dir = os.path.join(self.cache_dir, spider.name)
+        os.makedirs(self.spider_dir, exist_ok=True)
+        started = time.monotonic()
+        index_path = os.path.join(self.spider_dir, INDEX_FILE)
+        rebuild = not os.path.exists(index_path)
+        # Autocommit, WAL et attente des verrous : plusieurs workers écrivent dans le même index
+        self.db = sqlite3.connect(index_path, isolation_level=None, timeout=30)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS entries (path TEXT PRIMARY KEY, size INTEGER NOT NULL, accessed REAL NOT NULL)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)')
+        if rebuild:
+            self.rebuild_index()
+        count, total = self.db.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries').fetchone()
+        self.total_bytes = total
+        logger.info("Cache HTTP %s : %s pages, %.1f Mo (index ouvert en %.2fs)", self.spider_dir,
+                    count, total / 1e6, time.monotonic() - started)
+
+    def rebuild_index(self):
+        """Indexer un cache existant sans index (l'heure de modification sert d'heure d'accès)"""
+        self.db.execute('BEGIN')
+        for root, _, files in os.walk(self.spider_dir):
+            for name in files:
+                if name.endswith('.gz'):
+                    path = os.path.join(root, name)
+                    stat = os.stat(path)
+                    self.db.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?)', (path, stat.st_size, stat.st_mtime))
+        self.db.execute('COMMIT')
+
+    def close_spider(self, spider):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+    def entry_path(self, request):
+        numero, url_hash = cache_key(request)
+        if numero:
+            return os.path.join(self.spider_dir, numero[-3:], f"{numero}_{url_hash}.gz")
+        return os.path.join(self.spider_dir, '_', f"{url_hash}.gz")
+
+    def retrieve_response(self, spider, request):
+        path = self.entry_path(request)
+        if not os.path.exists(path):
+            return None
+        try:
+            with gzip.open(path, 'rb') as f:
+                metadata = json.loads(f.readline())
+                body = f.read()
+        except (OSError, ValueError, EOFError):
+            logger.warning("Entrée de cache illisible supprimée : %s", path)
+            self.remove(path)
+            return None
+        self.touch(path)
+
+        headers = Headers({name.encode('latin-1'): [value.encode('latin-1') for value in values]
+                           for name, values in metadata['headers'].items()})
+        url = metadata['url']
+        request.meta['cache_timestamp'] = metadata['timestamp']
+        respcls = responsetypes.from_args(headers=headers, url=url, body=body)
+        return respcls(url=url, headers=headers, status=metadata['status'], body=body)
+
+    def store_response(self, spider, request, response):
+        path = self.entry_path(request)
+        metadata = {
+            'url': response.url,
+            'status': response.status,
+            'timestamp': time.time(),
+            'headers': {name.decode('latin-1'): [value.decode('latin-1') for value in values]
+                        for name, values in response.headers.items()},
+        }
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Écriture dans un fichier temporaire puis renommage : jamais d'entrée à moitié écrite
+        tmp_path = f"{path}.tmp"
+        with gzip.open(tmp_path, 'wb', compresslevel=self.compresslevel) as f:
+            f.write(json.dumps(metadata).encode('utf-8') + b'\n')
+            f.write(response.body)
+        os.replace(tmp_path, path)
+
+        size = os.path.getsize(path)
+        previous = self.db.execute('SELECT size FROM entries WHERE path = ?', (path,)).fetchone()
+        self.db.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?)', (path, size, time.time()))
+        self.total_bytes += size - (previous[0] if previous else 0)
+        self.evict()
+
+    def touch(self, path):
+        if not self.db.execute('UPDATE entries SET accessed = ? WHERE path = ?', (time.time(), path)).rowcount:
+            # Page écrite par un autre worker avant son entrée d'index
+            self.db.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?)', (path, os.path.getsize(path), time.time()))
+
+    def remove(self, path):
+        row = self.db.execute('SELECT size FROM entries WHERE path = ?', (path,)).fetchone()
+        self.db.execute('DELETE FROM entries WHERE path = ?', (path,))
+        if row:
+            self.total_bytes -= row[0]
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def evict(self):
+        """Supprimer les entrées les moins récemment utilisées au-delà de max_bytes"""
+        if not self.max_bytes or self.total_bytes <= self.max_bytes:
+            return
+        # Total réel : les autres workers ont pu écrire ou évincer depuis
+        self.total_bytes = self.db.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+        evicted = 0
+        while self.total_bytes > self.max_bytes:
+            oldest = self.db.execute('SELECT path FROM entries ORDER BY accessed LIMIT ?', (EVICT_BATCH,)).fetchall()
+            # L'entrée la plus récente (celle qui vient d'être écrite) est toujours gardée
+            if len(oldest) <= 1:
+                break
+            for (path,) in oldest[:-1] if len(oldest) < EVICT_BATCH else oldest:
+                self.remove(path)
+                evicted += 1
+                if self.total_bytes <= self.max_bytes:
+                    break
+        if evicted:
+            logger.debug("Cache HTTP : %s entrées évincées (%.1f Mo)", evicted, self.total_bytes / 1e6)
+
+
+class RevalidatingCachePolicy:
+    """Réponse en cache servie telle quelle pendant HTTPCACHE_EXPIRATION_SECS (0 = toujours),
+    puis revalidée avec If-None-Match / If-Modified-Since quand le serveur fournit ETag ou
+    Last-Modified : un 304 réutilise la copie locale sans retélécharger la page.
+    """
+
+    def __init__(self, settings):
+        self.ttl = settings.getint('HTTPCACHE_EXPIRATION_SECS', 0)
+        self.ignore_schemes = settings.getlist('HTTPCACHE_IGNORE_SCHEMES', ['file'])
+        self.ignore_http_codes = [int(code) for code in settings.getlist('HTTPCACHE_IGNORE_HTTP_CODES', [])]
+
+    def should_cache_request(self, request):
+        return request.method == 'GET' and request.url.split(':', 1)[0] not in self.ignore_schemes
+
+    def should_cache_response(self, response, request):
+        # Les 304 ne sont pas stockés : ils confirment la copie déjà en cache
+        return response.status == 200 and response.status not in self.ignore_http_codes
+
+    def is_cached_response_fresh(self, cachedresponse, request):
+        timestamp = request.meta.get('cache_timestamp')
+        if not self.ttl or (timestamp is not None and time.time() - timestamp < self.ttl):
+            return True
+        self.set_conditional_validators(request, cachedresponse)
+        return False
+
+    def is_cached_response_valid(self, cachedresponse, response, request):
+        return response.status == 304
+
+    @staticmethod
+    def set_conditional_validators(request, cachedresponse):
+        # Sans ETag ni Last-Modified, la page est simplement retéléchargée
+        etag = cachedresponse.headers.get(b'ETag')
+        if etag:
+            request.headers[b'If-None-Match'] = etag
+        last_modified = cachedresponse.headers.get(b'Last-Modified')
+        if last_modified:
+            request.headers[b'If-Modified-Since'] = last_modified
@@ -0,0 +1,337 @@
+import argparse
+import csv
+import heapq
+import json
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from items import EntrepriseItem, NaceCode, to_plain
+from utils.debug_color import debug_print
+from utils.freshness import utc_now
+
+DEFAULT_DUMP_DIR = 'open_data'
+# Fichiers du dump open data de la BCE et colonne de jointure (numéro d'entreprise)
+ENTERPRISE_FILE = 'enterprise.csv'
+JOINED_FILES = {
+    'denomination': ('denomination.csv', 'EntityNumber'),
+    'address': ('address.csv', 'EntityNumber'),
+    'activity': ('activity.csv', 'EntityNumber'),
+    'establishment': ('establishment.csv', 'EnterpriseNumber'),
+}
+CODE_FILE = 'code.csv'
+# establishment.csv est trié par numéro d'établissement : trié à part sur EnterpriseNumber
+UNSORTED_FILES = ('establishment',)
+# Lignes triées en mémoire par fichier intermédiaire lors du tri externe
+SORT_RUN_ROWS = 1_000_000
+
+# Préférence de langue du dump (1 : FR, 2 : NL, 0 : inconnue, 3 : DE, 4 : EN)
+LANGUAGE_ORDER = ('1', '2', '0', '3', '4')
+# TypeOfDenomination : 001 dénomination sociale, 002 abréviation
+DENOMINATION = '001'
+ABBREVIATION = '002'
+# TypeOfAddress du siège
+REGISTERED_OFFICE = 'REGO'
+# ActivityGroup → type affiché sur la fiche KBO (TVA, ONSS...)
+ACTIVITY_GROUPS = {
+    '001': 'TVA',
+    '002': 'EDRL',
+    '003': 'Economie',
+    '004': 'Subsides',
+    '005': 'ONSS',
+    '006': 'Fédération',
+    '007': 'ONSSAPL',
+}
+NACE_VERSIONS = ('2025', '2008', '2003')
+MONTHS = ('janvier', 'février', 'mars', 'avril', 'mai', 'juin', 'juillet', 'août',
+          'septembre', 'octobre', 'novembre', 'décembre')
+
+
+def enterprise_key(value):
+    """Numéro du dump (0200.065.765) → numéro de la collection (0200065765), aussi clé de tri"""
+    return value.replace('.', '')
+
+
+def format_date(value):
+    """Date du dump (09-08-1960) au format de la fiche KBO (9 août 1960)"""
+    try:
+        day, month, year = value.split('-')
+        return f"{int(day)} {MONTHS[int(month) - 1]} {year}"
+    except (ValueError, IndexError):
+        return value or None
+
+
+def format_nace(code):
+    """Code NACE du dump (84130) au format de la fiche KBO (84.130)"""
+    return f"{code[:2]}.{code[2:]}" if len(code) > 2 else code
+
+
+def load_codes(path):
+    """Libellés français de code.csv : {(catégorie, code): description}, néerlandais à défaut"""
+    codes = {}
+    if not path or not os.path.exists(path):
+        return codes
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        for row in csv.DictReader(f):
+            key = (row['Category'], row['Code'])
+            if row['Language'] == 'FR' or (row['Language'] == 'NL' and key not in codes):
+                codes[key] = row['Description']
+    return codes
+
+
+class SortedCsv:
+    """CSV trié sur une colonne de numéro, lu au fil de la jointure : seules les lignes
+    de l'entreprise courante sont en mémoire"""
+
+    def __init__(self, path, key_column):
+        self.path = path
+        self.file = open(path, newline='', encoding='utf-8-sig')
+        self.reader = csv.reader(self.file)
+        self.columns = {name: index for index, name in enumerate(next(self.reader, []))}
+        if key_column not in self.columns:
+            raise ValueError(f"Colonne {key_column} absente de {path}")
+        self.key_index = self.columns[key_column]
+        self.previous = ''
+        self.row = None
+        self.key = None
+        self.advance()
+
+    def advance(self):
+        self.row = next(self.reader, None)
+        if self.row is None:
+            self.key = None
+            return
+        self.key = enterprise_key(self.row[self.key_index])
+        if self.key < self.previous:
+            raise ValueError(f"{self.path} n'est pas trié sur le numéro d'entreprise "
+                             f"({self.key} après {self.previous})")
+        self.previous = self.key
+
+    def take(self, key):
+        """Lignes du numéro key ; les numéros inférieurs (établissements, entreprises absentes) sont sautés"""
+        rows = []
+        while self.key is not None and self.key <= key:
+            if self.key == key:
+                rows.append({name: self.row[index] for name, index in self.columns.items()})
+            self.advance()
+        return rows
+
+    def close(self):
+        self.file.close()
+
+
+def sort_csv(path, key_column, workdir, run_rows=SORT_RUN_ROWS):
+    """Tri externe d'un CSV sur une colonne de numéro : lots triés sur disque puis fusionnés"""
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        key_index = header.index(key_column)
+        runs = []
+        while True:
+            rows = [row for _, row in zip(range(run_rows), reader)]
+            if not rows:
+                break
+            rows.sort(key=lambda row: enterprise_key(row[key_index]))
+            run_path = os.path.join(workdir, f"{os.path.basename(path)}.{len(runs):04d}")
+            with open(run_path, 'w', newline='', encoding='utf-8') as run:
+                csv.writer(run).writerows(rows)
+            runs.append(run_path)
+
+    sorted_path = os.path.join(workdir, os.path.basename(path))
+    files = [open(run_path, newline='', encoding='utf-8') for run_path in runs]
+    try:
+        with open(sorted_path, 'w', newline='', encoding='utf-8') as output:
+            writer = csv.writer(output)
+            writer.writerow(header)
+            writer.writerows(heapq.merge(*(csv.reader(run) for run in files),
+                                         key=lambda row: enterprise_key(row[key_index])))
+    finally:
+        for run in files:
+            run.close()
+        for run_path in runs:
+            os.remove(run_path)
+    return sorted_path
+
+
+def pick_language(rows):
+    return min(rows, key=lambda row: LANGUAGE_ORDER.index(row['Language'])
+               if row['Language'] in LANGUAGE_ORDER else len(LANGUAGE_ORDER))
+
+
+def format_address(row):
+    street = row.get('StreetFR') or row.get('StreetNL') or ''
+    municipality = row.get('MunicipalityFR') or row.get('MunicipalityNL') or ''
+    parts = [street, row.get('HouseNumber', '')]
+    if row.get('Box'):
+        parts.append(f"boîte {row['Box']}")
+    parts += [row.get('Zipcode', ''), municipality]
+    return ' '.join(part.strip() for part in parts if part and part.strip())
+
+
+def build_document(enterprise, joined, codes):
+    """Document au format d'EntrepriseItem à partir des lignes du dump d'une entreprise.
+
+    Seuls les champs présents dans le dump sont renseignés : le reste de la fiche
+    (fonctions, qualités, liens...) reste à crawler.
+    """
+    def label(category, code):
+        return codes.get((category, code), code) or None
+
+    generalites = {
+        'numero_entreprise': enterprise['EnterpriseNumber'],
+        'statut': label('Status', enterprise['Status']),
+        'situation_juridique': label('JuridicalSituation', enterprise['JuridicalSituation']),
+        'type_entite': label('TypeOfEnterprise', enterprise['TypeOfEnterprise']),
+        'forme_legale': label('JuridicalForm', enterprise['JuridicalForm']),
+        'date_debut': format_date(enterprise['StartDate']),
+    }
+    document = {'numero_entreprise': enterprise_key(enterprise['EnterpriseNumber']), 'generalites': generalites}
+
+    if 'denomination' in joined:
+        for field, denomination_type in (('denomination', DENOMINATION), ('abreviation', ABBREVIATION)):
+            rows = [row for row in joined['denomination'] if row['TypeOfDenomination'] == denomination_type]
+            if rows:
+                generalites[field] = pick_language(rows)['Denomination']
+
+    if 'address' in joined:
+        rows = [row for row in joined['address'] if row['TypeOfAddress'] == REGISTERED_OFFICE]
+        if rows:
+            generalites['adresse'] = format_address(rows[0])
+
+    if 'establishment' in joined:
+        generalites['nombre_ue'] = str(len(joined['establishment']))
+
+    if 'activity' in joined:
+        nace = {version: [] for version in NACE_VERSIONS}
+        for row in joined['activity']:
+            if row['NaceVersion'] in nace:
+                nace[row['NaceVersion']].append(NaceCode(
+                    type=ACTIVITY_GROUPS.get(row['ActivityGroup'], row['ActivityGroup']),
+                    code=format_nace(row['NaceCode']),
+                    description=label(f"Nace{row['NaceVersion']}", row['NaceCode']),
+                ))
+        for version, activities in nace.items():
+            if activities:
+                document[f'nace_{version}'] = activities
+
+    document['generalites'] = {key: value for key, value in generalites.items() if value is not None}
+    return document
+
+
+def build_update(document):
+    """$set des champs du dump en notation pointée : les autres champs de generalites
+    (situation_juridique_depuis...) et les données déjà crawlées sont conservés.
+
+    Les listes NACE ne sont écrites qu'à la création : celles d'une fiche existante
+    (crawlée, plus complètes que le dump) ne sont pas remplacées.
+    """
+    update = {f'generalites.{key}': value for key, value in document['generalites'].items()}
+    update['last_imported'] = utc_now()
+    # Nouvelle entreprise : champs du dump hors generalites (nace_*), le reste de la fiche
+    # à crawler initialisé comme dans EntrepriseItem
+    on_insert = {key: value for key, value in document.items() if key not in ('numero_entreprise', 'generalites')}
+    on_insert.update((field, []) for field in EntrepriseItem.fields
+                     if field not in document and field not in ('content_hash', 'last_crawled', 'last_imported', 'sources'))
+    on_insert['donnees_financieres'] = {}
+    return {'$set': update, '$setOnInsert': on_insert}
+
+
+def iter_documents(dump_dir, codes, workdir):
+    """Jointure par fusion des CSV triés sur le numéro d'entreprise, entreprise par entreprise"""
+    sources = {}
+    try:
+        for name, (filename, key_column) in JOINED_FILES.items():
+            path = os.path.join(dump_dir, filename)
+            if not os.path.exists(path):
+                debug_print(f"{filename} absent : champs correspondants non importés", "warning")
+                continue
+            if name in UNSORTED_FILES:
+                debug_print(f"Tri de {filename} sur {key_column}...", "info")
+                path = sort_csv(path, key_column, workdir)
+            sources[name] = SortedCsv(path, key_column)
+
+        enterprises = SortedCsv(os.path.join(dump_dir, ENTERPRISE_FILE), 'EnterpriseNumber')
+        sources_list = list(sources.items())
+        try:
+            while enterprises.key is not None:
+                key = enterprises.key
+                enterprise = {name: enterprises.row[index] for name, index in enterprises.columns.items()}
+                enterprises.advance()
+                joined = {name: source.take(key) for name, source in sources_list}
+                yield build_document(enterprise, joined, codes)
+        finally:
+            enterprises.close()
+    finally:
+        for source in sources.values():
+            source.close()
+
+
+def open_collection():
+    from pymongo import MongoClient
+    from main import MONGO_COLLECTION, MONGO_DB, MONGO_URI
+    return MongoClient(MONGO_URI)[MONGO_DB][MONGO_COLLECTION]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Importer le dump open data de la BCE dans MongoDB, sans crawler.")
+    parser.add_argument('--dump', '-d', type=str, default=DEFAULT_DUMP_DIR,
+                        help=f"Dossier des CSV du dump (enterprise.csv, denomination.csv, address.csv, activity.csv, establishment.csv, code.csv ; défaut: {DEFAULT_DUMP_DIR})")
+    parser.add_argument('--mongo', action='store_true',
+                        help='Écrire les entreprises dans MongoDB (upsert, $set des généralités du dump ; codes NACE à la création seulement)')
+    parser.add_argument('--output', '-o', type=str, default=None,
+                        help='Écrire aussi les documents dans un fichier JSONL')
+    parser.add_argument('--bulk-size', type=int, default=1000,
+                        help='Taille des lots d\'écriture MongoDB (défaut: 1000)')
+    args = parser.parse_args()
+
+    if not os.path.exists(os.path.join(args.dump, ENTERPRISE_FILE)):
+        debug_print(f"{ENTERPRISE_FILE} introuvable dans {args.dump}", "error")
+        return
+    if not args.mongo and not args.output:
+        debug_print("Ni --mongo ni --output : import à blanc (lecture et jointure seulement)", "warning")
+
+    from pymongo import UpdateOne
+
+    codes = load_codes(os.path.join(args.dump, CODE_FILE))
+    collection = open_collection() if args.mongo else None
+    output = open(args.output, 'w', encoding='utf-8') if args.output else None
+    workdir = tempfile.mkdtemp(prefix='import-open-data-')
+    # Un lot s'écrit pendant que le suivant est préparé ; au plus un lot en attente
+    writer = ThreadPoolExecutor(max_workers=1)
+    pending = None
+    started = time.monotonic()
+    count = 0
+    operations = []
+    try:
+        for document in iter_documents(args.dump, codes, workdir):
+            count += 1
+            if output is not None:
+                output.write(json.dumps(document, ensure_ascii=False, default=to_plain) + '\n')
+            if collection is not None:
+                operations.append(UpdateOne({'numero_entreprise': document['numero_entreprise']},
+                                            build_update(document), upsert=True))
+                if len(operations) >= args.bulk_size:
+                    if pending is not None:
+                        pending.result()
+                    pending = writer.submit(collection.bulk_write, operations, ordered=False)
+                    operations = []
+            if count % 100000 == 0:
+                debug_print(f"{count} entreprises importées ({count / (time.monotonic() - started):.0f}/s)", "info")
+        if pending is not None:
+            pending.result()
+        if operations:
+            collection.bulk_write(operations, ordered=False)
+    finally:
+        writer.shutdown()
+        if output is not None:
+            output.close()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    elapsed = time.monotonic() - started
+    debug_print(f"{count} entreprises importées en {elapsed:.1f}s", "success")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,71 @@
+from collections.abc import Mapping
+
 import scrapy
 
+
+class Record(Mapping):
+    """Sous-enregistrement d'une entreprise (fonction, code NACE, lien...) à attributs fixes.
+
+    __slots__ au lieu d'un dict par enregistrement : pas de clés répétées en mémoire.
+    L'interface Mapping (lecture seule) suffit à l'encodeur BSON de pymongo et à la
+    comparaison avec un dict : l'enregistrement part tel quel vers MongoDB, sans copie.
+    """
+    __slots__ = ()
+    fields = ()
+
+    def __init__(self, *args, **kwargs):
+        for field, value in zip(self.fields, args):
+            setattr(self, field, value)
+        for field in self.fields[len(args):]:
+            setattr(self, field, kwargs.get(field))
+
+    def __getitem__(self, key):
+        if key in self.fields:
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def __iter__(self):
+        return iter(self.fields)
+
+    def __len__(self):
+        return len(self.fields)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({', '.join(f'{field}={getattr(self, field)!r}' for field in self.fields)})"
+
+    def as_document(self):
+        return {field: getattr(self, field) for field in self.fields}
+
+
+class Fonction(Record):
+    __slots__ = fields = ('role', 'nom', 'depuis')
+
+
+class NaceCode(Record):
+    __slots__ = fields = ('type', 'code', 'description', 'depuis')
+
+
+class Autorisation(Record):
+    __slots__ = fields = ('denomination', 'date_debut')
+
+
+class Lien(Record):
+    __slots__ = fields = ('numero_entreprise', 'denomination', 'type_lien', 'date_debut')
+
+
+class LienExterne(Record):
+    __slots__ = fields = ('url', 'texte')
+
+
+def to_plain(value):
+    """Fonction default de json.dumps : items et enregistrements exportés comme des dict"""
+    if isinstance(value, Record):
+        return value.as_document()
+    if isinstance(value, Mapping):
+        return dict(value)
+    return str(value)
+
+
 class EntrepriseItem(scrapy.Item):
     numero_entreprise = scrapy.Field()
     generalites = scrapy.Field()
@@ -14,4 +80,12 @@ class EntrepriseItem(scrapy.Item):
     liens_entites = scrapy.Field()
     liens_externes = scrapy.Field()
     publications = scrapy.Field()
-    comptes_annuels = scrapy.Field()
\ No newline at end of file
+    comptes_annuels = scrapy.Field()
+    # Fraîcheur, renseignée par la pipeline MongoDB juste avant l'écriture
+    content_hash = scrapy.Field()
+    last_crawled = scrapy.Field()
+    # Date du dernier import du dump open data (import_open_data.py)
+    last_imported = scrapy.Field()
+    # Spider combiné : sources (kbo, ejustice, consult) dont l'item a été fusionné,
+    # retiré par la pipeline MongoDB avant l'écriture
+    sources = scrapy.Field()
@@ -1,100 +1,753 @@
+import argparse
+import multiprocessing
+import numbers
+import os
+import time
+from urllib.error import HTTPError
+
 from scrapy.crawler import CrawlerProcess
 from scrapy.utils.project import get_project_settings
-from pymongo import MongoClient
+from pymongo import MongoClient, UpdateOne
+from pymongo.errors import BulkWriteError
+from twisted.internet import defer, task, threads
+from twisted.python.threadpool import ThreadPool
+
+from httpcache import cached_numeros
+from utils.checkpoint import worker_checkpoint_path
+from utils.debug_color import debug_print, get_logger, setup_logging
+from utils.enterprise_source import DEFAULT_INPUT_FILE
+from utils.freshness import FreshnessIndex, compute_content_hash, load_latest_publications, utc_now
+from utils.documents import FileDocumentStore, GridFSDocumentStore, stream_document
+from spiders import CombinedSpider, ConsultSpider, EjusticeSpider, KboSpider, ScrapingStats
 
-from utils.debug_color import debug_print
-from spiders import KboSpider, scraping_stats
+# Spiders sélectionnables avec --spider
+SPIDERS = {
+    'kbo': KboSpider,
+    'ejustice': EjusticeSpider,
+    'consult': ConsultSpider,
+    'entreprise': CombinedSpider,
+}
 
 # Configuration MongoDB
 MONGO_URI = 'mongodb://localhost:27017/'
 MONGO_DB = 'ipssi_webscraping'
 MONGO_COLLECTION = 'Scrapy'
 
+# Écritures groupées : taille maximale d'un lot et âge maximal (en secondes) avant envoi
+MONGO_BULK_SIZE = 500
+MONGO_BULK_MAX_AGE = 5.0
+
+# Écritures hors du thread du réacteur : nombre de threads et d'écritures en vol
+# Quand la file est pleine, process_item ne rend pas la main et Scrapy ralentit les téléchargements
+MONGO_WRITE_THREADS = 4
+MONGO_WRITE_QUEUE_SIZE = 8
+
+# Mode incrémental : ne pas recrawler une entreprise vue il y a moins de INCREMENTAL_TTL secondes
+INCREMENTAL_TTL = 7 * 24 * 3600
+
+# Export périodique des statistiques (une ligne JSON par intervalle et par spider)
+STATS_JSONL_FILE = 'stats_%(name)s.jsonl'
+STATS_JSONL_INTERVAL = 30
+
+# Cache HTTP local des pages (voir httpcache.py) : durée de fraîcheur avant revalidation et taille maximale
+HTTPCACHE_DIR = 'httpcache'
+HTTPCACHE_TTL = 24 * 3600
+HTTPCACHE_MAX_BYTES = 2 * 1024 ** 3
+
+# Archive brute des pages téléchargées (voir utils/archive.py et reprocess_archive.py)
+ARCHIVE_DIR = 'archive'
+ARCHIVE_SEGMENT_BYTES = 256 * 1024 ** 2
+
+# Filtre des requêtes déjà vues (voir scheduler.py) : taille fixe, calculée pour DUPEFILTER_CAPACITY requêtes
+DUPEFILTER_CAPACITY = 10_000_000
+DUPEFILTER_ERROR_RATE = 1e-6
+
+# Documents des comptes annuels (ConsultSpider) : 'files', 'gridfs' ou '' pour ne pas les télécharger
+CONSULT_DOCUMENTS_STORE = 'files'
+CONSULT_DOCUMENTS_DIR = 'documents'
+CONSULT_DOWNLOAD_CONCURRENCY = 2
+CONSULT_DOCUMENT_MAX_BYTES = 0  # 0 = pas de limite (le téléchargement se fait en flux)
+# Champs du résultat d'un téléchargement copiés dans le document enregistré
+STORED_DOCUMENT_FIELDS = ('emplacement', 'taille', 'sha1', 'content_type')
+
+# Contrôle de débit adaptatif par domaine : bornes du délai (s) et de la concurrence
+THROTTLE_DOMAINS = {
+    'kbopub.economie.fgov.be': {'min_delay': 0.0, 'max_delay': 30.0, 'start_delay': 1.0,
+                                'min_concurrency': 1, 'max_concurrency': 4, 'target_latency': 2.0},
+    'www.ejustice.just.fgov.be': {'min_delay': 0.5, 'max_delay': 60.0, 'start_delay': 2.0,
+                                  'min_concurrency': 1, 'max_concurrency': 2, 'target_latency': 3.0},
+    'consult.cbso.nbb.be': {'min_delay': 0.0, 'max_delay': 30.0, 'start_delay': 1.0,
+                            'min_concurrency': 1, 'max_concurrency': 4, 'target_latency': 2.0},
+}
+
+logger = get_logger('pipeline')
+
+# Pipeline de téléchargement des documents des comptes annuels
+class ConsultDocumentsPipeline:
+    """Télécharger en flux les documents listés par ConsultSpider vers le disque ou GridFS.
+
+    Chaque document est lu par blocs dans un thread du pool et écrit au fur et à mesure :
+    la mémoire reste bornée quelle que soit la taille du fichier. Au plus concurrency
+    téléchargements ont lieu en même temps, en plus des requêtes Scrapy.
+    """
+
+    def __init__(self, store=CONSULT_DOCUMENTS_STORE, directory=CONSULT_DOCUMENTS_DIR,
+                 concurrency=CONSULT_DOWNLOAD_CONCURRENCY, max_bytes=CONSULT_DOCUMENT_MAX_BYTES,
+                 timeout=180, user_agent=None):
+        self.store_type = store
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.headers = {'User-Agent': user_agent} if user_agent else {}
+        self.threadpool = ThreadPool(minthreads=1, maxthreads=concurrency, name='documents')
+        self.download_slots = defer.DeferredSemaphore(concurrency)
+        self.store = None
+        self.client = None
+        self.scraping_stats = ScrapingStats()
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        pipeline = cls(
+            store=crawler.settings.get('CONSULT_DOCUMENTS_STORE', CONSULT_DOCUMENTS_STORE),
+            directory=crawler.settings.get('CONSULT_DOCUMENTS_DIR', CONSULT_DOCUMENTS_DIR),
+            concurrency=crawler.settings.getint('CONSULT_DOWNLOAD_CONCURRENCY', CONSULT_DOWNLOAD_CONCURRENCY),
+            max_bytes=crawler.settings.getint('CONSULT_DOCUMENT_MAX_BYTES', CONSULT_DOCUMENT_MAX_BYTES),
+            timeout=crawler.settings.getfloat('DOWNLOAD_TIMEOUT', 180),
+            user_agent=crawler.settings.get('USER_AGENT'),
+        )
+        pipeline.scraping_stats = ScrapingStats(crawler)
+        return pipeline
+
+    def open_spider(self, spider):
+        if spider.name not in (ConsultSpider.name, CombinedSpider.name) or not self.store_type:
+            return
+        if self.store_type == 'gridfs':
+            self.client = MongoClient(MONGO_URI, serverSelectionTimeoutMS=5000)
+            self.store = GridFSDocumentStore(self.client[MONGO_DB])
+        else:
+            self.store = FileDocumentStore(self.directory)
+        self.threadpool.start()
+        logger.info("Documents des comptes annuels enregistrés dans %s",
+                    'GridFS' if self.store_type == 'gridfs' else self.directory)
+
+    def process_item(self, item, spider):
+        if self.store is None or not item.get('comptes_annuels'):
+            return item
+        from twisted.internet import reactor
+        numero = item['numero_entreprise']
+        downloads = []
+        for deposit in item['comptes_annuels']:
+            for document in deposit.get('documents', []):
+                filename = f"{deposit.get('reference') or deposit.get('id')}.{document['type']}"
+                metadata = {'numero_entreprise': numero, 'reference': deposit.get('reference'), 'type': document['type']}
+                d = self.download_slots.run(threads.deferToThreadPool, reactor, self.threadpool, stream_document,
+                                            document['url'], self.store, numero, filename, self.headers,
+                                            self.timeout, self.max_bytes, metadata)
+                d.addCallbacks(self._download_success, self._download_error,
+                               callbackArgs=(document,), errbackArgs=(document, numero))
+                downloads.append(d)
+        d = defer.DeferredList(downloads)
+        d.addCallback(lambda _: item)
+        return d
+
+    def _download_success(self, result, document):
+        # 'type' reste celui du dépôt (pdf/xbrl) : le Content-Type a sa propre clé
+        document.update((key, result[key]) for key in STORED_DOCUMENT_FIELDS if key in result)
+        if not result.get('deja_present'):
+            self.scraping_stats.documents_downloaded += 1
+            self.scraping_stats.stats.inc_value('ipssi/document_bytes', result['taille'])
+
+    def _download_error(self, failure, document, numero):
+        # Un document absent (ex. pas de XBRL pour ce dépôt) n'empêche pas d'enregistrer les autres
+        if isinstance(failure.value, HTTPError) and failure.value.code == 404:
+            document['disponible'] = False
+            logger.debug("Pas de document %s pour %s", document['type'], numero)
+            return
+        document['erreur'] = str(failure.value)
+        self.scraping_stats.documents_failed += 1
+        logger.warning("Document %s de %s non téléchargé: %s", document['type'], numero, failure.value)
+
+    def close_spider(self, spider):
+        if self.store is None:
+            return
+        self.threadpool.stop()
+        if self.client is not None:
+            self.client.close()
+
+# Champs remplis par les spiders eJustice et Consult, jamais écrasés par une fiche KBO
+NON_KBO_FIELDS = ('publications', 'comptes_annuels')
+
+
+def kbo_document(item):
+    """Vue d'un item KBO pour le $set, sans les publications ni les comptes annuels"""
+    return {key: value for key, value in item.items() if key not in NON_KBO_FIELDS}
+
+
+def merge_publications(publications):
+    """Étape de mise à jour en pipeline (MongoDB 4.2+) : publications ajoutées à l'historique,
+    une seule par référence.
+
+    Une publication déjà enregistrée sous la même référence (titre reformaté, nouveau lien
+    vers le PDF...) est remplacée par la version reçue au lieu d'être gardée en double.
+    """
+    references = [publication['reference'] for publication in publications]
+    return {'$set': {'publications': {'$concatArrays': [
+        {'$filter': {
+            'input': {'$ifNull': ['$publications', []]},
+            'as': 'publication',
+            'cond': {'$not': [{'$in': ['$$publication.reference', {'$literal': references}]}]},
+        }},
+        {'$literal': publications},
+    ]}}}
+
+
+def literal_set(document):
+    """$set d'un document dans une mise à jour en pipeline : valeurs prises telles quelles"""
+    return {'$set': {key: {'$literal': value} for key, value in document.items()}}
+
+
 # Pipeline MongoDB pour stocker les données
 class MongoDBPipeline:
-    def __init__(self):
+    def __init__(self, bulk_size=0, bulk_max_age=MONGO_BULK_MAX_AGE,
+                 write_threads=MONGO_WRITE_THREADS, write_queue_size=MONGO_WRITE_QUEUE_SIZE,
+                 incremental=False, incremental_ttl=INCREMENTAL_TTL, prioritized=False):
+        # bulk_size = 0 : une écriture par item (mode historique)
+        self.bulk_size = bulk_size
+        self.bulk_max_age = bulk_max_age
+        self.incremental = incremental
+        self.incremental_ttl = incremental_ttl
+        # Priorités par palier : l'index de fraîcheur sert aussi à classer les entreprises
+        self.prioritized = prioritized
+        self.freshness = None
+        self.buffer = []
+        self.buffer_started = None
+        self.flush_loop = None
+        # pymongo est bloquant : les écritures passent par un pool de threads borné
+        self.threadpool = ThreadPool(minthreads=1, maxthreads=write_threads, name='mongodb')
+        self.write_slots = defer.DeferredSemaphore(write_queue_size)
+        self.pending_writes = set()
+        # Remplacées par les stats du crawler dans from_crawler
+        self.scraping_stats = ScrapingStats()
+        # Restent à None si la connexion échoue : chaque item est alors compté en erreur
+        self.client = None
+        self.collection = None
         try:
             self.client = MongoClient(MONGO_URI, serverSelectionTimeoutMS=5000)  # 5 secondes timeout
             # Test de connexion
             self.client.server_info()  # Va lever une exception si la connexion échoue
             self.db = self.client[MONGO_DB]
             self.collection = self.db[MONGO_COLLECTION]
-            debug_print(f"Pipeline MongoDB initialisée - Collection: {MONGO_COLLECTION}", "info")
+            logger.info("Pipeline MongoDB initialisée - Collection: %s", MONGO_COLLECTION)
         except Exception as e:
-            debug_print(f"ERREUR CRITIQUE: Impossible de se connecter à MongoDB: {e}", "error")
+            logger.error("ERREUR CRITIQUE: Impossible de se connecter à MongoDB: %s", e)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        pipeline = cls(
+            bulk_size=crawler.settings.getint('MONGO_BULK_SIZE', 0),
+            bulk_max_age=crawler.settings.getfloat('MONGO_BULK_MAX_AGE', MONGO_BULK_MAX_AGE),
+            write_threads=crawler.settings.getint('MONGO_WRITE_THREADS', MONGO_WRITE_THREADS),
+            write_queue_size=crawler.settings.getint('MONGO_WRITE_QUEUE_SIZE', MONGO_WRITE_QUEUE_SIZE),
+            incremental=crawler.settings.getbool('INCREMENTAL_ENABLED', False),
+            incremental_ttl=crawler.settings.getfloat('INCREMENTAL_TTL', INCREMENTAL_TTL),
+            prioritized=crawler.settings.getint('PRIORITY_TIERS', 0) > 0,
+        )
+        # Même StatsCollector que le spider du crawler : les compteurs sont propres à ce crawler
+        pipeline.scraping_stats = ScrapingStats(crawler)
+        return pipeline
+
+    def open_spider(self, spider):
+        self.threadpool.start()
+        if self.bulk_size > 0:
+            # Vider régulièrement les lots trop anciens, même quand les items arrivent lentement
+            self.flush_loop = task.LoopingCall(self.flush_if_expired, spider)
+            self.flush_loop.start(self.bulk_max_age, now=False)
+            logger.info("Écritures MongoDB groupées par lots de %s (âge max %ss)", self.bulk_size, self.bulk_max_age)
+        if not self.incremental and not self.prioritized:
+            return None
+        # Charger l'état existant en une seule requête ; start_requests n'est consommé qu'après
+        from twisted.internet import reactor
+        loads = []
+        if spider.name in ('kbo_spider', CombinedSpider.name):
+            d = threads.deferToThreadPool(reactor, self.threadpool, FreshnessIndex.load, self.collection)
+            d.addCallback(self._attach_freshness, spider)
+            d.addErrback(lambda failure: logger.error("Impossible de charger l'index de fraîcheur: %s", failure.value))
+            loads.append(d)
+        if self.incremental and spider.name in (EjusticeSpider.name, CombinedSpider.name):
+            d = threads.deferToThreadPool(reactor, self.threadpool, load_latest_publications, self.collection)
+            d.addCallback(lambda latest: setattr(spider, 'latest_publications', latest))
+            d.addErrback(lambda failure: logger.error("Impossible de charger les dernières publications: %s", failure.value))
+            loads.append(d)
+        if loads:
+            return defer.DeferredList(loads)
+
+    def _attach_freshness(self, index, spider):
+        self.freshness = index
+        spider.freshness = index
+        # Hors mode incrémental, l'index ne sert qu'aux priorités : aucune entreprise n'est sautée
+        spider.freshness_ttl = self.incremental_ttl if self.incremental else 0
+
+    def build_update(self, item, spider, sources=None):
+        """Construire le filtre et la mise à jour MongoDB correspondant à un item.
+
+        sources : sources abouties d'un item du spider combiné (kbo, ejustice, consult).
+        """
+        if spider.name == 'kbo_spider':
+            numero = item['numero_entreprise']
+            content_hash = compute_content_hash(item)
+            if self.freshness is not None and self.freshness.get_hash(numero) == content_hash:
+                # Contenu inchangé : seule la date de passage est rafraîchie
+                self.scraping_stats.items_unchanged += 1
+                return (
+                    {'numero_entreprise': numero},
+                    {'$set': {'last_crawled': utc_now()}},
+                    ("Entreprise %s inchangée", numero),
+                )
+            item['content_hash'] = content_hash
+            item['last_crawled'] = utc_now()
+            # Vue superficielle : les sous-enregistrements sont encodés en BSON sans copie
+            return (
+                {'numero_entreprise': numero},
+                {'$set': kbo_document(item)},
+                ("Entreprise %s mise à jour dans MongoDB", numero),
+            )
+        elif spider.name == 'ejustice':
+            # Une page de publications à la fois : ajout à la liste existante, une par référence
+            return (
+                {'numero_entreprise': item.get('numero_entreprise')},
+                [merge_publications(item.get('publications', []))],
+                ("%s publications ajoutées pour %s", len(item.get('publications', [])), item.get('numero_entreprise')),
+            )
+        elif spider.name == 'consult':
+            return (
+                {'numero_entreprise': item.get('numero_entreprise')},
+                {'$set': {'comptes_annuels': item.get('comptes_annuels', [])}},
+                ("Comptes annuels mis à jour pour %s", item.get('numero_entreprise')),
+            )
+        elif spider.name == CombinedSpider.name:
+            # Entreprise complète (KBO + eJustice + Consult) : une seule écriture
+            numero = item['numero_entreprise']
+            sources = sources or ()
+            publications = item.get('publications', [])
+            # Vue sans les publications (fusionnées par référence) ni les comptes annuels ; références seulement
+            document = kbo_document(item)
+            if 'kbo' in sources:
+                # Même hash que le spider KBO seul : seuls les champs de la fiche KBO comptent.
+                # Fiche KBO en échec : ni hash ni date de passage, l'entreprise reste à recrawler
+                item['content_hash'] = document['content_hash'] = compute_content_hash(
+                    dict(document, publications=[], comptes_annuels=[]))
+                item['last_crawled'] = document['last_crawled'] = utc_now()
+            if 'consult' in sources:
+                # Liste des dépôts reçue en entier : elle remplace celle enregistrée
+                document['comptes_annuels'] = item['comptes_annuels']
+            update = {'$set': document}
+            if publications:
+                # Les publications s'ajoutent à l'historique : en mode incrémental seules les nouvelles sont lues
+                update = [literal_set(document), merge_publications(publications)]
+            return (
+                {'numero_entreprise': numero},
+                update,
+                ("Entreprise %s mise à jour dans MongoDB (%s publications, %s dépôts)",
+                 numero, len(publications), len(document.get('comptes_annuels', []))),
+            )
+        return None
+
+    def run_write(self, func, *args):
+        """Exécuter une écriture pymongo dans le pool, au plus write_queue_size à la fois"""
+        # Import tardif : importer le réacteur au chargement du module installerait le réacteur par défaut
+        from twisted.internet import reactor
+        d = self.write_slots.run(threads.deferToThreadPool, reactor, self.threadpool, self._timed_write, func, *args)
+        self.pending_writes.add(d)
+        d.addBoth(self._write_done, d)
+        d.addCallback(self._record_latency)
+        return d
+
+    @staticmethod
+    def _timed_write(func, *args):
+        # Mesurée dans le thread : la latence n'inclut pas l'attente dans la file
+        started = time.perf_counter()
+        result = func(*args)
+        return result, time.perf_counter() - started
+
+    def _write_done(self, result, d):
+        self.pending_writes.discard(d)
+        return result
+
+    def _record_latency(self, timed_result):
+        result, elapsed = timed_result
+        self.scraping_stats.observe('mongodb_write_latency', elapsed)
+        return result
 
     def process_item(self, item, spider):
+        # Spider combiné : sources abouties, retirées de l'item avant l'écriture
+        sources = item.pop('sources', None)
         try:
-            if spider.name == 'kbo_spider':
-                self.collection.update_one(
-                    {'numero_entreprise': item['numero_entreprise']},
-                    {'$set': dict(item)},
-                    upsert=True
-                )
-                debug_print(f"Entreprise {item['numero_entreprise']} mise à jour dans MongoDB", "success")
-                scraping_stats.mongodb_updates += 1
-            elif spider.name == 'ejustice':
-                # Pour les autres spiders, mettre à jour des champs spécifiques
-                self.collection.update_one(
-                    {'numero_entreprise': item.get('numero_entreprise')},
-                    {'$set': {'publications': item.get('publications', [])}},
-                    upsert=True
-                )
-                debug_print(f"Publications mises à jour pour {item.get('numero_entreprise')}", "success")
-                scraping_stats.mongodb_updates += 1
-            elif spider.name == 'consult':
-                self.collection.update_one(
-                    {'numero_entreprise': item.get('numero_entreprise')},
-                    {'$set': {'comptes_annuels': item.get('comptes_annuels', [])}},
-                    upsert=True
-                )
-                debug_print(f"Comptes annuels mis à jour pour {item.get('numero_entreprise')}", "success")
-                scraping_stats.mongodb_updates += 1
+            update = self.build_update(item, spider, sources)
         except Exception as e:
-            debug_print(f"Erreur MongoDB: {e}", "error")
-            scraping_stats.mongodb_errors += 1
-        
-        return item
+            logger.error("Erreur MongoDB: %s", e)
+            self.scraping_stats.mongodb_errors += 1
+            return item
+        if update is None:
+            return item
+        if self.collection is None:
+            logger.error("Erreur MongoDB: pas de connexion, %s non enregistrée", item.get('numero_entreprise'))
+            self.scraping_stats.mongodb_errors += 1
+            return item
+        filtre, operation, message = update
+        # Sans sa fiche KBO, une entreprise du spider combiné n'est pas marquée terminée
+        completed = sources is None or 'kbo' in sources
+
+        if self.bulk_size > 0:
+            # Mode groupé : accumuler puis envoyer en un seul bulk_write
+            self.buffer.append((filtre.get('numero_entreprise'), UpdateOne(filtre, operation, upsert=True), completed))
+            if self.buffer_started is None:
+                self.buffer_started = time.monotonic()
+            if len(self.buffer) >= self.bulk_size:
+                # L'item qui remplit le lot attend son écriture : c'est ce qui freine le scheduler
+                return self.flush(spider).addCallback(lambda _: item)
+            return item
+
+        d = self.run_write(self.collection.update_one, filtre, operation, True)
+        d.addCallbacks(self._update_success, self._update_error,
+                       callbackArgs=(message, filtre.get('numero_entreprise') if completed else None, spider))
+        d.addCallback(lambda _: item)
+        return d
+
+    def _update_success(self, result, message, numero, spider):
+        # Message et arguments séparés : formatage seulement si le niveau debug est actif
+        logger.debug(*message)
+        self.scraping_stats.mongodb_updates += 1
+        self.mark_completed(spider, [numero])
+
+    def mark_completed(self, spider, numeros):
+        # Une entreprise n'est marquée terminée qu'une fois son écriture confirmée
+        checkpoint = getattr(spider, 'checkpoint', None)
+        if checkpoint is None:
+            return
+        for numero in numeros:
+            if numero:
+                checkpoint.mark_completed(numero)
+
+    def _update_error(self, failure):
+        logger.error("Erreur MongoDB: %s", failure.value)
+        self.scraping_stats.mongodb_errors += 1
+
+    def flush_if_expired(self, spider):
+        if self.buffer_started is not None and time.monotonic() - self.buffer_started >= self.bulk_max_age:
+            self.flush(spider)
+
+    def flush(self, spider):
+        """Envoyer le lot en attente avec bulk_write (non ordonné) depuis le pool de threads"""
+        if not self.buffer:
+            return defer.succeed(None)
+        batch, self.buffer = self.buffer, []
+        self.buffer_started = None
+        numeros = [numero for numero, _, _ in batch]
+        operations = [operation for _, operation, _ in batch]
+        completed = [done for _, _, done in batch]
+
+        d = self.run_write(self.bulk_write, operations)
+        d.addCallbacks(self._flush_success, self._flush_error,
+                       callbackArgs=(numeros, completed, spider), errbackArgs=(numeros,))
+        return d
+
+    def bulk_write(self, operations):
+        # Exécuté dans un thread du pool : ne pas toucher aux statistiques ici
+        try:
+            self.collection.bulk_write(operations, ordered=False)
+            return []
+        except BulkWriteError as e:
+            # Les opérations non ordonnées continuent après une erreur : ne renvoyer que celles en échec
+            return e.details.get('writeErrors', [])
+
+    def _flush_success(self, write_errors, numeros, completed, spider):
+        for error in write_errors:
+            logger.error("Erreur MongoDB pour %s: %s", numeros[error['index']], error.get('errmsg'))
+        self.scraping_stats.mongodb_errors += len(write_errors)
+        self.scraping_stats.mongodb_updates += len(numeros) - len(write_errors)
+        failed = {error['index'] for error in write_errors}
+        self.mark_completed(spider, [numero for i, numero in enumerate(numeros) if i not in failed and completed[i]])
+        if not write_errors:
+            logger.success("Lot de %s entreprises écrit dans MongoDB (%s)", len(numeros), spider.name)
+
+    def _flush_error(self, failure, numeros):
+        logger.error("Erreur MongoDB sur un lot de %s opérations: %s", len(numeros), failure.value)
+        self.scraping_stats.mongodb_errors += len(numeros)
     
     def close_spider(self, spider):
-        self.client.close()
-        debug_print(f"Spider '{spider.name}' terminé", "info")
-        scraping_stats.spiders_completed += 1
-        
-        # Si c'était le dernier spider, afficher le résumé
-        if scraping_stats.spiders_completed == 1:  # Ajuster selon le nombre de spiders actifs
-            scraping_stats.print_summary()
+        if self.flush_loop is not None and self.flush_loop.running:
+            self.flush_loop.stop()
+        # Dernier lot, puis attendre toutes les écritures en vol avant de fermer la connexion
+        self.flush(spider)
+        d = defer.DeferredList(list(self.pending_writes))
+        d.addCallback(lambda _: self._close(spider))
+        return d
+
+    def _close(self, spider):
+        self.threadpool.stop()
+        if self.client is not None:
+            self.client.close()
+        logger.info("Spider '%s' terminé", spider.name)
+        # Chaque crawler a ses propres statistiques : un résumé par spider
+        self.scraping_stats.print_summary(spider.name)
 
 # Configuration du crawler avec console allégée
 def configure_crawler():
     settings = get_project_settings()
     settings.set('ITEM_PIPELINES', {
+        'main.ConsultDocumentsPipeline': 200,
         'main.MongoDBPipeline': 300,
     })
+    settings.set('EXTENSIONS', {
+        'extensions.AdaptiveThrottle': 400,
+        'extensions.StatsJsonlDump': 500,
+        'extensions.ResponseArchive': 600,
+    })
+    settings.set('STATS_JSONL_FILE', STATS_JSONL_FILE)
+    settings.set('STATS_JSONL_INTERVAL', STATS_JSONL_INTERVAL)
     settings.set('USER_AGENT', 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36')
     settings.set('LOG_ENABLED', True)  # logs Scrapy par défaut
+    # Délai de départ des domaines hors THROTTLE_DOMAINS, ajusté ensuite par AdaptiveThrottle
     settings.set('DOWNLOAD_DELAY', 1)
+    settings.set('AUTOTHROTTLE_ENABLED', False)
+    settings.set('ADAPTIVE_THROTTLE_ENABLED', True)
+    settings.set('ADAPTIVE_THROTTLE_DOMAINS', THROTTLE_DOMAINS)
+    # Mémoire constante : filtre de Bloom pour les doublons, files SQLite sur disque quand JOBDIR est défini
+    settings.set('DUPEFILTER_CLASS', 'scheduler.BloomDupeFilter')
+    settings.set('DUPEFILTER_CAPACITY', DUPEFILTER_CAPACITY)
+    settings.set('DUPEFILTER_ERROR_RATE', DUPEFILTER_ERROR_RATE)
+    settings.set('SCHEDULER_DISK_QUEUE', 'scheduler.SqliteFifoQueue')
+    settings.set('SCHEDULER_START_DISK_QUEUE', 'scheduler.SqliteFifoQueue')
+    settings.set('CONSULT_DOCUMENTS_STORE', CONSULT_DOCUMENTS_STORE)
+    settings.set('CONSULT_DOCUMENTS_DIR', CONSULT_DOCUMENTS_DIR)
+    settings.set('CONSULT_DOWNLOAD_CONCURRENCY', CONSULT_DOWNLOAD_CONCURRENCY)
+    settings.set('CONSULT_DOCUMENT_MAX_BYTES', CONSULT_DOCUMENT_MAX_BYTES)
+    settings.set('MONGO_BULK_SIZE', MONGO_BULK_SIZE)
+    settings.set('MONGO_BULK_MAX_AGE', MONGO_BULK_MAX_AGE)
+    settings.set('MONGO_WRITE_THREADS', MONGO_WRITE_THREADS)
+    settings.set('MONGO_WRITE_QUEUE_SIZE', MONGO_WRITE_QUEUE_SIZE)
     return settings
 
-# Fonction principale pour exécuter les spiders
-def main():
-    debug_print("Démarrage du scraping des entreprises belges", "info")
-    debug_print("Configuration du crawler...", "debug")
-    
-    # Configurer et démarrer le crawler
+def parse_args():
+    parser = argparse.ArgumentParser(description='Scraper les entreprises belges (BCE, eJustice, NBB).')
+    parser.add_argument('--input', '-i', type=str, default=DEFAULT_INPUT_FILE,
+                        help=f"Fichier CSV des entreprises (défaut: {DEFAULT_INPUT_FILE})")
+    parser.add_argument('--spider', '-s', type=str, default='kbo', choices=sorted(SPIDERS),
+                        help='Spider à lancer (défaut: kbo)')
+    parser.add_argument('--offset', type=int, default=0,
+                        help='Nombre de lignes de données à ignorer en début de fichier')
+    parser.add_argument('--limit', type=int, default=None,
+                        help="Nombre maximum de lignes à lire après l'offset")
+    parser.add_argument('--shard-index', type=int, default=0,
+                        help='Index du shard à traiter (0 à shard-count - 1)')
+    parser.add_argument('--shard-count', type=int, default=1,
+                        help='Nombre total de shards')
+    parser.add_argument('--workers', '-w', type=int, default=1,
+                        help='Nombre de processus de crawl, chacun sur un sous-shard, au plus la concurrence maximale des domaines du spider (défaut: 1)')
+    parser.add_argument('--checkpoint', type=str, default='kbo_checkpoint.log',
+                        help="Journal de reprise des entreprises traitées (défaut: kbo_checkpoint.log, '' pour désactiver)")
+    parser.add_argument('--incremental', action='store_true',
+                        help="Ignorer les entreprises crawlées récemment et ne réécrire que celles qui ont changé (eJustice : seulement les publications postérieures à la dernière enregistrée)")
+    parser.add_argument('--incremental-ttl-days', type=float, default=INCREMENTAL_TTL / 86400,
+                        help=f"Âge minimal (en jours) avant de recrawler une entreprise (défaut: {INCREMENTAL_TTL / 86400:g})")
+    parser.add_argument('--priority-tiers', type=int, default=0,
+                        help="Crawler d'abord les entreprises actives, récentes ou jamais crawlées, en N passages sur le fichier (défaut: 0, ordre du fichier)")
+    parser.add_argument('--jobdir', type=str, default=None,
+                        help='Dossier de la file de requêtes sur disque (JOBDIR Scrapy, ex. jobs/kbo) : file SQLite et filtre de Bloom, mémoire constante et reprise après arrêt')
+    parser.add_argument('--sample-pages', type=int, default=0,
+                        help='Nombre de pages à enregistrer pour le diagnostic de structure (défaut: 0)')
+    parser.add_argument('--sample-rate', type=float, default=0.0,
+                        help='Fraction des pages à enregistrer pour le diagnostic, entre 0 et 1 (défaut: 0)')
+    parser.add_argument('--http-cache', action='store_true',
+                        help=f"Conserver les pages téléchargées dans {HTTPCACHE_DIR}/ et les revalider au lieu de les retélécharger")
+    parser.add_argument('--cache-ttl-hours', type=float, default=HTTPCACHE_TTL / 3600,
+                        help=f"Durée pendant laquelle une page en cache est réutilisée sans revalidation (défaut: {HTTPCACHE_TTL / 3600:g})")
+    parser.add_argument('--cache-max-mb', type=float, default=HTTPCACHE_MAX_BYTES / 1024 ** 2,
+                        help=f"Taille maximale du cache, les pages les moins récemment lues sont supprimées (défaut: {HTTPCACHE_MAX_BYTES / 1024 ** 2:g})")
+    parser.add_argument('--reparse-from-cache', action='store_true',
+                        help='Rejouer parse sur les pages du cache HTTP, sans aucun accès réseau')
+    parser.add_argument('--archive', action='store_true',
+                        help=f"Archiver le HTML brut de chaque page dans {ARCHIVE_DIR}/ (segments .jsonl.gz + index)")
+    parser.add_argument('--documents', type=str, default=CONSULT_DOCUMENTS_STORE, choices=['files', 'gridfs', 'none'],
+                        help=f"Stockage des documents des comptes annuels (défaut: {CONSULT_DOCUMENTS_STORE})")
+    parser.add_argument('--log-level', type=str, default='info',
+                        choices=['debug', 'fetch', 'info', 'success', 'warning', 'error'],
+                        help='Niveau minimal des messages console (défaut: info)')
+    parser.add_argument('--no-color', action='store_true',
+                        help='Désactiver les couleurs ANSI dans la console')
+    return parser.parse_args()
+
+def max_politeness_workers(settings, domains):
+    """Nombre maximal de workers dans le budget de politesse des domaines du spider.
+
+    Chaque worker garde au moins une requête en vol par domaine : au-delà de la concurrence
+    maximale d'un domaine, N workers dépasseraient le budget global.
+    """
+    limit = settings.getint('CONCURRENT_REQUESTS_PER_DOMAIN', 8)
+    for domain, options in settings.getdict('ADAPTIVE_THROTTLE_DOMAINS').items():
+        if any(domain == allowed or domain.endswith('.' + allowed) for allowed in domains):
+            limit = min(limit, options.get('max_concurrency', 4))
+    return limit
+
+
+def split_throttle_budget(domains, workers):
+    """Bornes de débit d'un worker : délais multipliés et concurrence divisée (arrondie à l'inférieur)
+    par le nombre de workers.
+
+    Le contrôle AIMD tourne dans chaque worker sans coordination : c'est la somme des bornes
+    qui respecte le budget global (concurrence totale au plus max_concurrency, délais
+    planchers multipliés par N), pas un réglage commun.
+    """
+    split = {}
+    for domain, options in domains.items():
+        options = dict(options)
+        for key in ('min_delay', 'max_delay', 'start_delay'):
+            if key in options:
+                options[key] = options[key] * workers
+        if 'max_concurrency' in options:
+            options['max_concurrency'] = max(1, options['max_concurrency'] // workers)
+        if 'min_concurrency' in options:
+            options['min_concurrency'] = max(1, min(options['min_concurrency'] // workers,
+                                                    options.get('max_concurrency', 1)))
+        split[domain] = options
+    return split
+
+
+def build_settings(args, workers=1, worker_index=None):
     settings = configure_crawler()
+    settings.set('STRUCTURE_SAMPLE_PAGES', args.sample_pages)
+    settings.set('STRUCTURE_SAMPLE_RATE', args.sample_rate)
+    if args.incremental:
+        settings.set('INCREMENTAL_ENABLED', True)
+        settings.set('INCREMENTAL_TTL', args.incremental_ttl_days * 86400)
+    settings.set('PRIORITY_TIERS', args.priority_tiers)
+    if args.jobdir:
+        # Requêtes en attente sur disque, un dossier par worker
+        settings.set('JOBDIR', args.jobdir if workers <= 1 else os.path.join(args.jobdir, f"w{worker_index}"))
+    settings.set('CONSULT_DOCUMENTS_STORE', '' if args.documents == 'none' else args.documents)
+    if args.archive:
+        settings.set('ARCHIVE_ENABLED', True)
+        settings.set('ARCHIVE_DIR', ARCHIVE_DIR)
+        settings.set('ARCHIVE_SEGMENT_BYTES', ARCHIVE_SEGMENT_BYTES)
+    if args.http_cache or args.reparse_from_cache:
+        settings.set('HTTPCACHE_ENABLED', True)
+        settings.set('HTTPCACHE_DIR', HTTPCACHE_DIR)
+        settings.set('HTTPCACHE_STORAGE', 'httpcache.EnterpriseCacheStorage')
+        settings.set('HTTPCACHE_POLICY', 'httpcache.RevalidatingCachePolicy')
+        settings.set('HTTPCACHE_EXPIRATION_SECS', int(args.cache_ttl_hours * 3600))
+        settings.set('HTTPCACHE_MAX_BYTES', int(args.cache_max_mb * 1024 ** 2))
+    if args.reparse_from_cache:
+        # Toute page absente du cache est ignorée : aucune requête ne part sur le réseau
+        settings.set('HTTPCACHE_POLICY', 'scrapy.extensions.httpcache.DummyPolicy')
+        settings.set('HTTPCACHE_IGNORE_MISSING', True)
+        settings.set('HTTPCACHE_MAX_BYTES', 0)
+        # Priorité cmdline : l'emporte sur les custom_settings du spider
+        settings.set('ROBOTSTXT_OBEY', False, priority='cmdline')
+        settings.set('DOWNLOAD_DELAY', 0)
+        settings.set('ADAPTIVE_THROTTLE_ENABLED', False)
+        settings.set('CONCURRENT_REQUESTS', 64)
+        settings.set('CONCURRENT_REQUESTS_PER_DOMAIN', 64)
+        # Ne sauter aucune entreprise pour cause de fraîcheur : on veut tout réextraire
+        settings.set('INCREMENTAL_TTL', 0)
+    if workers > 1:
+        # Budget de politesse global partagé : N workers à délai x N font le même débit qu'un seul crawler
+        settings.set('DOWNLOAD_DELAY', settings.getfloat('DOWNLOAD_DELAY') * workers)
+        per_domain = settings.getint('CONCURRENT_REQUESTS_PER_DOMAIN', 8)
+        settings.set('CONCURRENT_REQUESTS_PER_DOMAIN', max(1, per_domain // workers))
+        settings.set('ADAPTIVE_THROTTLE_DOMAINS', split_throttle_budget(settings.getdict('ADAPTIVE_THROTTLE_DOMAINS'), workers))
+        # Un fichier de stats par worker : les lignes JSON de plusieurs processus ne s'entremêlent pas
+        root, ext = os.path.splitext(settings.get('STATS_JSONL_FILE'))
+        settings.set('STATS_JSONL_FILE', f"{root}.w{worker_index}{ext}")
+    return settings
+
+
+def run_crawl(args, workers=1, worker_index=None):
+    """Lancer le spider choisi dans ce processus et renvoyer ses statistiques Scrapy"""
+    settings = build_settings(args, workers, worker_index)
+    spider_cls = SPIDERS[args.spider]
+    shard_index, shard_count, checkpoint = args.shard_index, args.shard_count, args.checkpoint or None
+    numeros = None
+    if args.reparse_from_cache:
+        # Les entreprises à rejouer sont celles du cache, pas celles du fichier d'entrée
+        numeros = cached_numeros(settings.get('HTTPCACHE_DIR'), spider_cls.name)
+        checkpoint = None
+        debug_print(f"{len(numeros)} entreprises en cache à réextraire", "info")
+    if checkpoint and spider_cls is CombinedSpider:
+        # Journal distinct de celui du spider KBO seul : kbo_checkpoint.log → kbo_checkpoint.entreprise.log
+        root, ext = os.path.splitext(checkpoint)
+        checkpoint = f"{root}.{CombinedSpider.name}{ext}"
+    if workers > 1:
+        # Sous-shards du shard demandé : crc % (S*N) == s + w*S implique crc % S == s
+        shard_index = args.shard_index + worker_index * args.shard_count
+        shard_count = args.shard_count * workers
+        if checkpoint:
+            checkpoint = worker_checkpoint_path(checkpoint, worker_index)
     process = CrawlerProcess(settings)
     
     # Ajouter les spiders au processus
     debug_print("Ajout des spiders au processus...", "info")
-    process.crawl(KboSpider)
-    # Décommenter pour activer les autres spiders
-    # process.crawl(EjusticeSpider)
-    # process.crawl(ConsultSpider)
+    spider_kwargs = {}
+    if spider_cls in (KboSpider, CombinedSpider):
+        # Le journal de reprise est indexé par numéro : réservé aux spiders KBO et combiné
+        spider_kwargs['checkpoint'] = checkpoint
+    crawler = process.create_crawler(spider_cls)
+    process.crawl(crawler, input_file=args.input, offset=args.offset, limit=args.limit,
+                  shard_index=shard_index, shard_count=shard_count, numeros=numeros, **spider_kwargs)
     
     # Démarrer le crawling
     debug_print("Démarrage du crawling...", "info")
     process.start()
+    return crawler.stats.get_stats() if crawler.stats is not None else {}
+
+
+def run_worker(args, workers, worker_index):
+    """Point d'entrée d'un processus worker : seuls les compteurs numériques sont renvoyés au lanceur"""
+    setup_logging(args.log_level, colored=not args.no_color)
+    debug_print(f"Worker {worker_index + 1}/{workers} démarré", "info")
+    stats = run_crawl(args, workers, worker_index)
+    return {key: value for key, value in stats.items()
+            if isinstance(value, numbers.Number) and not isinstance(value, bool)}
+
+
+def run_workers(args):
+    """Répartir le crawl sur args.workers processus et agréger leurs statistiques"""
+    started = time.monotonic()
+    # spawn : chaque worker démarre un interpréteur neuf (pas de réacteur ni de thread de log hérités)
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(processes=args.workers, maxtasksperchild=1) as pool:
+        results = pool.starmap(run_worker, [(args, args.workers, index) for index in range(args.workers)],
+                               chunksize=1)
+
+    total = ScrapingStats()
+    for stats in results:
+        for key, value in stats.items():
+            if key.startswith(('ipssi/', 'downloader/', 'item_', 'response_')):
+                total.stats.inc_value(key, value)
+    total.print_summary(f"{SPIDERS[args.spider].name}, {args.workers} workers")
+    elapsed = time.monotonic() - started
+    pages = total.stats.get_value('response_received_count', 0)
+    debug_print(f"{pages} pages en {elapsed:.1f}s ({pages / elapsed:.2f} pages/s au total)", "info")
+
+
+# Fonction principale pour exécuter les spiders
+def main():
+    args = parse_args()
+    setup_logging(args.log_level, colored=not args.no_color)
+    debug_print("Démarrage du scraping des entreprises belges", "info")
+    debug_print("Configuration du crawler...", "debug")
+    
+    if args.workers > 1 and not args.reparse_from_cache:
+        limit = max_politeness_workers(configure_crawler(), SPIDERS[args.spider].allowed_domains)
+        if args.workers > limit:
+            debug_print(f"{args.workers} workers dépasseraient le budget de politesse du spider {args.spider} "
+                        f"(concurrence maximale {limit}) : utiliser --workers {limit} ou moins", "error")
+            return
+    
+    if args.workers > 1:
+        debug_print(f"Lancement de {args.workers} workers (shard {args.shard_index}/{args.shard_count})", "info")
+        run_workers(args)
+    else:
+        run_crawl(args)
     
     debug_print("Processus de scraping terminé", "success")
 
@@ -0,0 +1,123 @@
+import argparse
+import json
+import multiprocessing
+import os
+import time
+import zlib
+
+from scrapy.http import HtmlResponse, Request
+
+from items import to_plain
+from utils.archive import load_latest_offsets, read_record
+from utils.debug_color import debug_print, setup_logging
+
+DEFAULT_ARCHIVE_DIR = 'archive'
+DEFAULT_OUTPUT_DIR = 'reprocessed'
+# Enregistrements par tâche : un gros segment est réparti entre plusieurs workers
+CHUNK_RECORDS = 5000
+
+
+def build_response(record):
+    request = Request(record['url'], meta={'numero_entreprise': record['numero_entreprise']})
+    return HtmlResponse(url=record['url'], body=record['body'], encoding=record.get('encoding') or 'utf-8',
+                        request=request)
+
+
+def open_collection():
+    from pymongo import MongoClient
+    from main import MONGO_COLLECTION, MONGO_DB, MONGO_URI
+    return MongoClient(MONGO_URI)[MONGO_DB][MONGO_COLLECTION]
+
+
+def reprocess_segment(task):
+    """Rejouer KboSpider.parse sur les enregistrements retenus d'un segment (exécuté dans un worker)"""
+    segment_path, chunk, offsets, output_dir, to_mongo, bulk_size = task
+    # Import dans le worker : chaque processus a son propre spider
+    from pymongo import UpdateOne
+    from main import kbo_document
+    from spiders import KboSpider
+
+    spider = KboSpider()
+    collection = open_collection() if to_mongo else None
+    output = None
+    if output_dir:
+        name = os.path.basename(segment_path).replace('.jsonl.gz', f'.{chunk:04d}.items.jsonl')
+        output = open(os.path.join(output_dir, name), 'w', encoding='utf-8')
+
+    pages = items = errors = 0
+    operations = []
+    try:
+        with open(segment_path, 'rb') as f:
+            # Offsets triés : lecture séquentielle du segment
+            for offset, length in offsets:
+                try:
+                    record = read_record(f, offset, length)
+                except (zlib.error, ValueError, EOFError):
+                    # Enregistrement tronqué par un arrêt brutal du crawl
+                    errors += 1
+                    continue
+                pages += 1
+                for item in spider.parse(build_response(record)):
+                    items += 1
+                    if output is not None:
+                        output.write(json.dumps(item, ensure_ascii=False, default=to_plain) + '\n')
+                    if collection is not None:
+                        # Publications et comptes annuels conservés ; sous-enregistrements encodés directement en BSON
+                        operations.append(UpdateOne({'numero_entreprise': item['numero_entreprise']},
+                                                    {'$set': kbo_document(item)}, upsert=True))
+                        if len(operations) >= bulk_size:
+                            collection.bulk_write(operations, ordered=False)
+                            operations = []
+        if operations:
+            collection.bulk_write(operations, ordered=False)
+    finally:
+        if output is not None:
+            output.close()
+    return segment_path, pages, items, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rejouer KboSpider.parse sur l'archive brute des pages KBO, sans recrawler.")
+    parser.add_argument('--archive', '-a', type=str, default=DEFAULT_ARCHIVE_DIR,
+                        help=f"Dossier des segments archivés (défaut: {DEFAULT_ARCHIVE_DIR})")
+    parser.add_argument('--workers', '-w', type=int, default=os.cpu_count() or 1,
+                        help='Nombre de processus (défaut: nombre de cœurs)')
+    parser.add_argument('--output', '-o', type=str, default=DEFAULT_OUTPUT_DIR,
+                        help=f"Dossier des items extraits, un JSONL par lot de {CHUNK_RECORDS} pages (défaut: {DEFAULT_OUTPUT_DIR}, '' pour aucun)")
+    parser.add_argument('--mongo', action='store_true',
+                        help='Mettre à jour les entreprises dans MongoDB ($set des champs extraits)')
+    parser.add_argument('--bulk-size', type=int, default=500,
+                        help='Taille des lots d\'écriture MongoDB (défaut: 500)')
+    args = parser.parse_args()
+
+    by_segment = load_latest_offsets(args.archive)
+    if not by_segment:
+        debug_print(f"Aucun segment indexé dans {args.archive}", "error")
+        return
+    total = sum(len(offsets) for offsets in by_segment.values())
+    debug_print(f"{total} entreprises dans {len(by_segment)} segments, {args.workers} workers", "info")
+    if args.output:
+        os.makedirs(args.output, exist_ok=True)
+
+    tasks = [(segment, start // CHUNK_RECORDS, offsets[start:start + CHUNK_RECORDS], args.output, args.mongo, args.bulk_size)
+             for segment, offsets in sorted(by_segment.items())
+             for start in range(0, len(offsets), CHUNK_RECORDS)]
+    started = time.monotonic()
+    pages = items = errors = 0
+    # Les messages de debug du spider ralentiraient le retraitement : seuls les avertissements sont affichés
+    setup_logging('warning')
+    with multiprocessing.get_context('spawn').Pool(args.workers, initializer=setup_logging,
+                                                   initargs=('warning',)) as pool:
+        for segment, segment_pages, segment_items, segment_errors in pool.imap_unordered(reprocess_segment, tasks):
+            pages += segment_pages
+            items += segment_items
+            errors += segment_errors
+    setup_logging('info')
+
+    elapsed = time.monotonic() - started
+    debug_print(f"{pages} pages retraitées en {elapsed:.1f}s ({pages / elapsed:.1f} pages/s), "
+                f"{items} items, {errors} enregistrements illisibles", "success")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+import hashlib
+import math
+import os
+import pickle
+import sqlite3
+import time
+
+from scrapy.dupefilters import BaseDupeFilter
+from scrapy.utils.job import job_dir
+from scrapy.utils.request import request_from_dict
+
+from utils.debug_color import get_logger
+
+logger = get_logger('scheduler')
+
+# Nom du fichier du filtre de Bloom dans JOBDIR
+BLOOM_FILE = 'requests.bloom'
+
+
+class SqliteFifoQueue:
+    """File FIFO de requêtes sur disque, dans une base SQLite (SCHEDULER_DISK_QUEUE avec JOBDIR).
+
+    Les requêtes sont sérialisées comme dans les files disque de Scrapy (to_dict + pickle).
+    Les écritures sont groupées dans une transaction validée toutes les SQLITE_QUEUE_COMMIT_OPS
+    opérations ou SQLITE_QUEUE_COMMIT_SECS secondes, au lieu d'un commit (et d'un fsync) par
+    requête. Seule la taille de la file est gardée en mémoire.
+    """
+
+    def __init__(self, crawler, key, commit_ops=1000, commit_secs=5.0):
+        self.spider = crawler.spider
+        self.path = key
+        self.commit_ops = commit_ops
+        self.commit_secs = commit_secs
+        os.makedirs(os.path.dirname(key) or '.', exist_ok=True)
+        self.db = sqlite3.connect(key, isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS queue (id INTEGER PRIMARY KEY AUTOINCREMENT, data BLOB NOT NULL)')
+        self.size = self.db.execute('SELECT COUNT(*) FROM queue').fetchone()[0]
+        self.uncommitted = 0
+        self.last_commit = time.monotonic()
+        self.db.execute('BEGIN')
+
+    @classmethod
+    def from_crawler(cls, crawler, key, *args, **kwargs):
+        return cls(crawler, key,
+                   commit_ops=crawler.settings.getint('SQLITE_QUEUE_COMMIT_OPS', 1000),
+                   commit_secs=crawler.settings.getfloat('SQLITE_QUEUE_COMMIT_SECS', 5.0))
+
+    def push(self, request):
+        try:
+            data = pickle.dumps(request.to_dict(spider=self.spider), protocol=4)
+        except (pickle.PicklingError, AttributeError, TypeError) as e:
+            # ValueError : le scheduler garde alors la requête dans la file mémoire
+            raise ValueError(str(e)) from e
+        self.db.execute('INSERT INTO queue (data) VALUES (?)', (data,))
+        self.size += 1
+        self.written()
+
+    def pop(self):
+        row = self.db.execute('SELECT id, data FROM queue ORDER BY id LIMIT 1').fetchone()
+        if row is None:
+            return None
+        self.db.execute('DELETE FROM queue WHERE id = ?', (row[0],))
+        self.size -= 1
+        self.written()
+        return request_from_dict(pickle.loads(row[1]), spider=self.spider)
+
+    def peek(self):
+        row = self.db.execute('SELECT data FROM queue ORDER BY id LIMIT 1').fetchone()
+        return request_from_dict(pickle.loads(row[0]), spider=self.spider) if row else None
+
+    def written(self):
+        self.uncommitted += 1
+        if self.uncommitted >= self.commit_ops or time.monotonic() - self.last_commit >= self.commit_secs:
+            self.db.execute('COMMIT')
+            self.db.execute('BEGIN')
+            self.uncommitted = 0
+            self.last_commit = time.monotonic()
+
+    def close(self):
+        self.db.execute('COMMIT')
+        # Une file vide ne laisse pas de fichier : le scheduler ne la rouvrira pas
+        empty = self.size == 0
+        self.db.close()
+        if empty:
+            for suffix in ('', '-wal', '-shm'):
+                try:
+                    os.remove(self.path + suffix)
+                except OSError:
+                    pass
+
+    def __len__(self):
+        return self.size
+
+
+class BloomFilter:
+    """Filtre de Bloom de taille fixe, calculée pour capacity éléments au taux d'erreur error_rate"""
+
+    def __init__(self, capacity, error_rate):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.bits = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.bits / capacity * math.log(2)))
+        self.array = bytearray((self.bits + 7) // 8)
+        self.count = 0
+
+    def positions(self, key):
+        # Double hachage (Kirsch-Mitzenmacher) à partir d'un seul condensé de 16 octets
+        digest = hashlib.blake2b(key, digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.bits for i in range(self.hashes)]
+
+    def add(self, key):
+        """Ajouter key ; renvoie True si elle était (probablement) déjà présente"""
+        present = True
+        array = self.array
+        for position in self.positions(key):
+            byte, mask = position >> 3, 1 << (position & 7)
+            if not array[byte] & mask:
+                present = False
+                array[byte] |= mask
+        if not present:
+            self.count += 1
+        return present
+
+    def save(self, path):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(f"{self.bits} {self.hashes} {self.count}\n".encode('ascii'))
+            f.write(self.array)
+        os.replace(tmp_path, path)
+
+    def load(self, path):
+        """Recharger un filtre sauvegardé ; False s'il a été créé avec d'autres dimensions"""
+        with open(path, 'rb') as f:
+            bits, hashes, count = (int(value) for value in f.readline().split())
+            if (bits, hashes) != (self.bits, self.hashes):
+                return False
+            f.readinto(self.array)
+        self.count = count
+        return True
+
+
+class BloomDupeFilter(BaseDupeFilter):
+    """Filtre des requêtes déjà vues (DUPEFILTER_CLASS) en mémoire constante.
+
+    Les empreintes ne sont pas conservées : un filtre de Bloom dimensionné par
+    DUPEFILTER_CAPACITY et DUPEFILTER_ERROR_RATE (10 millions d'URL à 1e-6 ≈ 36 Mo)
+    remplace l'ensemble de Scrapy, qui grossit avec chaque URL. Avec JOBDIR, le
+    filtre est sauvegardé à la fermeture et rechargé à la reprise.
+    """
+
+    def __init__(self, path=None, capacity=10_000_000, error_rate=1e-6, debug=False, fingerprinter=None, stats=None):
+        self.path = path
+        self.debug = debug
+        self.fingerprinter = fingerprinter
+        self.stats = stats
+        self.logdupes = True
+        self.bloom = BloomFilter(capacity, error_rate)
+        if path and os.path.exists(path):
+            if self.bloom.load(path):
+                logger.info("Filtre de requêtes rechargé : %s requêtes déjà vues", self.bloom.count)
+            else:
+                logger.warning("Filtre %s créé avec une autre capacité, ignoré", path)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        directory = job_dir(crawler.settings)
+        return cls(
+            path=os.path.join(directory, BLOOM_FILE) if directory else None,
+            capacity=crawler.settings.getint('DUPEFILTER_CAPACITY', 10_000_000),
+            error_rate=crawler.settings.getfloat('DUPEFILTER_ERROR_RATE', 1e-6),
+            debug=crawler.settings.getbool('DUPEFILTER_DEBUG'),
+            fingerprinter=crawler.request_fingerprinter,
+            stats=crawler.stats,
+        )
+
+    def request_seen(self, request):
+        seen = self.bloom.add(self.fingerprinter.fingerprint(request))
+        if not seen and self.bloom.count == self.bloom.capacity + 1:
+            logger.warning("Plus de %s requêtes vues : le taux de faux doublons dépasse %s, augmenter DUPEFILTER_CAPACITY",
+                           self.bloom.capacity, self.bloom.error_rate)
+        return seen
+
+    def close(self, reason):
+        if not self.path:
+            return
+        if reason == 'finished':
+            # Job terminé : le prochain lancement avec le même JOBDIR repart d'un filtre vide
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            return
+        self.bloom.save(self.path)
+
+    def log(self, request, spider):
+        if self.debug:
+            logger.debug("Requête en double filtrée : %s", request)
+        elif self.logdupes:
+            logger.debug("Requête en double filtrée : %s (les suivantes ne sont plus affichées)", request)
+            self.logdupes = False
+        if self.stats is not None:
+            self.stats.inc_value('dupefilter/filtered')
@@ -1,36 +1,214 @@
+import gzip
+import json
+import os
+import re
+import time
+import zlib
+from urllib.parse import urlparse
 import scrapy
-import csv
-from utils.debug_color import debug_print
-from items import EntrepriseItem
+from scrapy import signals
+from scrapy.exceptions import DontCloseSpider
+from twisted.internet import threads
+from utils.debug_color import get_logger
+from utils.enterprise_source import DEFAULT_INPUT_FILE, iter_enterprise_rows, iter_numeros_entreprise, shard_of
+from utils.checkpoint import CrawlCheckpoint
+from utils.kbo_sections import SectionIndex
+from utils.kbo_selectors import (
+    ACTIVE_VALUE, ADDRESS_TEXTS, CELLS, EXTERNAL_LINKS, FIRST_CELL_TEXT, FIRST_CELL_TEXTS, FIRST_VALUE_TEXT,
+    FONCTIONS_COUNT, FONCTIONS_TABLE, FONCTIONS_TABLE_AFTER_COUNT, FONCTIONS_TABLE_ANY, HREF, KEY_CELL_TEXT,
+    NACE_CODE_LINK, NBSP_CELLS, NESTED_ROWS, OWN_TEXT, ROWS, SECOND_CELL_TEXTS, STRONG_VALUE, TEXTS,
+    TEXTS_OUTSIDE_UPD, UPD_TEXT, VALUE_TEXTS, VALUE_UPD_TEXT, all_of, first, first_of, text,
+)
+from utils.priority import enterprise_priority, priority_tier
+from items import Autorisation, EntrepriseItem, Fonction, Lien, LienExterne, NaceCode
+
+logger = get_logger('spiders')
+
+# Bornes (en ms) des histogrammes de latence
+LATENCY_BUCKETS_MS = (50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+# En-têtes des sections NACE de la fiche KBO ("Activités TVA Code Nacebel version 2025")
+NACE_SECTION = re.compile(r'Activités (TVA|ONSS) Code Nacebel version (\d{4})')
+NACE_CODE = re.compile(r'\d+\.\d+')
+NACE_VERSIONS = ('2025', '2008', '2003')
+NACE_TYPES = ('TVA', 'ONSS')
+
+
+class StatField:
+    """Compteur stocké dans le StatsCollector du crawler, sous la clé "ipssi/<nom>" """
+
+    def __set_name__(self, owner, name):
+        self.key = f"{owner.prefix}/{name}"
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        return obj.stats.get_value(self.key, 0)
+
+    def __set__(self, obj, value):
+        obj.stats.set_value(self.key, value)
+
+
+class LocalStats:
+    """Équivalent minimal du StatsCollector pour un spider utilisé hors crawler (benchmark, retraitement)"""
 
-class ScrapingStats:
     def __init__(self):
-        self.requests_total = 0
-        self.requests_success = 0
-        self.requests_failed = 0
-        self.items_extracted = 0
-        self.mongodb_updates = 0
-        self.mongodb_errors = 0
-        self.spiders_completed = 0
-    
-    def print_summary(self):
-        debug_print("=== Résumé du scraping ===", "info")
-        debug_print(f"Requêtes totales : {self.requests_total}", "info")
-        debug_print(f"Requêtes réussies : {self.requests_success}", "success")
-        debug_print(f"Requêtes échouées : {self.requests_failed}", "error")
-        debug_print(f"Éléments extraits : {self.items_extracted}", "info")
-        debug_print(f"Mises à jour MongoDB : {self.mongodb_updates}", "info")
-        debug_print(f"Erreurs MongoDB : {self.mongodb_errors}", "warning")
-        debug_print(f"Spiders complétés : {self.spiders_completed}", "success")
-        debug_print("========================", "info")
-
-# Instance globale pour les statistiques
-scraping_stats = ScrapingStats()
+        self._stats = {}
+
+    def get_value(self, key, default=None):
+        return self._stats.get(key, default)
+
+    def set_value(self, key, value):
+        self._stats[key] = value
+
+    def inc_value(self, key, count=1, start=0):
+        self._stats[key] = self._stats.get(key, start) + count
+
+    def get_stats(self):
+        return self._stats
+
+
+class ScrapingStats:
+    """Statistiques d'un spider, adossées aux stats Scrapy de son crawler (une instance par spider)"""
+    prefix = 'ipssi'
+
+    requests_total = StatField()
+    requests_success = StatField()
+    requests_failed = StatField()
+    items_extracted = StatField()
+    mongodb_updates = StatField()
+    mongodb_errors = StatField()
+    items_unchanged = StatField()
+    requests_skipped = StatField()
+    publications_extracted = StatField()
+    documents_downloaded = StatField()
+    documents_failed = StatField()
+
+    def __init__(self, crawler=None):
+        # Le StatsCollector est lu à chaque accès : selon la version de Scrapy, crawler.stats
+        # n'existe qu'au démarrage du crawl, après la création du spider et des pipelines
+        self.crawler = crawler
+        self.local_stats = LocalStats() if crawler is None else None
+
+    @property
+    def stats(self):
+        return self.crawler.stats if self.crawler is not None else self.local_stats
+
+    def observe(self, name, seconds):
+        """Ajouter une durée à l'histogramme "<nom>_ms" (compteurs cumulés par borne + somme et nombre)"""
+        if seconds is None:
+            return
+        value_ms = seconds * 1000
+        key = f"{self.prefix}/{name}_ms"
+        for bound in LATENCY_BUCKETS_MS:
+            if value_ms <= bound:
+                self.stats.inc_value(f"{key}/le_{bound}")
+                break
+        else:
+            self.stats.inc_value(f"{key}/le_inf")
+        self.stats.inc_value(f"{key}/count")
+        self.stats.inc_value(f"{key}/sum", value_ms)
 
+    def mean(self, name):
+        count = self.stats.get_value(f"{self.prefix}/{name}_ms/count", 0)
+        return self.stats.get_value(f"{self.prefix}/{name}_ms/sum", 0) / count if count else None
+    
+    def print_summary(self, spider_name=None):
+        logger.info("=== Résumé du scraping%s ===", f" ({spider_name})" if spider_name else "")
+        logger.info("Requêtes totales : %s", self.requests_total)
+        logger.success("Requêtes réussies : %s", self.requests_success)
+        logger.error("Requêtes échouées : %s", self.requests_failed)
+        logger.info("Éléments extraits : %s", self.items_extracted)
+        logger.info("Octets téléchargés : %s", self.stats.get_value('downloader/response_bytes', 0))
+        logger.info("Mises à jour MongoDB : %s", self.mongodb_updates)
+        logger.warning("Erreurs MongoDB : %s", self.mongodb_errors)
+        logger.info("Items inchangés : %s", self.items_unchanged)
+        logger.info("Requêtes évitées (checkpoint/fraîcheur) : %s", self.requests_skipped)
+        if self.documents_downloaded or self.documents_failed:
+            logger.info("Documents téléchargés : %s (%s échecs, %.1f Mo)", self.documents_downloaded,
+                        self.documents_failed, self.stats.get_value(f"{self.prefix}/document_bytes", 0) / 1e6)
+        for name in ('latency', 'mongodb_write_latency'):
+            mean = self.mean(name)
+            if mean is not None:
+                logger.info("Moyenne %s : %.1f ms", name, mean)
+        logger.info("========================")
+
+
+class EnterpriseSpider(scrapy.Spider):
+    """Base des spiders qui parcourent les entreprises du fichier d'entrée (ou une liste fournie)"""
+    
+    # Nombre de paliers de priorité (PRIORITY_TIERS), 0 = ordre du fichier d'entrée
+    priority_tiers = 0
+    
+    def __init__(self, input_file=DEFAULT_INPUT_FILE, offset=0, limit=None,
+                 shard_index=0, shard_count=1, numeros=None, *args, **kwargs):
+        super(EnterpriseSpider, self).__init__(*args, **kwargs)
+        # Les arguments -a de Scrapy arrivent sous forme de chaînes
+        self.input_file = input_file
+        self.offset = int(offset or 0)
+        self.limit = int(limit) if limit not in (None, '') else None
+        self.shard_index = int(shard_index or 0)
+        self.shard_count = int(shard_count or 1)
+        # Liste explicite de numéros (ex. pages du cache HTTP) à la place du fichier d'entrée
+        self.numeros = numeros
+        # Journal de reprise éventuel (voir KboSpider et CombinedSpider)
+        self.checkpoint = None
+        # Remplacées par les stats du crawler dans from_crawler
+        self.scraping_stats = ScrapingStats()
+        
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super(EnterpriseSpider, cls).from_crawler(crawler, *args, **kwargs)
+        spider.scraping_stats = ScrapingStats(crawler)
+        spider.priority_tiers = crawler.settings.getint('PRIORITY_TIERS', 0)
+        return spider
+        
+    def iter_numeros_entreprise(self):
+        if self.numeros is not None:
+            return (numero for numero in self.numeros
+                    if self.shard_count <= 1 or shard_of(numero, self.shard_count) == self.shard_index)
+        # Lecture paresseuse : la première requête part avant la fin de la lecture du fichier
+        return iter_numeros_entreprise(self.input_file, self.offset, self.limit,
+                                       self.shard_index, self.shard_count)
+    
+    def is_already_done(self, numero):
+        if self.checkpoint and self.checkpoint.is_done(numero):
+            return True
+        # Index de fraîcheur attaché par la pipeline MongoDB en mode incrémental
+        freshness = getattr(self, 'freshness', None)
+        return freshness is not None and freshness.is_fresh(numero, self.freshness_ttl)
+    
+    def iter_prioritized(self):
+        """Numéros à crawler avec leur priorité de requête Scrapy.
+
+        Sans paliers, ordre du fichier et priorité 0. Avec paliers, le fichier est relu une
+        fois par palier (du plus au moins prioritaire) : le scheduler ne voit qu'une fenêtre
+        des requêtes de départ, trier cette fenêtre ne suffirait pas à faire passer les
+        entreprises actives en premier. La mémoire reste indépendante de la taille du fichier.
+        """
+        if not self.priority_tiers or self.numeros is not None:
+            for numero in self.iter_numeros_entreprise():
+                yield numero, 0
+            return
+        # Index de fraîcheur attaché par la pipeline MongoDB : date du dernier crawl connu
+        freshness = getattr(self, 'freshness', None)
+        now = time.time()
+        try:
+            for tier in range(self.priority_tiers):
+                count = 0
+                for numero, row in iter_enterprise_rows(self.input_file, self.offset, self.limit,
+                                                        self.shard_index, self.shard_count):
+                    priority = enterprise_priority(row, freshness.crawled_at(numero) if freshness else None, now)
+                    if priority_tier(priority, self.priority_tiers) == tier:
+                        count += 1
+                        yield numero, priority
+                logger.info("Palier de priorité %s/%s : %s entreprises", tier + 1, self.priority_tiers, count)
+        except FileNotFoundError:
+            logger.error("Fichier d'entrée introuvable: %s", self.input_file)
 
 
 # Spider 1: KBO Spider
-class KboSpider(scrapy.Spider):
+class KboSpider(EnterpriseSpider):
     name = 'kbo_spider'
     allowed_domains = ['kbopub.economie.fgov.be']
     
@@ -40,198 +218,195 @@ class KboSpider(scrapy.Spider):
         'ROBOTSTXT_OBEY': True
     }
     
-    def __init__(self, *args, **kwargs):
-        super(KboSpider, self).__init__(*args, **kwargs)
-        self.numeros_entreprise = self.load_numeros_entreprise()
-        debug_print(f"KBO Spider initialisé avec {len(self.numeros_entreprise)} entreprises", "info")
+    # Échantillonnage des diagnostics de structure (désactivé par défaut, voir STRUCTURE_SAMPLE_*)
+    structure_sample_pages = 0
+    structure_sample_rate = 0.0
+    structure_sample_dir = 'debug_pages'
+    
+    def __init__(self, input_file=DEFAULT_INPUT_FILE, offset=0, limit=None,
+                 shard_index=0, shard_count=1, checkpoint=None, numeros=None, *args, **kwargs):
+        super(KboSpider, self).__init__(input_file, offset, limit, shard_index, shard_count, numeros,
+                                        *args, **kwargs)
+        # Journal de reprise : les entreprises déjà traitées sont sautées au redémarrage
+        self.checkpoint = CrawlCheckpoint(checkpoint) if checkpoint else None
+        self.structure_samples = 0
+        logger.info("KBO Spider initialisé sur %s (offset=%s, limit=%s, shard=%s/%s)",
+                    self.input_file, self.offset, self.limit, self.shard_index, self.shard_count)
         
-    def load_numeros_entreprise(self):
-        numeros = []
-        try:
-            with open('enterprise_cropped.csv', 'r') as f:
-                csv_reader = csv.reader(f)
-                next(csv_reader)  # Ignorer l'en-tête
-                for row in csv_reader:
-                    if row and len(row) > 0 and row[0].strip('"'):
-                        numero = row[0].strip('"')
-                        # Formater le numéro pour enlever les points
-                        numero = numero.replace('.', '')
-                        numeros.append(numero)
-            debug_print(f"Chargé {len(numeros)} numéros d'entreprise", "success")
-            return numeros
-        except Exception as e:
-            debug_print(f"Erreur lors du chargement des numéros d'entreprise: {e}", "error")
-            return []
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super(KboSpider, cls).from_crawler(crawler, *args, **kwargs)
+        spider.structure_sample_pages = crawler.settings.getint('STRUCTURE_SAMPLE_PAGES', 0)
+        spider.structure_sample_rate = crawler.settings.getfloat('STRUCTURE_SAMPLE_RATE', 0.0)
+        spider.structure_sample_dir = crawler.settings.get('STRUCTURE_SAMPLE_DIR', cls.structure_sample_dir)
+        return spider
         
     def start_requests(self):
-        for i, numero in enumerate(self.numeros_entreprise):
+        skipped = 0
+        for i, (numero, priority) in enumerate(self.iter_prioritized()):
             # S'assurer que le format est correct (10 chiffres sans points)
             numero_clean = numero.replace('.', '')
             
-            url = f'https://kbopub.economie.fgov.be/kbopub/toonondernemingps.html?ondernemingsnummer={numero_clean}&lang=fr'
+            if self.is_already_done(numero_clean):
+                skipped += 1
+                self.scraping_stats.requests_skipped += 1
+                if skipped % 10000 == 0:
+                    logger.info("%s entreprises déjà traitées ignorées (checkpoint/fraîcheur)", skipped)
+                continue
             
             if i % 10 == 0:  # Afficher seulement tous les 10 pour alléger
-                debug_print(f"Requête KBO [{i+1}/{len(self.numeros_entreprise)}] pour {numero_clean}", "fetch")
+                logger.fetch("Requête KBO [%s] pour %s", i+1, numero_clean)
             
-            yield scrapy.Request(
-                url=url,
-                callback=self.parse,
-                headers={
-                    'Accept-Language': 'fr-FR,fr;q=0.9',
-                    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-                },
-                meta={'numero_entreprise': numero_clean},
-                errback=self.errback_http
-            )
-            scraping_stats.requests_total += 1
+            yield self.enterprise_request(numero_clean, priority)
+            self.scraping_stats.requests_total += 1
+    
+    def enterprise_request(self, numero, priority=0):
+        url = f'https://kbopub.economie.fgov.be/kbopub/toonondernemingps.html?ondernemingsnummer={numero}&lang=fr'
+        return scrapy.Request(
+            url=url,
+            callback=self.parse,
+            headers={
+                'Accept-Language': 'fr-FR,fr;q=0.9',
+                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+            },
+            meta={'numero_entreprise': numero},
+            errback=self.errback_http,
+            priority=priority
+        )
     
     def errback_http(self, failure):
         # Appelé lorsqu'une erreur HTTP se produit
         request = failure.request
         numero_entreprise = request.meta['numero_entreprise']
-        debug_print(f"Échec de la requête pour l'entreprise {numero_entreprise}: {failure.value}", "error")
-        scraping_stats.requests_failed += 1
+        logger.error("Échec de la requête pour l'entreprise %s: %s", numero_entreprise, failure.value)
+        self.scraping_stats.requests_failed += 1
+        if self.checkpoint:
+            self.checkpoint.mark_failed(numero_entreprise)
+    
+    def closed(self, reason):
+        if self.checkpoint:
+            self.checkpoint.close()
     
     def parse(self, response):
         # Traitement d'une réponse réussie
-        scraping_stats.requests_success += 1
+        self.scraping_stats.requests_success += 1
+        self.scraping_stats.observe('latency', response.meta.get('download_latency'))
         
         numero_entreprise = response.meta['numero_entreprise']
         
         # Vérifier que le numéro d'entreprise est valide
         if not numero_entreprise or numero_entreprise == "EnterpriseNumber":
-            debug_print(f"Numéro d'entreprise invalide: {numero_entreprise}", "error")
+            logger.error("Numéro d'entreprise invalide: %s", numero_entreprise)
             return
         
-        # Analyser la structure de la page si c'est l'une des premières requêtes
-        if scraping_stats.requests_success <= 2:
+        # Analyser la structure de la page seulement si elle fait partie de l'échantillon
+        if self.should_sample_structure(numero_entreprise):
             self.analyze_page_structure(response)
         
+        # Découper la page en sections une seule fois pour tous les extracteurs
+        sections = SectionIndex(response)
+        
         # Créer un nouvel item pour cette entreprise
         item = EntrepriseItem()
         item['numero_entreprise'] = numero_entreprise
         
         # Extraire les données par section avec gestion d'erreurs
         try:
-            generalites = self.extract_generalites(response)
+            generalites = self.extract_generalites(response, sections)
             if generalites:
                 item['generalites'] = generalites
-                debug_print(f"Généralités extraites avec succès", "success")
+                logger.debug("Généralités extraites avec succès")
             else:
                 item['generalites'] = {}
         except Exception as e:
-            debug_print(f"Erreur lors de l'extraction des généralités: {str(e)}", "error")
+            logger.error("Erreur lors de l'extraction des généralités: %s", str(e))
             item['generalites'] = {}
         
         try:
-            fonctions = self.extract_fonctions(response)
+            fonctions = self.extract_fonctions(response, sections)
             if fonctions:
                 item['fonctions'] = fonctions
-                debug_print(f"{len(fonctions)} fonctions extraites", "success")
+                logger.debug("%s fonctions extraites", len(fonctions))
             else:
                 item['fonctions'] = []
         except Exception as e:
-            debug_print(f"Erreur lors de l'extraction des fonctions: {str(e)}", "error")
+            logger.error("Erreur lors de l'extraction des fonctions: %s", str(e))
             item['fonctions'] = []
         
         try:
-            qualites = self.extract_qualites(response)
+            qualites = self.extract_qualites(response, sections)
             if qualites:
                 item['qualites'] = qualites
-                debug_print(f"{len(qualites)} qualités extraites", "success")
+                logger.debug("%s qualités extraites", len(qualites))
             else:
                 item['qualites'] = []
         except Exception as e:
-            debug_print(f"Erreur lors de l'extraction des qualités: {str(e)}", "error")
+            logger.error("Erreur lors de l'extraction des qualités: %s", str(e))
             item['qualites'] = []
         
         try:
-            capacites = self.extract_capacites_entrepreneuriales(response)
+            capacites = self.extract_capacites_entrepreneuriales(response, sections)
             if capacites:
                 item['capacites_entrepreneuriales'] = capacites
-                debug_print(f"{len(capacites)} capacités entrepreneuriales extraites", "success")
+                logger.debug("%s capacités entrepreneuriales extraites", len(capacites))
             else:
                 item['capacites_entrepreneuriales'] = []
         except Exception as e:
-            debug_print(f"Erreur lors de l'extraction des capacités: {str(e)}", "error")
+            logger.error("Erreur lors de l'extraction des capacités: %s", str(e))
             item['capacites_entrepreneuriales'] = []
         
         try:
-            autorisations = self.extract_autorisations(response)
+            autorisations = self.extract_autorisations(response, sections)
             if autorisations:
                 item['autorisations'] = autorisations
-                debug_print(f"{len(autorisations)} autorisations extraites", "success")
+                logger.debug("%s autorisations extraites", len(autorisations))
             else:
                 item['autorisations'] = []
         except Exception as e:
-            debug_print(f"Erreur lors de l'extraction des autorisations: {str(e)}", "error")
+            logger.error("Erreur lors de l'extraction des autorisations: %s", str(e))
             item['autorisations'] = []
         
-        # NACE codes
-        try:
-            nace_2025 = self.extract_nace_2025(response)
-            if nace_2025:
-                item['nace_2025'] = nace_2025
-                debug_print(f"{len(nace_2025)} codes NACE 2025 extraits", "success")
-            else:
-                item['nace_2025'] = []
-        except Exception as e:
-            debug_print(f"Erreur lors de l'extraction des codes NACE 2025: {str(e)}", "error")
-            item['nace_2025'] = []
-        
-        try:
-            nace_2008 = self.extract_nace_2008(response)
-            if nace_2008:
-                item['nace_2008'] = nace_2008
-                debug_print(f"{len(nace_2008)} codes NACE 2008 extraits", "success")
-            else:
-                item['nace_2008'] = []
-        except Exception as e:
-            debug_print(f"Erreur lors de l'extraction des codes NACE 2008: {str(e)}", "error")
-            item['nace_2008'] = []
-        
+        # Codes NACE de toutes les versions en un seul passage
         try:
-            nace_2003 = self.extract_nace_2003(response)
-            if nace_2003:
-                item['nace_2003'] = nace_2003
-                debug_print(f"{len(nace_2003)} codes NACE 2003 extraits", "success")
-            else:
-                item['nace_2003'] = []
+            nace = self.extract_nace(response, sections)
         except Exception as e:
-            debug_print(f"Erreur lors de l'extraction des codes NACE 2003: {str(e)}", "error")
-            item['nace_2003'] = []
+            logger.error("Erreur lors de l'extraction des codes NACE: %s", str(e))
+            nace = {}
+        for version in NACE_VERSIONS:
+            item[f'nace_{version}'] = nace.get(version, [])
+            logger.debug("%s codes NACE %s extraits", len(item[f'nace_{version}']), version)
         
         try:
-            donnees_financieres = self.extract_donnees_financieres(response)
+            donnees_financieres = self.extract_donnees_financieres(response, sections)
             if donnees_financieres:
                 item['donnees_financieres'] = donnees_financieres
-                debug_print(f"Données financières extraites avec succès", "success")
+                logger.debug("Données financières extraites avec succès")
             else:
                 item['donnees_financieres'] = {}
         except Exception as e:
-            debug_print(f"Erreur lors de l'extraction des données financières: {str(e)}", "error")
+            logger.error("Erreur lors de l'extraction des données financières: %s", str(e))
             item['donnees_financieres'] = {}
         
         try:
-            liens_entites = self.extract_liens_entites(response)
+            liens_entites = self.extract_liens_entites(response, sections)
             if liens_entites:
                 item['liens_entites'] = liens_entites
-                debug_print(f"{len(liens_entites)} liens entre entités extraits", "success")
+                logger.debug("%s liens entre entités extraits", len(liens_entites))
             else:
                 item['liens_entites'] = []
         except Exception as e:
-            debug_print(f"Erreur lors de l'extraction des liens entre entités: {str(e)}", "error")
+            logger.error("Erreur lors de l'extraction des liens entre entités: %s", str(e))
             item['liens_entites'] = []
         
         try:
-            liens_externes = self.extract_liens_externes(response)
+            liens_externes = self.extract_liens_externes(response, sections)
             if liens_externes:
                 item['liens_externes'] = liens_externes
-                debug_print(f"{len(liens_externes)} liens externes extraits", "success")
+                logger.debug("%s liens externes extraits", len(liens_externes))
             else:
                 item['liens_externes'] = []
         except Exception as e:
-            debug_print(f"Erreur lors de l'extraction des liens externes: {str(e)}", "error")
+            logger.error("Erreur lors de l'extraction des liens externes: %s", str(e))
             item['liens_externes'] = []
         
         # Champs pour les autres spider (à remplir ultérieurement)
@@ -240,46 +415,64 @@ class KboSpider(scrapy.Spider):
         
         # Si des données ont été extraites, yielder l'item
         if generalites or any(isinstance(value, list) and value for value in item.values()):
-            debug_print(f"Données extraites pour l'entreprise {numero_entreprise}", "success")
-            scraping_stats.items_extracted += 1
+            logger.debug("Données extraites pour l'entreprise %s", numero_entreprise)
+            self.scraping_stats.items_extracted += 1
             yield item
         else:
-            debug_print(f"Aucune donnée valide extraite pour {numero_entreprise}", "warning") 
+            logger.warning("Aucune donnée valide extraite pour %s", numero_entreprise) 
+            # Sans item, rien ne passera par la pipeline : marquer l'entreprise comme traitée ici
+            if self.checkpoint:
+                self.checkpoint.mark_completed(numero_entreprise)
+    
+    def should_sample_structure(self, numero):
+        """Les N premières pages du spider, puis un pourcentage stable des numéros"""
+        if self.structure_samples < self.structure_sample_pages:
+            return True
+        if self.structure_sample_rate > 0:
+            return zlib.crc32(numero.encode('ascii')) % 10000 < self.structure_sample_rate * 10000
+        return False
     
     def analyze_page_structure(self, response):
         """Analyser la structure de la page pour comprendre le HTML"""
+        self.structure_samples += 1
         try:
             # Extraire les balises principales
             all_div_classes = response.xpath('//div/@class').getall()
             all_headers = response.xpath('//h1|//h2|//h3').getall()[:5]  # les 5 premiers en-têtes
             
-            debug_print("=== ANALYSE DE STRUCTURE DE PAGE ===", "info")
-            debug_print(f"URL: {response.url}", "info")
-            debug_print(f"Classes DIV principales: {all_div_classes[:10]}", "debug")
-            debug_print(f"En-têtes principaux: {all_headers}", "debug")
+            logger.info("=== ANALYSE DE STRUCTURE DE PAGE ===")
+            logger.info("URL: %s", response.url)
+            logger.debug("Classes DIV principales: %s", all_div_classes[:10])
+            logger.debug("En-têtes principaux: %s", all_headers)
             
-            # Enregistrer le HTML pour analyse
-            with open(f"debug_page_{response.meta['numero_entreprise']}.html", 'w', encoding='utf-8') as f:
-                f.write(response.text)
-            debug_print(f"HTML enregistré dans debug_page_{response.meta['numero_entreprise']}.html", "info")
+            # Enregistrer le HTML compressé depuis un thread pour ne pas bloquer le réacteur
+            path = os.path.join(self.structure_sample_dir, f"debug_page_{response.meta['numero_entreprise']}.html.gz")
+            d = threads.deferToThread(self.write_structure_sample, path, response.body)
+            d.addCallback(lambda _: logger.info("HTML enregistré dans %s", path))
+            d.addErrback(lambda failure: logger.error("Erreur lors de l'enregistrement de %s: %s", path, failure.value))
         except Exception as e:
-            debug_print(f"Erreur lors de l'analyse de la structure: {e}", "error")
+            logger.error("Erreur lors de l'analyse de la structure: %s", e)
+    
+    @staticmethod
+    def write_structure_sample(path, body):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with gzip.open(path, 'wb') as f:
+            f.write(body)
     
     # --- Extraire les données spécifiques de la page ---
 
-    def extract_capacites_entrepreneuriales(self, response):
+    def extract_capacites_entrepreneuriales(self, response, sections=None):
         capacites = []
         try:
             # Trouver la section des capacités entrepreneuriales
-            section_header = response.xpath('//div[@id="table"]/table/tbody/tr/td[@class="I" and h2[contains(text(), "Capacités entrepreneuriales")]]/ancestor::tr')
-            
-            if not section_header:
+            sections = sections or SectionIndex(response)
+            if not sections.has("Capacités entrepreneuriales", partial=True):
                 return []
             
             # Examiner la ligne suivante pour voir si elle contient des données
-            next_row = section_header.xpath('following-sibling::tr[1]')
-            if next_row:
-                text_content = ''.join(next_row.xpath('.//text()').getall()).strip()
+            next_row = sections.first_row("Capacités entrepreneuriales", partial=True)
+            if next_row is not None:
+                text_content = text(next_row).strip()
                 
                 # Si "Pas de données", retourner liste vide
                 if "Pas de données reprises dans la BCE" in text_content:
@@ -293,85 +486,81 @@ class KboSpider(scrapy.Spider):
                 }
                 
                 # Chercher une date éventuelle
-                depuis = next_row.xpath('.//span[@class="upd"]/text()').get()
+                depuis = first(UPD_TEXT, next_row)
                 if depuis and "Depuis le" in depuis:
                     capacite['date_debut'] = depuis.replace('Depuis le ', '').strip()
                 
                 capacites.append(capacite)
             
-            debug_print(f"Nombre de capacités entrepreneuriales extraites: {len(capacites)}", "debug")
+            logger.debug("Nombre de capacités entrepreneuriales extraites: %s", len(capacites))
         except Exception as e:
-            debug_print(f"Erreur lors de l'extraction des capacités entrepreneuriales: {e}", "error")
+            logger.error("Erreur lors de l'extraction des capacités entrepreneuriales: %s", e)
         
         return capacites
     
-    def extract_autorisations(self, response):
+    def extract_autorisations(self, response, sections=None):
         autorisations = []
         try:
-            autorisations_section = response.xpath('//div[contains(., "Autorisations")]/following-sibling::div[1]')
-            for row in autorisations_section.xpath('.//tr'):
+            sections = sections or SectionIndex(response)
+            for row in sections.rows("Autorisations"):
+                # Ignorer la ligne "Pas de données"
+                if "Pas de données reprises dans la BCE" in text(row):
+                    continue
                 try:
-                    autorisation = {
-                        'denomination': row.xpath('./td[1]//text()').get(),
-                        'date_debut': row.xpath('./td[2]//text()').get()
-                    }
-                    if autorisation['denomination']:
+                    autorisation = Autorisation(first(FIRST_CELL_TEXTS, row), first(SECOND_CELL_TEXTS, row))
+                    if autorisation.denomination:
                         autorisations.append(autorisation)
                 except Exception as e:
-                    debug_print(f"Erreur sur une autorisation: {e}", "debug")
+                    logger.debug("Erreur sur une autorisation: %s", e)
         except Exception as e:
-            debug_print(f"Erreur lors de l'extraction des autorisations: {e}", "debug")
+            logger.debug("Erreur lors de l'extraction des autorisations: %s", e)
         return autorisations
     
-    def extract_donnees_financieres(self, response):
+    def extract_donnees_financieres(self, response, sections=None):
         donnees = {}
         try:
             # Trouver la section des données financières
-            section_header = response.xpath('//div[@id="table"]/table/tbody/tr/td[@class="I" and h2[text()="Données financières"]]/ancestor::tr')
-            
-            if not section_header:
+            sections = sections or SectionIndex(response)
+            if not sections.has("Données financières"):
                 return {}
             
-            # Traiter les lignes suivantes jusqu'à la prochaine section
-            next_rows = section_header.xpath('following-sibling::tr')
-            
-            for row in next_rows:
-                # S'arrêter si on trouve une nouvelle section ou une ligne vide
-                if row.xpath('./td[@class="I" and h2]') or row.xpath('./td[contains(text(), "&nbsp;")]'):
+            # Lignes de la section (l'index s'arrête déjà à la prochaine section)
+            for row in sections.rows("Données financières"):
+                # S'arrêter sur une ligne vide
+                if NBSP_CELLS(row):
                     break
                 
                 # Extraire la clé (première cellule)
-                key_cell = row.xpath('./td[1]/text()').get()
+                key_cell = first(FIRST_CELL_TEXT, row)
                 if not key_cell:
                     continue
                 
                 key = key_cell.strip()
                 
                 # Extraire la valeur (cellules suivantes)
-                value = ''.join(row.xpath('./td[position()>1]//text()').getall()).strip()
+                value = ''.join(VALUE_TEXTS(row)).strip()
                 
                 if key and value:
                     donnees[key] = value
             
-            debug_print(f"Données financières extraites: {donnees}", "debug")
+            logger.debug("Données financières extraites: %s", donnees)
         except Exception as e:
-            debug_print(f"Erreur lors de l'extraction des données financières: {e}", "error")
+            logger.error("Erreur lors de l'extraction des données financières: %s", e)
         
         return donnees
 
-    def extract_liens_entites(self, response):
+    def extract_liens_entites(self, response, sections=None):
         liens = []
         try:
             # Trouver la section des liens entre entités
-            section_header = response.xpath('//div[@id="table"]/table/tbody/tr/td[@class="I" and h2[text()="Liens entre entités"]]/ancestor::tr')
-            
-            if not section_header:
+            sections = sections or SectionIndex(response)
+            if not sections.has("Liens entre entités"):
                 return []
             
             # Examiner la ligne suivante pour voir si elle contient des données
-            next_row = section_header.xpath('following-sibling::tr[1]')
-            if next_row:
-                text_content = ''.join(next_row.xpath('.//text()').getall()).strip()
+            next_row = sections.first_row("Liens entre entités")
+            if next_row is not None:
+                text_content = text(next_row).strip()
                 
                 # Si "Pas de données", retourner liste vide
                 if "Pas de données reprises dans la BCE" in text_content:
@@ -379,66 +568,54 @@ class KboSpider(scrapy.Spider):
                 
                 # Sinon, extraire les liens entre entités
                 # Cette partie dépend de la structure exacte quand il y a des liens
-                for row in next_row.xpath('.//table//tr'):
-                    cells = row.xpath('./td')
+                for row in NESTED_ROWS(next_row):
+                    cells = CELLS(row)
                     if len(cells) >= 4:
-                        lien = {
-                            'numero_entreprise': cells[0].xpath('.//text()').get(),
-                            'denomination': cells[1].xpath('.//text()').get(),
-                            'type_lien': cells[2].xpath('.//text()').get(),
-                            'date_debut': cells[3].xpath('.//text()').get()
-                        }
-                        
-                        # Nettoyer les valeurs
-                        for key in lien:
-                            if lien[key]:
-                                lien[key] = lien[key].strip()
+                        # Valeurs nettoyées, dans l'ordre des champs de Lien
+                        values = [first(TEXTS, cell) for cell in cells[:4]]
+                        lien = Lien(*[value.strip() if value else value for value in values])
                         
-                        if lien['numero_entreprise'] or lien['denomination']:
+                        if lien.numero_entreprise or lien.denomination:
                             liens.append(lien)
             
-            debug_print(f"Nombre de liens entre entités extraits: {len(liens)}", "debug")
+            logger.debug("Nombre de liens entre entités extraits: %s", len(liens))
         except Exception as e:
-            debug_print(f"Erreur lors de l'extraction des liens entre entités: {e}", "error")
+            logger.error("Erreur lors de l'extraction des liens entre entités: %s", e)
         
         return liens
     
-    def extract_liens_externes(self, response):
+    def extract_liens_externes(self, response, sections=None):
         liens = []
         try:
-            # Simplification du sélecteur XPath
-            section_header = response.xpath('//tr/td[@class="I" and h2[text()="Liens externes"]]/ancestor::tr')
-            
-            if not section_header:
-                debug_print("Section 'Liens externes' non trouvée", "debug")
+            sections = sections or SectionIndex(response)
+            if not sections.has("Liens externes"):
+                logger.debug("Section 'Liens externes' non trouvée")
                 return []
             
             # Traiter la ligne suivante qui contient les liens
-            next_row = section_header.xpath('following-sibling::tr[1]')
-            if next_row:
+            next_row = sections.first_row("Liens externes")
+            if next_row is not None:
                 # Extraire tous les liens avec la classe "external"
-                for link in next_row.xpath('.//a[@class="external"]'):
-                    url = link.xpath('@href').get()  # Simplification du sélecteur
-                    text = link.xpath('text()').get() # Simplification du sélecteur
+                for link in EXTERNAL_LINKS(next_row):
+                    url = first(HREF, link)
+                    label = first(OWN_TEXT, link)
                     
-                    if url and text:
-                        liens.append({
-                            'url': url.strip(),
-                            'texte': text.strip()
-                        })
+                    if url and label:
+                        liens.append(LienExterne(url.strip(), label.strip()))
             
-            debug_print(f"Nombre de liens externes extraits: {len(liens)}", "debug")
+            logger.debug("Nombre de liens externes extraits: %s", len(liens))
         except Exception as e:
-            debug_print(f"Erreur lors de l'extraction des liens externes: {e}", "error")
-            debug_print(f"Détails de l'erreur: {repr(e)}", "error")  # Afficher plus de détails
+            logger.error("Erreur lors de l'extraction des liens externes: %s", e)
+            logger.error("Détails de l'erreur: %s", repr(e))  # Afficher plus de détails
         
         return liens
 
-    def extract_generalites(self, response):
+    def extract_generalites(self, response, sections=None):
         generalites = {}
         try:
-            # Approche plus robuste: chercher directement les paires clé-valeur dans la section des généralités
-            section_generalites = response.xpath('//tr/td[@class="I" and h2[text()="Généralités"]]/ancestor::table//tr')
+            # Chercher les paires clé-valeur dans les lignes de la section des généralités
+            sections = sections or SectionIndex(response)
+            section_generalites = sections.rows("Généralités")
             
             # Mapper les clés aux noms de champs
             mapping = {
@@ -456,7 +633,7 @@ class KboSpider(scrapy.Spider):
             
             for row in section_generalites:
                 # Chercher la cellule avec une clé
-                key_cell = row.xpath('./td[contains(@class, "QL") or contains(@class, "RL")]/text()').get()
+                key_cell = first(KEY_CELL_TEXT, row)
                 
                 if not key_cell:
                     continue
@@ -468,12 +645,12 @@ class KboSpider(scrapy.Spider):
                     if original_key in key_cell:
                         # Extraire la valeur (différentes stratégies selon le champ)
                         if mapped_field == "statut" or mapped_field == "situation_juridique":
-                            value = row.xpath('./td[position()>1]//span[@class="pageactief"]/text()').get()
+                            value = first(ACTIVE_VALUE, row)
                         elif mapped_field == "nombre_ue":
-                            value = row.xpath('./td[position()>1]/strong/text()').get()
+                            value = first(STRONG_VALUE, row)
                         else:
                             # Valeur de texte standard
-                            value = row.xpath('./td[position()>1]/text()[1]').get()
+                            value = first(FIRST_VALUE_TEXT, row)
                             
                         # Nettoyer la valeur
                         if value:
@@ -481,106 +658,95 @@ class KboSpider(scrapy.Spider):
                         
                         # Extraire les informations supplémentaires (dates "depuis")
                         if mapped_field == "situation_juridique":
-                            depuis = row.xpath('./td[position()>1]//span[@class="upd"]/text()').get()
+                            depuis = first(VALUE_UPD_TEXT, row)
                             if depuis and "Depuis le" in depuis:
                                 generalites["situation_juridique_depuis"] = depuis.replace('Depuis le ', '').strip()
                         
                         # Pour l'adresse, combiner les lignes
                         if mapped_field == "adresse":
-                            all_text = row.xpath('./td[position()>1]//text()[not(parent::span[@class="upd"])]').getall()
+                            all_text = ADDRESS_TEXTS(row)
                             if all_text:
                                 generalites["adresse"] = ' '.join([t.strip() for t in all_text if t.strip()])
                         break
             
-            debug_print(f"Généralités extraites: {generalites}", "debug")
+            logger.debug("Généralités extraites: %s", generalites)
         
         except Exception as e:
-            debug_print(f"Erreur lors de l'extraction des généralités: {e}", "error")
+            logger.error("Erreur lors de l'extraction des généralités: %s", e)
         
         return generalites
     
-    def extract_fonctions(self, response):
+    def extract_fonctions(self, response, sections=None):
         fonctions = []
         try:
+            # Limiter la recherche à la section "Fonctions" quand elle existe
+            sections = sections or SectionIndex(response)
+            scope = sections.rows("Fonctions") or [sections.root]
+            
             # D'abord, chercher les informations sur le nombre de fonctions (même si le tableau est caché)
-            fonctions_info = response.xpath('//span[@id="klikfctie"]/text()').get()
+            fonctions_info = first_of(FONCTIONS_COUNT, scope)
             if fonctions_info:
-                debug_print(f"Information sur les fonctions: {fonctions_info}", "info")
+                logger.debug("Information sur les fonctions: %s", fonctions_info)
             
             # Essayer plusieurs approches pour trouver le tableau des fonctions
             # 1. Chercher le tableau directement visible
-            table_fonctions = response.xpath('//table[@id="toonfctie"]')
+            table_fonctions = all_of(FONCTIONS_TABLE, scope)
             
             # 2. Chercher le tableau même s'il est caché
             if not table_fonctions:
-                table_fonctions = response.xpath('//table[contains(@id, "toonfctie")]')
+                table_fonctions = FONCTIONS_TABLE_ANY(sections.root)
                 
             # 3. Si toujours pas trouvé, essayer en se basant sur la structure parent
             if not table_fonctions:
-                table_fonctions = response.xpath('//tr[td/span[@id="klikfctie"]]/following-sibling::tr[1]//table')
+                table_fonctions = FONCTIONS_TABLE_AFTER_COUNT(sections.root)
             
             if table_fonctions:
                 # Extraire les données des lignes du tableau
-                for row in table_fonctions.xpath('.//tr'):
-                    cells = row.xpath('./td')
+                for row in all_of(ROWS, table_fonctions):
+                    cells = CELLS(row)
                     if len(cells) >= 3:
-                        fonction = {
-                            'role': cells[0].xpath('.//text()').get(),
-                            'nom': cells[1].xpath('.//text()').get(),
-                            'depuis': None
-                        }
-                        
                         # Extraire la date (dans un span spécifique)
-                        depuis = cells[2].xpath('.//span[@class="upd"]/text()').get()
+                        depuis = first(UPD_TEXT, cells[2])
                         if depuis:
-                            fonction['depuis'] = depuis.replace('Depuis le ', '').strip()
-                            
+                            depuis = depuis.replace('Depuis le ', '').strip()
+                        
                         # Nettoyer les valeurs
-                        for key in fonction:
-                            if fonction[key]:
-                                fonction[key] = ' '.join(fonction[key].strip().split())
+                        values = [first(TEXTS, cells[0]), first(TEXTS, cells[1]), depuis]
+                        fonction = Fonction(*[' '.join(value.strip().split()) if value else value for value in values])
                         
                         # Ajouter seulement si nous avons au moins un rôle ou un nom
-                        if fonction['role'] or fonction['nom']:
+                        if fonction.role or fonction.nom:
                             fonctions.append(fonction)
             
-            debug_print(f"Nombre de fonctions extraites: {len(fonctions)}", "debug")
+            logger.debug("Nombre de fonctions extraites: %s", len(fonctions))
         
         except Exception as e:
-            debug_print(f"Erreur lors de l'extraction des fonctions: {e}", "error")
+            logger.error("Erreur lors de l'extraction des fonctions: %s", e)
         
         return fonctions
     
-    def extract_qualites(self, response):
+    def extract_qualites(self, response, sections=None):
         qualites = []
         try:
-            # Correction du sélecteur - rechercher au niveau tr sans div
-            section_header = response.xpath('//tr/td[@class="I" and h2[text()="Qualités"]]/ancestor::tr')
-            
-            if not section_header:
-                debug_print("Section 'Qualités' non trouvée", "debug")
+            sections = sections or SectionIndex(response)
+            if not sections.has("Qualités"):
+                logger.debug("Section 'Qualités' non trouvée")
                 return []
             
-            # Traiter les lignes suivantes jusqu'à la prochaine section
-            next_rows = section_header.xpath('following-sibling::tr')
-            
-            for row in next_rows:
-                # S'arrêter si on trouve une nouvelle section
-                if row.xpath('./td[@class="I" and h2]'):
-                    break
-                    
+            # Lignes de la section (l'index s'arrête déjà à la prochaine section)
+            for row in sections.rows("Qualités"):
                 # Ignorer les lignes vides ou "Pas de données"
-                text_content = ''.join(row.xpath('.//text()').getall()).strip()
+                text_content = text(row).strip()
                 if not text_content or "Pas de données reprises dans la BCE" in text_content:
                     continue
                     
                 # Extraire la qualité (simplification du sélecteur)
-                qualite_text = row.xpath('.//text()[not(ancestor::span[@class="upd"])]').getall()
+                qualite_text = TEXTS_OUTSIDE_UPD(row)
                 if qualite_text:
                     qualite_text = ''.join(qualite_text).strip()
                     
                     # Extraire la date "depuis"
-                    depuis = row.xpath('.//span[@class="upd"]/text()').get()
+                    depuis = first(UPD_TEXT, row)
                     depuis_value = None
                     if depuis and "Depuis le" in depuis:
                         depuis_value = depuis.replace('Depuis le ', '').strip()
@@ -590,260 +756,79 @@ class KboSpider(scrapy.Spider):
                         'depuis': depuis_value
                     })
             
-            debug_print(f"Nombre de qualités extraites: {len(qualites)}", "debug")
+            logger.debug("Nombre de qualités extraites: %s", len(qualites))
         
         except Exception as e:
-            debug_print(f"Erreur lors de l'extraction des qualités: {e}", "error")
+            logger.error("Erreur lors de l'extraction des qualités: %s", e)
         
         return qualites
     
-    def extract_nace_2025(self, response):
-        codes = []
+    def extract_nace(self, response, sections=None):
+        """Codes NACE de toutes les versions, en un passage sur l'index des sections : {version: [NaceCode]}.
+
+        Les sections 2008 et 2003 sont dans les tableaux cachés toonbtw2008 et toonbtw,
+        indexés par SectionIndex comme le reste de la page.
+        """
+        codes = {version: [] for version in NACE_VERSIONS}
         try:
-            # Simplification des sélecteurs XPath
-            sections = [
-                # Pour les activités TVA
-                '//tr/td[@class="I" and contains(h2/text(), "Activités TVA Code Nacebel version 2025")]',
-                # Pour les activités ONSS
-                '//tr/td[@class="I" and contains(h2/text(), "Activités ONSS Code Nacebel version 2025")]'
-            ]
-            
-            for section_xpath in sections:
-                section = response.xpath(section_xpath)
-                if not section:
-                    continue
-                    
-                section_tr = section.xpath('./ancestor::tr')
-                if not section_tr:
-                    continue
-                    
-                # Récupérer la ligne suivante contenant les données
-                code_row = section_tr.xpath('following-sibling::tr[1]')
-                if not code_row:
+            sections = sections or SectionIndex(response)
+            found = {}
+            for title in sections.sections:
+                match = NACE_SECTION.search(title)
+                # La première section d'un type et d'une version l'emporte
+                if not match or match.groups() in found:
                     continue
-                    
-                # Extraire le texte complet pour analyse
-                row_text = ''.join(code_row.xpath('.//text()').getall()).strip()
-                if "Pas de données" in row_text:
-                    continue
-                    
-                # Déterminer le type (TVA ou ONSS)
-                nace_type = "TVA" if "TVA" in row_text else "ONSS"
-                
-                # Extraire le code NACE (dans le lien ou directement du texte)
-                code = code_row.xpath('.//a[contains(@href, "nace.code=")]/text()').get()
-                if not code:
-                    # Extraction du code à partir du texte formaté comme "TYPE2025 CODE - DESCRIPTION"
-                    import re
-                    code_match = re.search(r'(TVA|ONSS)\D*(\d+\.\d+)', row_text)
-                    if code_match:
-                        code = code_match.group(2)
-                
-                # Extraire la description (après le tiret)
-                description = None
-                if '-' in row_text:
-                    parts = row_text.split('-')
-                    if len(parts) > 1:
-                        description = parts[1].strip()
-                
-                # Extraire la date depuis
-                depuis = code_row.xpath('.//span[@class="upd"]/text()').get()
-                depuis_value = None
-                if depuis and "Depuis le" in depuis:
-                    depuis_value = depuis.replace('Depuis le ', '').strip()
-                
-                if code and description:
-                    codes.append({
-                        'type': nace_type,
-                        'code': code.strip(),
-                        'description': description,
-                        'depuis': depuis_value
-                    })
+                nace_type, version = match.groups()
+                found[nace_type, version] = self.parse_nace_row(sections.first_row(title), nace_type)
             
-            debug_print(f"Nombre de codes NACE 2025 extraits: {len(codes)}", "debug")
-        except Exception as e:
-            debug_print(f"Erreur lors de l'extraction des codes NACE 2025: {e}", "error")
-        
-        return codes
-
-    def extract_nace_2008(self, response):
-        codes = []
-        try:
-            # La table des codes NACE 2008 a un ID spécifique
-            nace_table = response.xpath('//table[@id="toonbtw2008"]')
+            # TVA puis ONSS dans chaque version, quel que soit l'ordre de la page
+            for version, version_codes in codes.items():
+                for nace_type in NACE_TYPES:
+                    code = found.get((nace_type, version))
+                    if code is not None:
+                        version_codes.append(code)
             
-            if nace_table:
-                # Chercher les sections TVA et ONSS
-                sections = [
-                    './/tr/td[@class="I" and h2[contains(text(), "Activités TVA Code Nacebel version 2008")]]/ancestor::tr',
-                    './/tr/td[@class="I" and h2[contains(text(), "Activités ONSS Code Nacebel version 2008")]]/ancestor::tr'
-                ]
-                
-                for section_xpath in sections:
-                    section = nace_table.xpath(section_xpath)
-                    if section:
-                        # Traiter la ligne suivante qui contient le code
-                        code_row = section.xpath('following-sibling::tr[1]')
-                        if code_row:
-                            # Extraire toutes les données textuelles de la ligne
-                            row_text = ''.join(code_row.xpath('.//text()').getall()).strip()
-                            
-                            # Extraire le code NACE
-                            code_parts = row_text.split('-')
-                            code_text = None
-                            if len(code_parts) > 0:
-                                code_text_parts = code_parts[0].split()
-                                if len(code_text_parts) > 1:
-                                    code_text = code_text_parts[-1].strip()
-                            
-                            # Extraire la description (après le tiret)
-                            description = None
-                            if '-' in row_text:
-                                parts = row_text.split('-')
-                                if len(parts) > 1:
-                                    description = parts[-1].strip()
-                            
-                            # Extraire la date
-                            depuis = code_row.xpath('.//span[@class="upd"]/text()').get()
-                            depuis_value = None
-                            if depuis and "Depuis le" in depuis:
-                                depuis_value = depuis.replace('Depuis le ', '').strip()
-                            
-                            if code_text and description:
-                                # Déterminer le type (TVA ou ONSS)
-                                nace_type = "TVA" if "TVA" in row_text else "ONSS" 
-                                
-                                codes.append({
-                                    'type': nace_type,
-                                    'code': code_text,
-                                    'description': description,
-                                    'depuis': depuis_value
-                                })
-            
-            debug_print(f"Nombre de codes NACE 2008 extraits: {len(codes)}", "debug")
+            logger.debug("Codes NACE extraits: %s", codes)
         except Exception as e:
-            debug_print(f"Erreur lors de l'extraction des codes NACE 2008: {e}", "error")
+            logger.error("Erreur lors de l'extraction des codes NACE: %s", e)
         
         return codes
-
-    def extract_nace_2003(self, response):
-        codes = []
-        try:
-            # La table des codes NACE 2003 a un ID spécifique
-            nace_table = response.xpath('//table[@id="toonbtw"]')
-            
-            if nace_table:
-                # Chercher la section TVA
-                section = nace_table.xpath('.//tr/td[@class="I" and h2[contains(text(), "Activités TVA Code Nacebel version 2003")]]/ancestor::tr')
-                if section:
-                    # Traiter la ligne suivante qui contient le code
-                    code_row = section.xpath('following-sibling::tr[1]')
-                    if code_row:
-                        # Extraire toutes les données textuelles de la ligne
-                        row_text = ''.join(code_row.xpath('.//text()').getall()).strip()
-                        
-                        # Extraire le code NACE
-                        code_parts = row_text.split('-')
-                        code_text = None
-                        if len(code_parts) > 0:
-                            code_text_parts = code_parts[0].split()
-                            if len(code_text_parts) > 1:
-                                code_text = code_text_parts[-1].strip()
-                        
-                        # Extraire la description (après le tiret)
-                        description = None
-                        if '-' in row_text:
-                            parts = row_text.split('-')
-                            if len(parts) > 1:
-                                description = parts[-1].strip()
-                        
-                        # Extraire la date
-                        depuis = code_row.xpath('.//span[@class="upd"]/text()').get()
-                        depuis_value = None
-                        if depuis and "Depuis le" in depuis:
-                            depuis_value = depuis.replace('Depuis le ', '').strip()
-                        
-                        if code_text and description:
-                            codes.append({
-                                'type': "TVA",
-                                'code': code_text,
-                                'description': description,
-                                'depuis': depuis_value
-                            })
-            
-            debug_print(f"Nombre de codes NACE 2003 extraits: {len(codes)}", "debug")
-        except Exception as e:
-            debug_print(f"Erreur lors de l'extraction des codes NACE 2003: {e}", "error")
+    
+    def parse_nace_row(self, code_row, nace_type):
+        """Ligne suivant un en-tête NACE ("TVA2025 84.130 - Description Depuis le ...") → NaceCode ou None"""
+        if code_row is None:
+            return None
+        row_text = text(code_row).strip()
+        if "Pas de données" in row_text:
+            return None
         
-        return codes
-
-        def extract_nace_hidden(self, response, version):
-            """Extraction des codes NACE qui peuvent être cachés dans des sections repliées"""
-            codes = []
-            try:
-                # Pour les codes NACE 2008 et 2003 qui sont souvent cachés
-                if version in ["2008", "2003"]:
-                    table_id = f"toonbtw{version}"
-                    nace_table = response.xpath(f'//table[@id="{table_id}"]')
-                    
-                    if nace_table:
-                        for row in nace_table.xpath('.//tr'):
-                            code_text = row.xpath('./td[1]/text()').get()
-                            description = row.xpath('./td[2]/text()').get()
-                            depuis = row.xpath('.//span[@class="upd"]/text()').get()
-                            
-                            if code_text and description:
-                                code = {
-                                    'code': code_text.strip(),
-                                    'description': description.strip(),
-                                    'depuis': depuis.replace('Depuis le ', '').strip() if depuis else None
-                                }
-                                codes.append(code)
-                
-                debug_print(f"Nombre de codes NACE {version} cachés extraits: {len(codes)}", "debug")
-            
-            except Exception as e:
-                debug_print(f"Erreur lors de l'extraction des codes NACE {version} cachés: {e}", "error")
-            
-            return codes
-
-        def extract_hidden_content(self, response, section_id):
-            """Extrait le contenu caché qui nécessiterait normalement un clic JavaScript"""
-            content = {}
-            try:
-                # Les contenus cachés ont généralement un id spécifique et display:none
-                hidden_element = response.xpath(f'//*[@id="{section_id}" and contains(@style, "display: none")]')
-                
-                if not hidden_element:
-                    # Essayer de trouver l'élément sans vérifier le style (il peut être dans le HTML mais caché)
-                    hidden_element = response.xpath(f'//*[@id="{section_id}"]')
-                
-                if hidden_element:
-                    # Récupérer tous le contenu texte de cet élément
-                    content['html'] = hidden_element.get()
-                    content['text'] = ''.join(hidden_element.xpath('.//text()').getall())
-                    
-                    # Rechercher des tables
-                    tables = hidden_element.xpath('.//table')
-                    if tables:
-                        content['tables_count'] = len(tables)
-                        
-                    # Rechercher des liens 
-                    links = hidden_element.xpath('.//a/@href').getall()
-                    if links:
-                        content['links'] = links
-                        
-                    debug_print(f"Contenu caché trouvé pour {section_id}: {len(content['text'])} caractères", "debug")
-                else:
-                    debug_print(f"Aucun contenu caché trouvé pour {section_id}", "debug")
-            
-            except Exception as e:
-                debug_print(f"Erreur lors de l'extraction du contenu caché {section_id}: {e}", "error")
-            
-            return content
+        # Code NACE dans le lien, sinon dans le texte avant le tiret
+        code = first(NACE_CODE_LINK, code_row)
+        if not code:
+            code_match = NACE_CODE.search(row_text.split('-', 1)[0])
+            code = code_match.group(0) if code_match else None
+        
+        # Description : tout ce qui suit le premier tiret
+        description = row_text.split('-', 1)[1].strip() if '-' in row_text else None
+        
+        depuis = first(UPD_TEXT, code_row)
+        depuis_value = None
+        if depuis and "Depuis le" in depuis:
+            depuis_value = depuis.replace('Depuis le ', '').strip()
+        
+        if code and description:
+            return NaceCode(nace_type, code.strip(), description, depuis_value)
+        return None
 
 # Spider 2: eJustice Spider 
-class EjusticeSpider(scrapy.Spider):
+class EjusticeSpider(EnterpriseSpider):
+    """Publications au Moniteur belge d'une entreprise (listes cgi_tsv/list.pl de eJustice).
+
+    La première page donne le nombre de pages : les suivantes sont demandées toutes en même
+    temps. Chaque page produit un item avec ses publications, dédoublonnées par référence ;
+    la pipeline les ajoute à la liste existante, une par référence. En mode incrémental,
+    seules les publications postérieures à la dernière déjà enregistrée sont demandées.
+    """
     name = 'ejustice'
     allowed_domains = ['ejustice.just.fgov.be']
     
@@ -853,16 +838,384 @@ class EjusticeSpider(scrapy.Spider):
         'ROBOTSTXT_OBEY': False  # Désactive l'obéissance au robots.txt
     }
     
-    # Implémentez ce spider selon vos besoins spécifiques
+    search_url = 'https://www.ejustice.just.fgov.be/cgi_tsv/list.pl?language=fr&btw={numero}&page={page}'
+    # Paramètre de date de publication minimale du formulaire de recherche
+    since_param = 'pdd'
+    
+    def __init__(self, input_file=DEFAULT_INPUT_FILE, offset=0, limit=None,
+                 shard_index=0, shard_count=1, numeros=None, *args, **kwargs):
+        super(EjusticeSpider, self).__init__(input_file, offset, limit, shard_index, shard_count, numeros,
+                                             *args, **kwargs)
+        # Pages en cours et références déjà vues des entreprises à plusieurs pages : créées à la
+        # réception de la première page, oubliées une fois toutes les pages reçues
+        self.pending_pages = {}
+        self.seen_references = {}
+        logger.info("eJustice Spider initialisé sur %s (offset=%s, limit=%s, shard=%s/%s)",
+                    self.input_file, self.offset, self.limit, self.shard_index, self.shard_count)
+    
+    def start_requests(self):
+        for numero, priority in self.iter_prioritized():
+            yield self.first_request(numero, priority)
+            self.scraping_stats.requests_total += 1
+    
+    def first_request(self, numero, priority=0):
+        return self.page_request(numero, 1, priority)
+    
+    def latest_publication(self, numero):
+        # Dates de la dernière publication enregistrée, attachées par la pipeline MongoDB en mode incrémental
+        latest = getattr(self, 'latest_publications', None)
+        return latest.get(numero) if latest else None
+    
+    def page_request(self, numero, page, priority=0):
+        url = self.search_url.format(numero=numero, page=page)
+        since = self.latest_publication(numero)
+        if since:
+            url = f"{url}&{self.since_param}={since}"
+        return scrapy.Request(
+            url=url,
+            callback=self.parse,
+            meta={'numero_entreprise': numero, 'page': page},
+            errback=self.errback_http,
+            priority=priority,
+        )
+    
+    def page_done(self, numero):
+        if numero not in self.pending_pages:
+            # Première page en échec, ou entreprise à une seule page : rien à oublier
+            return
+        self.pending_pages[numero] -= 1
+        if self.pending_pages[numero] <= 0:
+            del self.pending_pages[numero]
+            del self.seen_references[numero]
+    
+    def errback_http(self, failure):
+        numero_entreprise = failure.request.meta['numero_entreprise']
+        logger.error("Échec de la requête eJustice pour l'entreprise %s (page %s): %s",
+                     numero_entreprise, failure.request.meta['page'], failure.value)
+        self.scraping_stats.requests_failed += 1
+        self.page_done(numero_entreprise)
+    
+    def parse(self, response):
+        self.scraping_stats.requests_success += 1
+        self.scraping_stats.observe('latency', response.meta.get('download_latency'))
+        numero_entreprise = response.meta['numero_entreprise']
+        page = response.meta['page']
+        
+        if page == 1:
+            last_page = self.extract_last_page(response)
+            if last_page > 1:
+                self.pending_pages[numero_entreprise] = last_page
+                self.seen_references[numero_entreprise] = set()
+                logger.debug("%s pages de publications pour %s", last_page, numero_entreprise)
+                for next_page in range(2, last_page + 1):
+                    yield self.page_request(numero_entreprise, next_page, response.request.priority)
+        
+        since = self.latest_publication(numero_entreprise)
+        seen = self.seen_references.get(numero_entreprise, set())
+        publications = []
+        for publication in self.extract_publications(response):
+            reference = publication['reference']
+            if reference in seen or (since and publication['date'] and publication['date'] < since):
+                continue
+            seen.add(reference)
+            publications.append(publication)
+        self.page_done(numero_entreprise)
+        
+        if publications:
+            self.scraping_stats.items_extracted += 1
+            self.scraping_stats.publications_extracted += len(publications)
+            yield EntrepriseItem(numero_entreprise=numero_entreprise, publications=publications)
+    
+    def extract_last_page(self, response):
+        pages = [int(page) for page in response.css('a[href*="page="]::attr(href)').re(r'[?&]page=(\d+)')]
+        return max(pages, default=1)
+    
+    def extract_publications(self, response):
+        """Publications de la page : titre, rubrique, date, numéro et lien vers le PDF"""
+        blocks = response.css('div.list-item')
+        if not blocks:
+            # Ancienne mise en page : un bloc par lien vers un PDF
+            blocks = response.xpath('//a[contains(@href, "tsv_pdf")]/..')
+        for block in blocks:
+            lines = [line.strip() for line in block.xpath('.//text()').getall() if line.strip()]
+            text = '\n'.join(lines)
+            match = re.search(r'(\d{4}-\d{2}-\d{2})\s*/\s*(\d+)', text)
+            pdf = block.xpath('.//a[contains(@href, ".pdf")]/@href').get()
+            if not match and not pdf:
+                continue
+            date, numero_publication = match.groups() if match else (None, None)
+            if pdf:
+                reference = os.path.splitext(os.path.basename(pdf))[0]
+            else:
+                reference = f"{date}/{numero_publication}"
+            # La rubrique précède la ligne "date / numéro"
+            date_line = next((i for i, line in enumerate(lines) if match and match.group(0) in line), None)
+            yield {
+                'reference': reference,
+                'date': date,
+                'numero_publication': numero_publication,
+                'titre': lines[0] if lines else None,
+                'rubrique': lines[date_line - 1] if date_line else None,
+                'pdf': response.urljoin(pdf) if pdf else None,
+            }
 
 # Spider 3: Consult Spider (NBB)
-class ConsultSpider(scrapy.Spider):
+class ConsultSpider(EnterpriseSpider):
+    """Dépôts de comptes annuels d'une entreprise via l'API JSON de consult.cbso.nbb.be.
+
+    Le spider ne fait que lister les dépôts : les documents (PDF, XBRL) sont téléchargés
+    en flux par ConsultDocumentsPipeline, hors du downloader Scrapy qui garde chaque
+    réponse entière en mémoire.
+    """
     name = 'consult'
     allowed_domains = ['consult.cbso.nbb.be']
     
+    custom_settings = {
+        'LOG_ENABLED': False,
+        'ROBOTSTXT_OBEY': True,
+        # Limites propres à l'API de la BNB, indépendantes de celles de KBO
+        'CONCURRENT_REQUESTS_PER_DOMAIN': 4,
+    }
+    
+    # Modèles d'URL (surchargeables par CONSULT_API_URL / CONSULT_DOCUMENT_URLS)
+    api_url = ('https://consult.cbso.nbb.be/api/rs-consult/published-deposits'
+               '?page={page}&size={size}&enterpriseNumber={numero}&sort=periodEndDate,desc')
+    document_urls = {
+        'pdf': 'https://consult.cbso.nbb.be/api/external/broker/public/deposits/pdf/{id}',
+        'xbrl': 'https://consult.cbso.nbb.be/api/external/broker/public/deposits/xbrl/{id}',
+    }
+    page_size = 50
+    
+    def __init__(self, input_file=DEFAULT_INPUT_FILE, offset=0, limit=None,
+                 shard_index=0, shard_count=1, numeros=None, *args, **kwargs):
+        super(ConsultSpider, self).__init__(input_file, offset, limit, shard_index, shard_count, numeros,
+                                            *args, **kwargs)
+        logger.info("Consult Spider initialisé sur %s (offset=%s, limit=%s, shard=%s/%s)",
+                    self.input_file, self.offset, self.limit, self.shard_index, self.shard_count)
+    
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super(ConsultSpider, cls).from_crawler(crawler, *args, **kwargs)
+        spider.api_url = crawler.settings.get('CONSULT_API_URL', cls.api_url)
+        spider.document_urls = crawler.settings.getdict('CONSULT_DOCUMENT_URLS', cls.document_urls)
+        spider.allowed_domains = [urlparse(spider.api_url).hostname]
+        return spider
+    
+    def start_requests(self):
+        for numero, priority in self.iter_prioritized():
+            yield self.deposits_request(numero, 0, [], priority)
+            self.scraping_stats.requests_total += 1
+    
+    def deposits_request(self, numero, page, deposits, priority=0):
+        return scrapy.Request(
+            url=self.api_url.format(numero=numero, page=page, size=self.page_size),
+            callback=self.parse,
+            headers={'Accept': 'application/json'},
+            meta={'numero_entreprise': numero, 'page': page, 'comptes_annuels': deposits},
+            errback=self.errback_http,
+            priority=priority,
+        )
+    
+    def errback_http(self, failure):
+        numero_entreprise = failure.request.meta['numero_entreprise']
+        logger.error("Échec de la requête Consult pour l'entreprise %s: %s", numero_entreprise, failure.value)
+        self.scraping_stats.requests_failed += 1
+    
+    def parse(self, response):
+        self.scraping_stats.requests_success += 1
+        self.scraping_stats.observe('latency', response.meta.get('download_latency'))
+        numero_entreprise = response.meta['numero_entreprise']
+        page = response.meta['page']
+        deposits = response.meta['comptes_annuels']
+        
+        try:
+            data = json.loads(response.text)
+        except ValueError:
+            logger.error("Réponse Consult illisible pour %s (page %s)", numero_entreprise, page)
+            return
+        deposits.extend(self.extract_deposit(deposit) for deposit in data.get('content') or [])
+        
+        # Pages suivantes demandées l'une après l'autre : la liste complète part en un seul item
+        if not data.get('last', True) and page + 1 < data.get('totalPages', 0):
+            yield self.deposits_request(numero_entreprise, page + 1, deposits, response.request.priority)
+            return
+        
+        logger.debug("%s dépôts de comptes annuels pour %s", len(deposits), numero_entreprise)
+        self.scraping_stats.items_extracted += 1
+        yield EntrepriseItem(numero_entreprise=numero_entreprise, comptes_annuels=deposits)
+    
+    def extract_deposit(self, deposit):
+        """Champs utiles d'un dépôt, avec les URL des documents à télécharger"""
+        deposit_id = deposit.get('id')
+        return {
+            'id': deposit_id,
+            'reference': deposit.get('reference'),
+            'date_depot': deposit.get('depositDate'),
+            'exercice_debut': deposit.get('periodStartDate'),
+            'exercice_fin': deposit.get('periodEndDate'),
+            'modele': deposit.get('modelName') or deposit.get('modelType'),
+            'langue': deposit.get('language'),
+            'documents': [
+                {'type': doc_type, 'url': url.format(id=deposit_id)}
+                for doc_type, url in self.document_urls.items()
+            ] if deposit_id is not None else [],
+        }
+
+
+# Spider combiné : KBO, eJustice et Consult pour chaque entreprise
+class CombinedSpider(EnterpriseSpider):
+    """Chaque numéro d'entreprise part vers les trois sources dans le même crawl.
+
+    Les spiders KBO, eJustice et Consult servent de parseurs : leurs requêtes sont
+    routées par ce spider, qui compte les réponses attendues par entreprise et fusionne
+    leurs résultats en mémoire le temps qu'elles arrivent. Un seul EntrepriseItem complet
+    est produit par entreprise, donc une seule écriture MongoDB au lieu de trois.
+    """
+    name = 'entreprise'
+    
+    # Domaines des trois sources (remplacés dans from_crawler par ceux des spiders créés)
+    allowed_domains = KboSpider.allowed_domains + EjusticeSpider.allowed_domains + ConsultSpider.allowed_domains
     custom_settings = {
         'LOG_ENABLED': False,
         'ROBOTSTXT_OBEY': True
     }
     
-    # Implémentez ce spider selon vos besoins spécifiques
\ No newline at end of file
+    def __init__(self, input_file=DEFAULT_INPUT_FILE, offset=0, limit=None,
+                 shard_index=0, shard_count=1, checkpoint=None, numeros=None, *args, **kwargs):
+        super(CombinedSpider, self).__init__(input_file, offset, limit, shard_index, shard_count, numeros,
+                                             *args, **kwargs)
+        self.checkpoint = CrawlCheckpoint(checkpoint) if checkpoint else None
+        # Spiders sources, créés avec les réglages du crawler dans from_crawler
+        self.sources = {}
+        # Résultats partiels et nombre de réponses attendues par entreprise en cours : créés à la
+        # première réponse d'une entreprise, libérés à la dernière
+        self.merged = {}
+        self.pending = {}
+        # Entreprises terminées hors callback (requête écartée), produites au prochain passage à vide
+        self.ready = []
+        logger.info("Spider combiné initialisé sur %s (offset=%s, limit=%s, shard=%s/%s)",
+                    self.input_file, self.offset, self.limit, self.shard_index, self.shard_count)
+    
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super(CombinedSpider, cls).from_crawler(crawler, *args, **kwargs)
+        # Les sources partagent les réglages et les stats du crawler
+        spider.sources = {
+            'kbo': KboSpider.from_crawler(crawler),
+            'ejustice': EjusticeSpider.from_crawler(crawler),
+            'consult': ConsultSpider.from_crawler(crawler),
+        }
+        spider.allowed_domains = [domain for source in spider.sources.values() for domain in source.allowed_domains]
+        crawler.signals.connect(spider.request_dropped, signal=signals.request_dropped)
+        crawler.signals.connect(spider.spider_idle, signal=signals.spider_idle)
+        return spider
+    
+    def start_requests(self):
+        skipped = 0
+        # Dates des dernières publications attachées par la pipeline en mode incrémental
+        self.sources['ejustice'].latest_publications = getattr(self, 'latest_publications', None)
+        for numero, priority in self.iter_prioritized():
+            if self.is_already_done(numero):
+                skipped += 1
+                self.scraping_stats.requests_skipped += 1
+                if skipped % 10000 == 0:
+                    logger.info("%s entreprises déjà traitées ignorées (checkpoint/fraîcheur)", skipped)
+                continue
+            
+            yield self.route(self.sources['kbo'].enterprise_request(numero, priority), 'kbo')
+            yield self.route(self.sources['ejustice'].first_request(numero, priority), 'ejustice')
+            yield self.route(self.sources['consult'].deposits_request(numero, 0, [], priority), 'consult')
+            self.scraping_stats.requests_total += 3
+    
+    def route(self, request, source):
+        """Rediriger une requête d'une source vers ce spider"""
+        request.meta['source'] = source
+        if source == 'ejustice':
+            # Même choix que EjusticeSpider : robots.txt interdit les listes de publications
+            request.meta['dont_obey_robotstxt'] = True
+        return request.replace(callback=self.parse_part, errback=self.errback_part)
+    
+    def open_parts(self, numero):
+        """État de fusion d'une entreprise, créé à sa première réponse (une par source attendue)"""
+        if numero not in self.pending:
+            self.merged[numero] = EntrepriseItem(numero_entreprise=numero, publications=[], sources=set())
+            self.pending[numero] = len(self.sources)
+    
+    def parse_part(self, response):
+        source = response.meta['source']
+        numero = response.meta['numero_entreprise']
+        self.open_parts(numero)
+        for result in self.sources[source].parse(response):
+            if isinstance(result, scrapy.Request):
+                # Page suivante ou dépôts suivants : une réponse de plus à attendre
+                self.pending[numero] += 1
+                yield self.route(result, source)
+            else:
+                self.merge(numero, source, result)
+        yield from self.part_done(numero)
+    
+    def errback_part(self, failure):
+        source = failure.request.meta['source']
+        numero = failure.request.meta['numero_entreprise']
+        self.open_parts(numero)
+        self.sources[source].errback_http(failure)
+        if source == 'kbo' and self.checkpoint:
+            self.checkpoint.mark_failed(numero)
+        yield from self.part_done(numero)
+    
+    def merge(self, numero, source, item):
+        merged = self.merged[numero]
+        # Une source n'est enregistrée qu'avec son item : fiche KBO lue, liste complète des dépôts...
+        merged['sources'].add(source)
+        if source == 'kbo':
+            # Les champs publications et comptes_annuels du KBO ne sont que des listes vides
+            for key, value in item.items():
+                if key not in ('publications', 'comptes_annuels'):
+                    merged[key] = value
+        elif source == 'ejustice':
+            merged['publications'].extend(item['publications'])
+        elif source == 'consult':
+            merged['comptes_annuels'] = item['comptes_annuels']
+    
+    def part_done(self, numero):
+        self.pending[numero] -= 1
+        if self.pending[numero] > 0:
+            return
+        del self.pending[numero]
+        item = self.merged.pop(numero)
+        if item['sources']:
+            yield item
+        elif self.checkpoint and int(numero) not in self.checkpoint.failed:
+            # Aucune donnée sur les trois sources : rien à écrire, mais ne pas recommencer
+            # (sauf si la fiche KBO est en échec : errback_part l'a marquée à reprendre)
+            self.checkpoint.mark_completed(numero)
+    
+    def request_dropped(self, request, spider):
+        """Requête écartée par le dupefilter : ni callback ni errback, une réponse de moins à attendre"""
+        numero = request.meta.get('numero_entreprise')
+        if request.meta.get('source') is None or numero is None:
+            return
+        self.open_parts(numero)
+        self.ready.extend(self.part_done(numero))
+    
+    def spider_idle(self, spider):
+        """Plus aucune requête en cours : les entreprises encore incomplètes (requête filtrée sans
+        signal, ex. hors domaine) ne recevront plus de réponse et sont produites telles quelles"""
+        for numero in list(self.pending):
+            logger.warning("Entreprise %s incomplète : %s réponses jamais reçues", numero, self.pending[numero])
+            self.pending[numero] = 1
+            self.ready.extend(self.part_done(numero))
+        if not self.ready:
+            return
+        # Un item ne sort que d'un callback : requête locale (data:) qui produit les entreprises prêtes
+        self.crawler.engine.crawl(scrapy.Request('data:,', callback=self.emit_ready, dont_filter=True,
+                                                 meta={'dont_cache': True}))
+        raise DontCloseSpider
+    
+    def emit_ready(self, response):
+        ready, self.ready = self.ready, []
+        yield from ready
+    
+    def closed(self, reason):
+        if self.checkpoint:
+            self.checkpoint.close()
@@ -0,0 +1,53 @@
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+from unittest import mock
+
+from utils.archive import ArchiveWriter, list_segments, load_latest_offsets, read_record
+
+
+def archive_run(directory, prefix, now, body):
+    """Un crawl archivant la fiche de 0403170701, segment ouvert à la date now"""
+    with mock.patch('utils.archive.datetime') as fake_datetime:
+        fake_datetime.now.return_value = now
+        writer = ArchiveWriter(directory, prefix)
+        writer.write({'numero_entreprise': '0403170701', 'body': body}, '0403170701')
+        writer.close()
+
+
+class LatestOffsetsTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def latest_body(self):
+        by_segment = load_latest_offsets(self.directory)
+        self.assertEqual(len(by_segment), 1)
+        (segment_path, offsets), = by_segment.items()
+        with open(segment_path, 'rb') as f:
+            return read_record(f, *offsets[0])['body']
+
+    def test_newer_run_wins_over_higher_pid(self):
+        archive_run(self.directory, 'kbo_spider-90000', datetime(2024, 1, 1, 10, 0, 0), 'ancienne')
+        archive_run(self.directory, 'kbo_spider-1200', datetime(2024, 3, 1, 10, 0, 0), 'récente')
+        self.assertEqual(self.latest_body(), 'récente')
+
+    def test_newer_run_wins_across_spiders(self):
+        archive_run(self.directory, 'kbo_spider-1200', datetime(2024, 1, 1, 10, 0, 0), 'ancienne')
+        archive_run(self.directory, 'entreprise-1300', datetime(2024, 3, 1, 10, 0, 0), 'récente')
+        self.assertEqual(self.latest_body(), 'récente')
+
+    def test_segments_of_one_run_in_order(self):
+        for count, prefix in ((2, 'kbo_spider-5'), (1, 'kbo_spider-5')):
+            for suffix in ('.jsonl.gz', '.idx'):
+                open(os.path.join(self.directory, f"{prefix}-20240101-100000-{count:05d}{suffix}"), 'w').close()
+        self.assertEqual([os.path.basename(path) for path in list_segments(self.directory)],
+                         ['kbo_spider-5-20240101-100000-00001.jsonl.gz', 'kbo_spider-5-20240101-100000-00002.jsonl.gz'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,226 @@
+import hashlib
+import http.server
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+import urllib.request
+from urllib.parse import parse_qs, urlparse
+
+from scrapy.http import TextResponse
+from twisted.trial import unittest as trial_unittest
+
+from items import EntrepriseItem
+from utils.documents import DocumentTooLarge, FileDocumentStore, stream_document
+
+PDF_BODY = b'%PDF-1.4\n' + os.urandom(200 * 1024)
+NUMERO = '0403170701'
+# Dépôts publiés de NUMERO, servis par pages de DEPOSITS_PAGE_SIZE comme l'API de la BNB
+DEPOSITS = [
+    {'id': f'dep-{index}', 'reference': f'2023-{index:08d}', 'depositDate': '2023-07-01',
+     'periodStartDate': '2022-01-01', 'periodEndDate': '2022-12-31', 'modelType': 'm02-f', 'language': 'FR'}
+    for index in range(5)
+]
+DEPOSITS_PAGE_SIZE = 2
+
+
+class StandInHandler(http.server.BaseHTTPRequestHandler):
+    """Serveur local jouant le rôle de consult.cbso.nbb.be (API des dépôts et documents)"""
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/api/deposits':
+            self.send_deposits(parse_qs(url.query))
+        elif url.path.endswith('.pdf'):
+            self.send_body(PDF_BODY, 'application/pdf')
+        else:
+            # Pas de XBRL pour ces dépôts
+            self.send_error(404)
+
+    def send_deposits(self, query):
+        page = int(query['page'][0])
+        pages = -(-len(DEPOSITS) // DEPOSITS_PAGE_SIZE)
+        content = DEPOSITS[page * DEPOSITS_PAGE_SIZE:(page + 1) * DEPOSITS_PAGE_SIZE]
+        body = json.dumps({'content': content, 'totalPages': pages, 'last': page + 1 >= pages})
+        self.send_body(body.encode('utf-8'), 'application/json')
+
+    def send_body(self, body, content_type):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StandInServerMixin:
+    """Serveur démarré une fois par classe de tests, sur un port libre"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+        cls.base_url = f"http://127.0.0.1:{cls.server.server_port}"
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+
+class StreamDocumentTest(StandInServerMixin, unittest.TestCase):
+    def setUp(self):
+        self.url = f"{self.base_url}/document.pdf"
+        self.directory = tempfile.mkdtemp()
+        self.store = FileDocumentStore(self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_download(self):
+        result = stream_document(self.url, self.store, NUMERO, '2023-00012345.pdf')
+        self.assertEqual(result['taille'], len(PDF_BODY))
+        self.assertEqual(result['sha1'], hashlib.sha1(PDF_BODY).hexdigest())
+        self.assertEqual(result['content_type'], 'application/pdf')
+        self.assertNotIn('type', result)
+        with open(result['emplacement'], 'rb') as f:
+            self.assertEqual(f.read(), PDF_BODY)
+
+    def test_already_stored(self):
+        first = stream_document(self.url, self.store, NUMERO, '2023-00012345.pdf')
+        second = stream_document(self.url, self.store, NUMERO, '2023-00012345.pdf')
+        self.assertEqual(second, {'emplacement': first['emplacement'], 'deja_present': True})
+
+    def test_too_large(self):
+        with self.assertRaises(DocumentTooLarge):
+            stream_document(self.url, self.store, NUMERO, '2023-00012345.pdf', max_bytes=1024)
+        # Ni document partiel ni fichier .part laissé sur disque
+        self.assertIsNone(self.store.exists(NUMERO, '2023-00012345.pdf'))
+        self.assertEqual(os.listdir(os.path.dirname(self.store.path(NUMERO, 'x'))), [])
+
+
+class ConsultParseTest(StandInServerMixin, unittest.TestCase):
+    def setUp(self):
+        from spiders import ConsultSpider
+        self.spider = ConsultSpider(numeros=[NUMERO])
+        self.spider.api_url = self.base_url + '/api/deposits?page={page}&size={size}&enterpriseNumber={numero}'
+        self.spider.document_urls = {'pdf': self.base_url + '/{id}.pdf', 'xbrl': self.base_url + '/{id}.xbrl'}
+        self.spider.page_size = DEPOSITS_PAGE_SIZE
+
+    def fetch(self, request):
+        """Réponse Scrapy construite à partir de la page servie par le serveur local"""
+        with urllib.request.urlopen(urllib.request.Request(request.url, headers={'Accept': 'application/json'})) as f:
+            return TextResponse(request.url, body=f.read(), encoding='utf-8', request=request)
+
+    def test_pages_followed_until_last(self):
+        request = self.spider.deposits_request(NUMERO, 0, [])
+        pages = 0
+        while request is not None:
+            pages += 1
+            results = list(self.spider.parse(self.fetch(request)))
+            self.assertEqual(len(results), 1)
+            request = results[0] if not isinstance(results[0], EntrepriseItem) else None
+        self.assertEqual(pages, 3)
+        item = results[0]
+        self.assertEqual(item['numero_entreprise'], NUMERO)
+        self.assertEqual([deposit['reference'] for deposit in item['comptes_annuels']],
+                         [deposit['reference'] for deposit in DEPOSITS])
+
+    def test_extract_deposit(self):
+        deposit = self.spider.extract_deposit(DEPOSITS[0])
+        self.assertEqual(deposit, {
+            'id': 'dep-0',
+            'reference': '2023-00000000',
+            'date_depot': '2023-07-01',
+            'exercice_debut': '2022-01-01',
+            'exercice_fin': '2022-12-31',
+            'modele': 'm02-f',
+            'langue': 'FR',
+            'documents': [
+                {'type': 'pdf', 'url': self.base_url + '/dep-0.pdf'},
+                {'type': 'xbrl', 'url': self.base_url + '/dep-0.xbrl'},
+            ],
+        })
+
+    def test_extract_deposit_without_id(self):
+        self.assertEqual(self.spider.extract_deposit({'reference': '2023-1'})['documents'], [])
+
+
+class ConsultDocumentsPipelineTest(StandInServerMixin, trial_unittest.TestCase):
+    """process_item complet : téléchargements dans le pool de threads, sous le réacteur"""
+
+    def setUp(self):
+        from main import ConsultDocumentsPipeline
+        from spiders import ConsultSpider
+        self.directory = tempfile.mkdtemp()
+        self.spider = ConsultSpider(numeros=[NUMERO])
+        self.pipeline = ConsultDocumentsPipeline(directory=self.directory)
+        self.pipeline.open_spider(self.spider)
+
+    def tearDown(self):
+        self.pipeline.close_spider(self.spider)
+        shutil.rmtree(self.directory)
+
+    def make_item(self):
+        documents = [{'type': 'pdf', 'url': self.base_url + '/dep-0.pdf'},
+                     {'type': 'xbrl', 'url': self.base_url + '/dep-0.xbrl'}]
+        return EntrepriseItem(numero_entreprise=NUMERO,
+                              comptes_annuels=[{'id': 'dep-0', 'reference': '2023-00000000', 'documents': documents}])
+
+    def test_documents_recorded(self):
+        from main import STORED_DOCUMENT_FIELDS
+
+        def check(item):
+            pdf, xbrl = item['comptes_annuels'][0]['documents']
+            self.assertEqual(pdf['type'], 'pdf')
+            self.assertEqual(set(pdf) - {'type', 'url'}, set(STORED_DOCUMENT_FIELDS))
+            self.assertEqual(pdf['content_type'], 'application/pdf')
+            self.assertEqual(pdf['sha1'], hashlib.sha1(PDF_BODY).hexdigest())
+            self.assertTrue(os.path.exists(pdf['emplacement']))
+            # 404 : document marqué indisponible, sans erreur ni échec compté
+            self.assertEqual(xbrl, {'type': 'xbrl', 'url': self.base_url + '/dep-0.xbrl', 'disponible': False})
+            self.assertEqual(self.pipeline.scraping_stats.documents_downloaded, 1)
+            self.assertEqual(self.pipeline.scraping_stats.documents_failed, 0)
+
+        return self.pipeline.process_item(self.make_item(), self.spider).addCallback(check)
+
+    def test_already_stored_not_downloaded_again(self):
+        def second_pass(first):
+            location = first['comptes_annuels'][0]['documents'][0]['emplacement']
+            d = self.pipeline.process_item(self.make_item(), self.spider)
+            d.addCallback(check, location)
+            return d
+
+        def check(item, location):
+            pdf = item['comptes_annuels'][0]['documents'][0]
+            self.assertEqual(pdf, {'type': 'pdf', 'url': self.base_url + '/dep-0.pdf', 'emplacement': location})
+            self.assertEqual(self.pipeline.scraping_stats.documents_downloaded, 1)
+
+        return self.pipeline.process_item(self.make_item(), self.spider).addCallback(second_pass)
+
+
+class DownloadSuccessTest(unittest.TestCase):
+    def setUp(self):
+        from main import ConsultDocumentsPipeline
+        self.pipeline = ConsultDocumentsPipeline()
+
+    def test_keeps_document_type(self):
+        document = {'type': 'pdf', 'url': 'https://consult.cbso.nbb.be/document.pdf'}
+        self.pipeline._download_success({'emplacement': 'documents/701/0403170701/a.pdf', 'taille': 10,
+                                         'sha1': 'abc', 'content_type': 'application/pdf'}, document)
+        self.assertEqual(document['type'], 'pdf')
+        self.assertEqual(document['content_type'], 'application/pdf')
+        self.assertEqual(document['taille'], 10)
+
+    def test_already_stored_not_copied(self):
+        document = {'type': 'xbrl'}
+        self.pipeline._download_success({'emplacement': 'documents/701/0403170701/a.xbrl', 'deja_present': True}, document)
+        self.assertEqual(document, {'type': 'xbrl', 'emplacement': 'documents/701/0403170701/a.xbrl'})
+
+
+if __name__ == '__main__':
+    unittest.main()
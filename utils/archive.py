@@ -0,0 +1,124 @@
+import glob
+import gzip
+import json
+import os
+import re
+import zlib
+from datetime import datetime
+
+from utils.debug_color import get_logger
+
+logger = get_logger('archive')
+
+SEGMENT_SUFFIX = '.jsonl.gz'
+INDEX_SUFFIX = '.idx'
+# Fin du nom d'un segment : <spider>-<pid>-<AAAAmmjj-HHMMSS>-<n° du segment dans le crawl>
+SEGMENT_NAME_RE = re.compile(r'-(\d{8}-\d{6})-(\d+)' + re.escape(SEGMENT_SUFFIX) + '$')
+
+
+class ArchiveWriter:
+    """Archive brute des réponses en segments JSONL compressés, avec index par numéro d'entreprise.
+
+    Chaque enregistrement est un membre gzip indépendant : le segment reste un .jsonl.gz
+    lisible d'un bloc (zcat), et l'index "<numero> <offset> <longueur>" permet de relire
+    un enregistrement seul sans décompresser le reste. Un nouveau segment est ouvert dès
+    que le segment courant dépasse segment_bytes.
+    """
+
+    def __init__(self, directory, prefix, segment_bytes=256 * 1024 ** 2, compresslevel=6):
+        self.directory = directory
+        self.prefix = prefix
+        self.segment_bytes = segment_bytes
+        self.compresslevel = compresslevel
+        self.segment = None
+        self.index = None
+        self.segment_path = None
+        self.segment_count = 0
+        self.records = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def open_segment(self):
+        self.close()
+        self.segment_count += 1
+        name = f"{self.prefix}-{datetime.now():%Y%m%d-%H%M%S}-{self.segment_count:05d}"
+        self.segment_path = os.path.join(self.directory, name + SEGMENT_SUFFIX)
+        self.segment = open(self.segment_path, 'ab')
+        self.index = open(os.path.join(self.directory, name + INDEX_SUFFIX), 'a', encoding='ascii')
+
+    def write(self, record, numero=None):
+        if self.segment is None or self.segment.tell() >= self.segment_bytes:
+            self.open_segment()
+        data = gzip.compress(json.dumps(record, ensure_ascii=False).encode('utf-8') + b'\n',
+                             compresslevel=self.compresslevel)
+        offset = self.segment.tell()
+        self.segment.write(data)
+        if numero:
+            self.index.write(f"{numero} {offset} {len(data)}\n")
+        self.records += 1
+
+    def close(self):
+        if self.segment is None:
+            return
+        self.segment.close()
+        self.index.close()
+        self.segment = self.index = None
+
+
+def segment_order(segment_path):
+    """Clé de tri chronologique : date d'ouverture puis rang du segment, quels que soient le
+    spider et le pid en tête du nom"""
+    match = SEGMENT_NAME_RE.search(os.path.basename(segment_path))
+    if match is None:
+        return ('', 0, segment_path)
+    return (match.group(1), int(match.group(2)), segment_path)
+
+
+def list_segments(directory):
+    """Segments de l'archive, du plus ancien au plus récent"""
+    return sorted(glob.glob(os.path.join(directory, '*' + SEGMENT_SUFFIX)), key=segment_order)
+
+
+def index_path(segment_path):
+    return segment_path[:-len(SEGMENT_SUFFIX)] + INDEX_SUFFIX
+
+
+def read_record(f, offset, length):
+    """Relire un enregistrement à partir de sa position dans le segment ouvert f"""
+    f.seek(offset)
+    # wbits 31 : un membre gzip complet (en-tête + données + CRC)
+    return json.loads(zlib.decompress(f.read(length), 31))
+
+
+def iter_segment(segment_path):
+    """Parcourir tous les enregistrements d'un segment, dans l'ordre d'écriture"""
+    with gzip.open(segment_path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            yield json.loads(line)
+
+
+def load_latest_offsets(directory):
+    """Dernière version archivée de chaque entreprise : {segment: [(offset, longueur), ...]} trié par offset.
+
+    Les segments sont parcourus dans l'ordre chronologique (date dans leur nom), la dernière
+    entrée d'un numéro l'emporte.
+    """
+    latest = {}
+    for segment_path in list_segments(directory):
+        path = index_path(segment_path)
+        if not os.path.exists(path):
+            logger.warning("Index absent pour %s, segment ignoré", segment_path)
+            continue
+        with open(path, 'r', encoding='ascii') as f:
+            for line in f:
+                parts = line.split()
+                # Une ligne tronquée par un arrêt brutal est simplement ignorée
+                if len(parts) != 3 or not parts[0].isdigit():
+                    continue
+                latest[int(parts[0])] = (segment_path, int(parts[1]), int(parts[2]))
+
+    by_segment = {}
+    for segment_path, offset, length in latest.values():
+        by_segment.setdefault(segment_path, []).append((offset, length))
+    for offsets in by_segment.values():
+        offsets.sort()
+    return by_segment
@@ -0,0 +1,106 @@
+import glob
+import os
+import time
+
+from utils.debug_color import get_logger
+
+logger = get_logger('checkpoint')
+
+# Statuts enregistrés dans le journal
+COMPLETED = 'C'
+FAILED = 'F'
+
+
+def worker_checkpoint_path(path, worker_index):
+    """Journal propre à un worker du lanceur multi-processus : kbo_checkpoint.log → kbo_checkpoint.w2.log"""
+    root, ext = os.path.splitext(path)
+    return f"{root}.w{worker_index}{ext}"
+
+
+def checkpoint_family(path):
+    """Journal principal et journaux des workers : relus ensemble quel que soit le nombre de workers"""
+    root, ext = os.path.splitext(path)
+    if '.w' in os.path.basename(root):
+        root = root.rsplit('.w', 1)[0]
+    paths = [f"{root}{ext}"] + sorted(glob.glob(f"{glob.escape(root)}.w*{ext}"))
+    return [p for p in paths if os.path.exists(p)]
+
+
+class CrawlCheckpoint:
+    """Journal append-only des numéros d'entreprise terminés ou en échec.
+
+    Chaque ligne vaut "<statut> <numero>". Le journal est relu au démarrage dans
+    deux ensembles d'entiers (recherche en O(1)) et n'est synchronisé sur disque
+    (fsync) que toutes les fsync_interval secondes. Les journaux des workers
+    (kbo_checkpoint.wN.log) sont relus avec le journal principal : une reprise
+    reste valable si le nombre de workers change.
+    """
+
+    def __init__(self, path, fsync_interval=5.0, skip_failed=False):
+        self.path = path
+        self.fsync_interval = fsync_interval
+        self.skip_failed = skip_failed
+        self.completed = set()
+        self.failed = set()
+        self.load()
+        self.file = open(path, 'a', encoding='ascii')
+        self.last_sync = time.monotonic()
+
+    def load(self):
+        paths = checkpoint_family(self.path)
+        if not paths:
+            return
+        started = time.monotonic()
+        for path in paths:
+            self.load_file(path)
+        logger.info("Checkpoint %s: %s terminées, %s en échec (%s journaux chargés en %.2fs)",
+                    self.path, len(self.completed), len(self.failed), len(paths), time.monotonic() - started)
+
+    def load_file(self, path):
+        with open(path, 'r', encoding='ascii', errors='ignore') as f:
+            for line in f:
+                # Une ligne tronquée par un arrêt brutal est simplement ignorée
+                parts = line.split()
+                if len(parts) != 2 or not parts[1].isdigit():
+                    continue
+                status, numero = parts[0], int(parts[1])
+                if status == COMPLETED:
+                    self.completed.add(numero)
+                    self.failed.discard(numero)
+                elif status == FAILED and numero not in self.completed:
+                    self.failed.add(numero)
+
+    def is_done(self, numero):
+        numero = int(numero)
+        return numero in self.completed or (self.skip_failed and numero in self.failed)
+
+    def mark_completed(self, numero):
+        numero = int(numero)
+        if numero in self.completed:
+            return
+        self.completed.add(numero)
+        self.failed.discard(numero)
+        self._write(COMPLETED, numero)
+
+    def mark_failed(self, numero):
+        numero = int(numero)
+        if numero in self.completed:
+            return
+        self.failed.add(numero)
+        self._write(FAILED, numero)
+
+    def _write(self, status, numero):
+        self.file.write(f"{status} {numero:010d}\n")
+        if time.monotonic() - self.last_sync >= self.fsync_interval:
+            self.sync()
+
+    def sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.last_sync = time.monotonic()
+
+    def close(self):
+        if self.file.closed:
+            return
+        self.sync()
+        self.file.close()
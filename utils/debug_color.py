@@ -1,3 +1,7 @@
+import atexit
+import logging
+import logging.handlers
+import queue
 import sys
 
 # Définition des couleurs ANSI
@@ -10,41 +14,125 @@ class Colors:
     MAGENTA = '\033[95m'
     CYAN = '\033[96m'
 
-def debug_print(message, level="info", end='\n', file=sys.stdout):
-    color_map = {
-        "info": Colors.BLUE,
-        "success": Colors.GREEN,
-        "warning": Colors.YELLOW,
-        "error": Colors.RED,
-        "debug": Colors.MAGENTA,
-        "fetch": Colors.CYAN,
-    }
+# Niveaux propres au projet, intercalés entre les niveaux standard de logging
+FETCH = 15
+SUCCESS = 25
+logging.addLevelName(FETCH, 'FETCH')
+logging.addLevelName(SUCCESS, 'SUCCESS')
 
-    color = color_map.get(level.lower(), Colors.RESET)
-    prefix = f"[{level.upper()}] "
+LEVELS = {
+    "debug": logging.DEBUG,
+    "fetch": FETCH,
+    "info": logging.INFO,
+    "success": SUCCESS,
+    "warning": logging.WARNING,
+    "error": logging.ERROR,
+}
 
-    lines = str(message).splitlines()
-    if not lines:
-        print(f"{color}{prefix}{Colors.RESET}", end=end, file=file)
-        return
+COLOR_MAP = {
+    logging.INFO: Colors.BLUE,
+    SUCCESS: Colors.GREEN,
+    logging.WARNING: Colors.YELLOW,
+    logging.ERROR: Colors.RED,
+    logging.DEBUG: Colors.MAGENTA,
+    FETCH: Colors.CYAN,
+}
 
-    print(f"{color}{prefix}{lines[0]}{Colors.RESET}", file=file)
-    for line in lines[1:]:
-        print(f"{color}{' ' * (len(prefix))}{line}{Colors.RESET}", file=file)
+# Logger racine du projet (ne se propage pas vers le handler racine installé par Scrapy)
+LOGGER_NAME = 'ipssi'
 
-    if end != '\n' and len(lines) > 1:
-         print("", end=end, file=file)
-    elif end != '\n' and len(lines) == 1:
-         pass
-    elif end == '\n' and len(lines) > 1:
-         pass
+_listener = None
+
+
+class ColorFormatter(logging.Formatter):
+    """Rendu historique de debug_print : "[NIVEAU] message", coloré, lignes suivantes indentées"""
+
+    def __init__(self, colored=True):
+        super().__init__()
+        self.colored = colored
+
+    def format(self, record):
+        message = record.getMessage()
+        if record.exc_info:
+            message = f"{message}\n{self.formatException(record.exc_info)}"
+        prefix = f"[{record.levelname}] "
+        color = COLOR_MAP.get(record.levelno, Colors.RESET) if self.colored else ''
+        reset = Colors.RESET if self.colored else ''
+
+        lines = message.splitlines() or ['']
+        output = [f"{color}{prefix}{lines[0]}{reset}"]
+        output.extend(f"{color}{' ' * len(prefix)}{line}{reset}" for line in lines[1:])
+        return '\n'.join(output)
+
+
+class ProjectLogger(logging.LoggerAdapter):
+    """Logger avec les niveaux success() et fetch() ; les arguments ne sont formatés que si le niveau est actif"""
+
+    def success(self, msg, *args, **kwargs):
+        self.log(SUCCESS, msg, *args, **kwargs)
+
+    def fetch(self, msg, *args, **kwargs):
+        self.log(FETCH, msg, *args, **kwargs)
+
+
+def get_logger(name=None):
+    return ProjectLogger(logging.getLogger(f"{LOGGER_NAME}.{name}" if name else LOGGER_NAME), {})
+
+
+def setup_logging(level="info", colored=True, stream=None, use_queue=True):
+    """(Re)configurer la sortie console du projet.
+
+    Avec use_queue, les messages passent par une file et sont écrits par un thread dédié :
+    le thread appelant (réacteur Twisted) ne fait jamais d'écriture console.
+    """
+    global _listener
+    logger = logging.getLogger(LOGGER_NAME)
+    logger.setLevel(LEVELS.get(level.lower(), logging.INFO) if isinstance(level, str) else level)
+    logger.propagate = False
+
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+
+    console = logging.StreamHandler(stream or sys.stdout)
+    console.setFormatter(ColorFormatter(colored))
+    if use_queue:
+        log_queue = queue.SimpleQueue()
+        logger.addHandler(logging.handlers.QueueHandler(log_queue))
+        _listener = logging.handlers.QueueListener(log_queue, console)
+        _listener.start()
+    else:
+        logger.addHandler(console)
+    return logger
+
+
+def shutdown_logging():
+    """Vider la file des messages en attente (appelé automatiquement à la sortie)"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(shutdown_logging)
+
+_logger = get_logger()
+if not logging.getLogger(LOGGER_NAME).handlers:
+    setup_logging()
+
+
+def debug_print(message, level="info"):
+    _logger.log(LEVELS.get(level.lower(), logging.INFO), "%s", message)
 
 
 if __name__ == '__main__':
+    setup_logging("debug")
     debug_print("Ceci est une information.", level="info")
     debug_print("Opération réussie !", level="success")
     debug_print("Attention, quelque chose d'inattendu.", level="warning")
     debug_print("Une erreur critique est survenue.", level="error")
     debug_print("Variable x = 10", level="debug")
     debug_print("Récupération de la page...", level="fetch")
-    debug_print("Message\nsur\nplusieurs lignes.", level="info")
\ No newline at end of file
+    debug_print("Message\nsur\nplusieurs lignes.", level="info")
@@ -0,0 +1,121 @@
+import hashlib
+import os
+import re
+import urllib.request
+
+# Taille des blocs lus sur le réseau puis écrits : la mémoire utilisée ne dépend pas de la taille du fichier
+CHUNK_SIZE = 64 * 1024
+
+
+class DocumentTooLarge(Exception):
+    pass
+
+
+def safe_filename(name):
+    return re.sub(r'[^A-Za-z0-9._-]+', '_', name).strip('._') or 'document'
+
+
+class FileDocumentStore:
+    """Documents rangés sur disque : <racine>/<3 derniers chiffres>/<numero>/<nom>"""
+
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, numero, filename):
+        return os.path.join(self.root, numero[-3:], numero, safe_filename(filename))
+
+    def exists(self, numero, filename):
+        path = self.path(numero, filename)
+        return path if os.path.exists(path) else None
+
+    def open(self, numero, filename, metadata):
+        return FileSink(self.path(numero, filename))
+
+
+class FileSink:
+    """Écriture dans un fichier .part renommé à la fin : un document présent est toujours complet"""
+
+    def __init__(self, path):
+        self.location = path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.file = open(f"{path}.part", 'wb')
+
+    def write(self, chunk):
+        self.file.write(chunk)
+
+    def commit(self):
+        self.file.close()
+        os.replace(self.file.name, self.location)
+        return self.location
+
+    def abort(self):
+        self.file.close()
+        os.remove(self.file.name)
+
+
+class GridFSDocumentStore:
+    """Documents stockés dans GridFS (découpés en blocs par MongoDB), nom "<numero>/<nom>" """
+
+    def __init__(self, database, bucket_name='comptes_annuels'):
+        import gridfs
+        self.bucket = gridfs.GridFSBucket(database, bucket_name=bucket_name)
+
+    def exists(self, numero, filename):
+        found = next(iter(self.bucket.find({'filename': f"{numero}/{safe_filename(filename)}"}).limit(1)), None)
+        return str(found._id) if found is not None else None
+
+    def open(self, numero, filename, metadata):
+        return GridFSSink(self.bucket.open_upload_stream(f"{numero}/{safe_filename(filename)}",
+                                                         chunk_size_bytes=255 * 1024, metadata=metadata))
+
+
+class GridFSSink:
+    def __init__(self, stream):
+        self.stream = stream
+        self.location = str(stream._id)
+
+    def write(self, chunk):
+        self.stream.write(chunk)
+
+    def commit(self):
+        self.stream.close()
+        return self.location
+
+    def abort(self):
+        self.stream.abort()
+
+
+def stream_document(url, store, numero, filename, headers=None, timeout=60, max_bytes=0, metadata=None):
+    """Télécharger un document bloc par bloc vers le stockage (à appeler depuis un thread).
+
+    Renvoie {'emplacement', 'taille', 'sha1', 'content_type'} ; un document déjà stocké n'est pas
+    retéléchargé (renvoie {'emplacement', 'deja_present': True}).
+    """
+    existing = store.exists(numero, filename)
+    if existing:
+        return {'emplacement': existing, 'deja_present': True}
+
+    request = urllib.request.Request(url, headers=headers or {})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        sink = store.open(numero, filename, dict(metadata or {}, url=url))
+        digest = hashlib.sha1()
+        size = 0
+        try:
+            while True:
+                chunk = response.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if max_bytes and size > max_bytes:
+                    raise DocumentTooLarge(f"{url} dépasse {max_bytes} octets")
+                digest.update(chunk)
+                sink.write(chunk)
+        except BaseException:
+            sink.abort()
+            raise
+        return {
+            'emplacement': sink.commit(),
+            'taille': size,
+            'sha1': digest.hexdigest(),
+            'content_type': response.headers.get('Content-Type'),
+        }
@@ -0,0 +1,57 @@
+import csv
+import zlib
+from itertools import islice
+
+from utils.debug_color import get_logger
+
+logger = get_logger('enterprise_source')
+
+# Fichier d'entrée par défaut (extrait du dump open data de la BCE)
+DEFAULT_INPUT_FILE = 'enterprise_cropped.csv'
+
+
+def clean_numero(numero):
+    """Normaliser un numéro d'entreprise : 10 chiffres sans guillemets ni points"""
+    return numero.strip().strip('"').replace('.', '')
+
+
+def shard_of(numero, shard_count):
+    """Shard d'un numéro, stable quel que soit l'ordre ou le découpage du fichier"""
+    return zlib.crc32(clean_numero(numero).encode('ascii')) % shard_count
+
+
+def iter_enterprise_rows(path=DEFAULT_INPUT_FILE, offset=0, limit=None, shard_index=0, shard_count=1):
+    """Lire le CSV des entreprises ligne par ligne et produire des couples (numero, ligne).
+
+    offset/limit s'appliquent aux lignes de données du fichier (en-tête exclu),
+    le filtre de shard est appliqué ensuite. Le fichier n'est jamais chargé en mémoire.
+    """
+    offset = int(offset or 0)
+    limit = int(limit) if limit not in (None, '') else None
+    shard_index = int(shard_index or 0)
+    shard_count = int(shard_count or 1)
+
+    with open(path, 'r', newline='', encoding='utf-8') as f:
+        csv_reader = csv.reader(f)
+        header = next(csv_reader, None)  # Ignorer l'en-tête
+        if header is None:
+            return
+        header = [column.strip('"') for column in header]
+
+        stop = offset + limit if limit is not None else None
+        for row in islice(csv_reader, offset, stop):
+            if not row or not row[0].strip('"'):
+                continue
+            numero = clean_numero(row[0])
+            if shard_count > 1 and shard_of(numero, shard_count) != shard_index:
+                continue
+            yield numero, dict(zip(header, row))
+
+
+def iter_numeros_entreprise(path=DEFAULT_INPUT_FILE, offset=0, limit=None, shard_index=0, shard_count=1):
+    """Variante de iter_enterprise_rows qui ne produit que les numéros"""
+    try:
+        for numero, _ in iter_enterprise_rows(path, offset, limit, shard_index, shard_count):
+            yield numero
+    except FileNotFoundError:
+        logger.error("Fichier d'entrée introuvable: %s", path)
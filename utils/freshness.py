@@ -0,0 +1,86 @@
+import hashlib
+import json
+import time
+from datetime import datetime, timezone
+
+from items import to_plain
+from utils.debug_color import get_logger
+
+logger = get_logger('freshness')
+
+# Métadonnées de fraîcheur : exclues du calcul du hash
+FRESHNESS_FIELDS = ('content_hash', 'last_crawled')
+
+
+def compute_content_hash(item):
+    """Hash stable du contenu extrait d'une entreprise (indépendant de l'ordre des clés)"""
+    data = {key: value for key, value in item.items() if key not in FRESHNESS_FIELDS}
+    payload = json.dumps(data, sort_keys=True, ensure_ascii=False, default=to_plain)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+def utc_now():
+    return datetime.now(timezone.utc)
+
+
+class FreshnessIndex:
+    """État connu en base pour chaque entreprise : (content_hash, last_crawled en timestamp).
+
+    Chargé en une seule requête au démarrage plutôt qu'une requête par item.
+    """
+
+    def __init__(self):
+        self.entries = {}
+
+    @classmethod
+    def load(cls, collection, batch_size=10000):
+        index = cls()
+        started = time.monotonic()
+        cursor = collection.find(
+            {'content_hash': {'$exists': True}},
+            {'_id': 0, 'numero_entreprise': 1, 'content_hash': 1, 'last_crawled': 1},
+            batch_size=batch_size,
+        )
+        for document in cursor:
+            last_crawled = document.get('last_crawled')
+            if isinstance(last_crawled, datetime):
+                if last_crawled.tzinfo is None:
+                    last_crawled = last_crawled.replace(tzinfo=timezone.utc)
+                last_crawled = last_crawled.timestamp()
+            else:
+                last_crawled = None
+            index.entries[document['numero_entreprise']] = (document.get('content_hash'), last_crawled)
+        logger.info("Index de fraîcheur chargé: %s entreprises en %.2fs", len(index.entries), time.monotonic() - started)
+        return index
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get_hash(self, numero):
+        entry = self.entries.get(numero)
+        return entry[0] if entry else None
+
+    def crawled_at(self, numero):
+        """Date du dernier crawl (timestamp), None si l'entreprise n'a jamais été crawlée"""
+        entry = self.entries.get(numero)
+        return entry[1] if entry else None
+
+    def is_fresh(self, numero, ttl, now=None):
+        """Vrai si l'entreprise a été crawlée il y a moins de ttl secondes"""
+        entry = self.entries.get(numero)
+        if not entry or entry[1] is None:
+            return False
+        now = time.time() if now is None else now
+        return now - entry[1] < ttl
+
+
+def load_latest_publications(collection, batch_size=10000):
+    """Date (AAAA-MM-JJ) de la dernière publication eJustice enregistrée pour chaque entreprise"""
+    started = time.monotonic()
+    cursor = collection.aggregate([
+        {'$match': {'publications.date': {'$type': 'string'}}},
+        {'$project': {'_id': 0, 'numero_entreprise': 1, 'latest': {'$max': '$publications.date'}}},
+    ], batchSize=batch_size)
+    latest = {document['numero_entreprise']: document['latest'] for document in cursor if document.get('latest')}
+    logger.info("Dernières publications chargées: %s entreprises en %.2fs", len(latest), time.monotonic() - started)
+    return latest
@@ -0,0 +1,60 @@
+from utils.kbo_selectors import SECTION_TITLES
+
+
+def is_section_header(row):
+    """Une ligne d'en-tête de section KBO : <tr><td class="I"><h2>Titre</h2></td></tr>"""
+    for cell in row:
+        if cell.tag == 'td' and cell.get('class') == 'I' and cell.find('h2') is not None:
+            return True
+    return False
+
+
+class SectionIndex:
+    """Index des sections d'une page KBO : titre du h2 → lignes <tr> de la section.
+
+    La page est parcourue une seule fois : chaque en-tête td.I > h2 est suivi de
+    ses lignes sœurs jusqu'à l'en-tête suivant. Les tableaux imbriqués (NACE 2008
+    et 2003 cachés) ont leurs propres en-têtes et sont indexés de la même façon.
+    """
+
+    def __init__(self, response):
+        self.sections = {}
+        # Racine lxml de la page, pour les recherches hors section (tableau des fonctions caché)
+        self.root = root = response.selector.root
+        for h2 in SECTION_TITLES(root):
+            header_row = h2.getparent().getparent()
+            title = ' '.join(h2.text_content().split())
+            if title in self.sections:
+                continue  # La première occurrence l'emporte, comme avec les XPath d'origine
+
+            rows = []
+            row = header_row.getnext()
+            while row is not None and not is_section_header(row):
+                if row.tag == 'tr':
+                    rows.append(row)
+                row = row.getnext()
+            self.sections[title] = (header_row, rows)
+
+    def find_title(self, title, partial=False):
+        if title in self.sections:
+            return title
+        if partial:
+            for candidate in self.sections:
+                if title in candidate:
+                    return candidate
+        return None
+
+    def has(self, title, partial=False):
+        return self.find_title(title, partial) is not None
+
+    def rows(self, title, partial=False):
+        """Lignes <tr> (éléments lxml) de la section, liste vide si la section est absente"""
+        found = self.find_title(title, partial)
+        if found is None:
+            return []
+        return self.sections[found][1]
+
+    def first_row(self, title, partial=False):
+        """Équivalent de following-sibling::tr[1] sur l'en-tête de section, None si absente"""
+        rows = self.rows(title, partial)
+        return rows[0] if rows else None
@@ -0,0 +1,79 @@
+from lxml import etree
+
+
+def compile_xpath(expression):
+    """XPath compilé une seule fois, évalué directement sur un élément lxml.
+
+    smart_strings=False : les textes sont des str simples, sans référence vers l'arbre
+    (comme ceux renvoyés par parsel).
+    """
+    return etree.XPath(expression, smart_strings=False)
+
+
+# Découpage de la page en sections
+SECTION_TITLES = compile_xpath('//tr/td[@class="I"]/h2')
+
+# Textes d'une ligne ou d'une cellule
+TEXTS = compile_xpath('.//text()')
+OWN_TEXT = compile_xpath('text()')
+TEXTS_OUTSIDE_UPD = compile_xpath('.//text()[not(ancestor::span[@class="upd"])]')
+UPD_TEXT = compile_xpath('.//span[@class="upd"]/text()')
+
+# Lignes et cellules
+CELLS = compile_xpath('./td')
+ROWS = compile_xpath('.//tr')
+NESTED_ROWS = compile_xpath('.//table//tr')
+FIRST_CELL_TEXT = compile_xpath('./td[1]/text()')
+FIRST_CELL_TEXTS = compile_xpath('./td[1]//text()')
+SECOND_CELL_TEXTS = compile_xpath('./td[2]//text()')
+NBSP_CELLS = compile_xpath('./td[contains(text(), "&nbsp;")]')
+VALUE_TEXTS = compile_xpath('./td[position()>1]//text()')
+
+# Généralités : clé dans une cellule QL/RL, valeur dans les cellules suivantes
+KEY_CELL_TEXT = compile_xpath('./td[contains(@class, "QL") or contains(@class, "RL")]/text()')
+ACTIVE_VALUE = compile_xpath('./td[position()>1]//span[@class="pageactief"]/text()')
+STRONG_VALUE = compile_xpath('./td[position()>1]/strong/text()')
+FIRST_VALUE_TEXT = compile_xpath('./td[position()>1]/text()[1]')
+VALUE_UPD_TEXT = compile_xpath('./td[position()>1]//span[@class="upd"]/text()')
+ADDRESS_TEXTS = compile_xpath('./td[position()>1]//text()[not(parent::span[@class="upd"])]')
+
+# Fonctions : tableau visible, caché, ou ligne suivant le compteur
+FONCTIONS_COUNT = compile_xpath('.//span[@id="klikfctie"]/text()')
+FONCTIONS_TABLE = compile_xpath('.//table[@id="toonfctie"]')
+FONCTIONS_TABLE_ANY = compile_xpath('//table[contains(@id, "toonfctie")]')
+FONCTIONS_TABLE_AFTER_COUNT = compile_xpath('//tr[td/span[@id="klikfctie"]]/following-sibling::tr[1]//table')
+
+# Liens et codes NACE
+EXTERNAL_LINKS = compile_xpath('.//a[@class="external"]')
+HREF = compile_xpath('@href')
+NACE_CODE_LINK = compile_xpath('.//a[contains(@href, "nace.code=")]/text()')
+
+
+def first(xpath, element):
+    """Premier résultat ou None, comme .get() de parsel"""
+    result = xpath(element)
+    return result[0] if result else None
+
+
+def first_of(xpath, elements):
+    """Premier résultat sur une liste d'éléments, comme .get() sur une SelectorList"""
+    for element in elements:
+        result = xpath(element)
+        if result:
+            return result[0]
+    return None
+
+
+def all_of(xpath, elements):
+    """Résultats concaténés sur une liste d'éléments, comme .xpath() sur une SelectorList"""
+    return [result for element in elements for result in xpath(element)]
+
+
+def text(element):
+    """Texte complet d'un élément, comme ''.join(sel.xpath('.//text()').getall())"""
+    return ''.join(TEXTS(element))
+
+
+def compiled_xpaths():
+    """{nom: XPath compilé} de ce module (utilisé par le benchmark)"""
+    return {name: value for name, value in globals().items() if isinstance(value, etree.XPath)}
@@ -0,0 +1,59 @@
+import time
+from datetime import datetime
+
+# Paliers de priorité : chaque palier est un passage complet sur le fichier d'entrée,
+# du plus prioritaire au moins prioritaire
+PRIORITY_TIERS = 4
+# Score maximal de enterprise_priority, pour répartir les scores entre les paliers
+MAX_PRIORITY = 200
+
+# Situation juridique "normale" : les autres codes (faillite, liquidation, dissolution...) passent après
+NORMAL_SITUATION = '000'
+# TypeOfEnterprise 2 : personne morale (fiche KBO plus riche que pour une personne physique)
+LEGAL_PERSON = '2'
+
+
+def parse_start_date(value):
+    """Date de début du dump open data (JJ-MM-AAAA) en timestamp, None si absente ou invalide"""
+    try:
+        return datetime.strptime(value.strip('"'), '%d-%m-%Y').timestamp()
+    except (AttributeError, ValueError):
+        return None
+
+
+def enterprise_priority(row, crawled_at=None, now=None):
+    """Score de priorité d'une entreprise (0 à MAX_PRIORITY, plus haut = crawlé plus tôt).
+
+    row est la ligne du CSV (colonnes Status, JuridicalSituation, TypeOfEnterprise, StartDate),
+    crawled_at la date du dernier crawl connu en base (timestamp) ou None si jamais crawlée.
+    """
+    now = time.time() if now is None else now
+    score = 0
+    if row.get('Status', '').strip('"') == 'AC':
+        score += 80
+    if row.get('JuridicalSituation', '').strip('"') == NORMAL_SITUATION:
+        score += 30
+    if row.get('TypeOfEnterprise', '').strip('"') == LEGAL_PERSON:
+        score += 20
+
+    # Entreprise récente : fiche encore susceptible de changer souvent
+    started = parse_start_date(row.get('StartDate'))
+    if started is not None:
+        age_days = (now - started) / 86400
+        if age_days < 365:
+            score += 20
+        elif age_days < 5 * 365:
+            score += 10
+
+    # Jamais crawlée : en tête de son palier ; sinon d'autant plus prioritaire que la donnée est ancienne
+    if crawled_at is None:
+        score += 50
+    else:
+        score += min(50, int((now - crawled_at) / (7 * 86400)))
+    return score
+
+
+def priority_tier(priority, tiers=PRIORITY_TIERS):
+    """Palier d'un score : 0 pour les scores les plus hauts, tiers - 1 pour les plus bas"""
+    tier = (MAX_PRIORITY - min(max(priority, 0), MAX_PRIORITY)) * tiers // (MAX_PRIORITY + 1)
+    return min(tier, tiers - 1)